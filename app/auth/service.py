@@ -1,29 +1,173 @@
-from typing import Optional
+import asyncio
+import json
+import logging
+import re
+from typing import Dict, Optional
 
+from app import metrics
 from app.auth.models import User
+from app.config import get_settings
 from app.services.filemaker import FileMakerService
 from app.services import redis as redis_svc
+from app.services import cache
+from app.exceptions import ServicioNoDisponibleError
+
+logger = logging.getLogger(__name__)
+
+# Hash Redis con el directorio completo (telefono normalizado -> User JSON)
+_DIRECTORIO_KEY = "auth:directory"
+
+# Directorio en memoria del proceso (telefono normalizado -> User)
+_directorio: Dict[str, User] = {}
+
+_refresh_task: Optional[asyncio.Task] = None
+
+
+def _normalizar(phone: str) -> str:
+    """Deja solo digitos para que '+56 9 1234 5678' y '56912345678' coincidan."""
+    return re.sub(r"\D", "", phone)
+
+
+def _negativo_key(clave: str) -> str:
+    return f"auth:unknown:{clave}"
+
+
+# Prefijo de invalidacion: "auth:user:<telefono>" o "auth:user:*" (todo el directorio)
+_INVALIDACION_PREFIJO = "auth:user:"
+
+
+def _descartar_local(clave_cache: str):
+    """Descarta del directorio en memoria lo invalidado por otro worker."""
+    clave = clave_cache[len(_INVALIDACION_PREFIJO):]
+    if clave == "*":
+        _directorio.clear()
+    else:
+        _directorio.pop(clave, None)
+
+
+cache.on_invalidate(_INVALIDACION_PREFIJO, _descartar_local)
 
 
 class AuthService:
     @classmethod
+    @metrics.medir(metrics.AUTH_LATENCIA)
     async def get_user_by_phone(cls, phone: str) -> Optional[User]:
         """
-        Obtiene usuario por numero de telefono con cache en Redis.
-        Usuarios cacheados por 5 minutos para reducir llamadas a FileMaker.
+        Obtiene usuario por numero de telefono.
+
+        Orden de resolucion:
+            1. Directorio en memoria (precargado al iniciar y refrescado periodicamente)
+            2. Hash Redis compartido (cargado por cualquier worker)
+            3. Entrada negativa (telefono desconocido consultado hace poco)
+            4. Busqueda en FileMaker (el resultado se cachea, positivo o negativo)
         """
-        cached = await redis_svc.get_json(f"auth:user:{phone}")
-        if cached:
-            return User(**cached)
+        clave = _normalizar(phone)
+
+        user = _directorio.get(clave)
+        if user:
+            return user.model_copy(update={"phone": phone})
+
+        raw = await redis_svc.hget(_DIRECTORIO_KEY, clave)
+        if raw:
+            user = User(**json.loads(raw))
+            _directorio[clave] = user
+            return user.model_copy(update={"phone": phone})
+
+        if await redis_svc.get(_negativo_key(clave)):
+            logger.debug("Telefono %s en cache negativa, omitiendo FileMaker", phone)
+            return None
 
         user = await FileMakerService.get_user_by_phone(phone)
 
         if user:
-            await redis_svc.set_json(f"auth:user:{phone}", user.model_dump(), ttl=300)
+            _directorio[clave] = user
+            await redis_svc.hset(_DIRECTORIO_KEY, clave, user.model_dump_json())
+        else:
+            settings = get_settings()
+            await redis_svc.set(_negativo_key(clave), "1", ttl=settings.AUTH_NEGATIVE_TTL_SECONDS)
 
         return user
 
+    @classmethod
+    async def cargar_directorio(cls) -> int:
+        """
+        Carga el directorio completo de usuarios desde FileMaker a memoria y Redis.
+        Si FileMaker no responde, usa el ultimo directorio guardado en Redis.
+
+        Returns:
+            Cantidad de usuarios cargados.
+        """
+        try:
+            usuarios = await FileMakerService.get_all_users()
+        except ServicioNoDisponibleError as e:
+            logger.warning("No se pudo cargar el directorio desde FileMaker: %s", e)
+            guardado = await redis_svc.hgetall(_DIRECTORIO_KEY)
+            nuevo = {clave: User(**json.loads(raw)) for clave, raw in guardado.items()}
+            _directorio.clear()
+            _directorio.update(nuevo)
+            logger.info("Directorio de usuarios cargado desde Redis: %d usuarios", len(nuevo))
+            return len(nuevo)
+
+        nuevo = {_normalizar(u.phone): u for u in usuarios}
+        await redis_svc.hash_replace(
+            _DIRECTORIO_KEY,
+            {clave: u.model_dump_json() for clave, u in nuevo.items()},
+        )
+        _directorio.clear()
+        _directorio.update(nuevo)
+        logger.info("Directorio de usuarios cargado desde FileMaker: %d usuarios", len(nuevo))
+        return len(nuevo)
+
+    @classmethod
+    async def start(cls):
+        """Precarga el directorio e inicia su refresco periodico."""
+        global _refresh_task
+        try:
+            await cls.cargar_directorio()
+        except Exception:
+            logger.exception("Error precargando directorio de usuarios")
+
+        if _refresh_task is None:
+            _refresh_task = asyncio.create_task(cls._refresh_loop())
+
+    @classmethod
+    async def stop(cls):
+        """Detiene el refresco periodico del directorio."""
+        global _refresh_task
+        if _refresh_task is None:
+            return
+        _refresh_task.cancel()
+        try:
+            await _refresh_task
+        except asyncio.CancelledError:
+            pass
+        _refresh_task = None
+
+    @classmethod
+    async def _refresh_loop(cls):
+        intervalo = get_settings().AUTH_DIRECTORY_REFRESH_SECONDS
+        while True:
+            await asyncio.sleep(intervalo)
+            try:
+                await cls.cargar_directorio()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error refrescando directorio de usuarios")
+
     @classmethod
     async def clear_cache(cls, phone: Optional[str] = None):
+        """
+        Invalida usuarios cacheados. Con phone invalida solo ese telefono
+        (incluida su entrada negativa); sin phone invalida el directorio completo.
+        """
         if phone:
-            await redis_svc.delete(f"auth:user:{phone}")
+            clave = _normalizar(phone)
+            await redis_svc.hdel(_DIRECTORIO_KEY, clave)
+            await redis_svc.delete(_negativo_key(clave))
+            # Descarta la copia en memoria de este y de los demas workers
+            await cache.invalidate(f"{_INVALIDACION_PREFIJO}{clave}")
+            return
+
+        await redis_svc.delete(_DIRECTORIO_KEY)
+        await cache.invalidate(f"{_INVALIDACION_PREFIJO}*")
@@ -13,6 +13,7 @@ class Settings(BaseSettings):
 
     # --- FileMaker ---
     FM_HOST: str = Field(default="fmsk.skinmed.cl", description="Host del servidor FileMaker")
+    FM_SCHEME: str = Field(default="https", description="Esquema de la Data API de FileMaker (http solo para stand-ins locales, ej. bench/)")
     FM_DB: str = Field(default="Agenda%20v20b", description="Nombre de la base de datos FileMaker")
     FM_USER: str = Field(description="Usuario de FileMaker")
     FM_PASS: str = Field(description="Contraseña de FileMaker")
@@ -31,33 +32,111 @@ class Settings(BaseSettings):
     WSP_VERIFY_TOKEN: str = Field(description="Token de verificacion de webhook")
     WSP_APP_SECRET: str = Field(description="App Secret para firma HMAC-SHA256")
     META_API_VERSION: str = Field(default="v25.0", description="Version de la API de Meta Graph")
+    META_API_BASE_URL: str = Field(default="https://graph.facebook.com", description="URL base de la Graph API (se reemplaza solo en pruebas locales)")
+    WSP_DISPATCH_WORKERS: int = Field(default=8, description="Envios concurrentes del dispatcher de mensajes salientes")
+    WSP_MAX_MESSAGES_PER_SECOND: int = Field(default=80, description="Mensajes por segundo del numero (tier de throughput de Meta), compartido entre workers")
+    WSP_COALESCE_WINDOW_MS: int = Field(default=0, description="Ventana para fusionar textos consecutivos al mismo telefono (0 = sin fusion)")
+    WSP_DISPATCH_DRAIN_SECONDS: float = Field(default=5.0, description="Tiempo maximo para vaciar la cola de salida al apagar")
 
     # --- Redis ---
     REDIS_URL: str = Field(default="redis://localhost:6379/0", description="URL de conexion a Redis")
 
+    # --- Timeouts adaptativos y reintentos ---
+    ADAPTIVE_TIMEOUT_FACTOR: float = Field(default=3.0, description="El timeout de lectura por llamada es el p99 observado de la operacion por este factor (nunca mas que el del pool)")
+    ADAPTIVE_TIMEOUT_MIN_SECONDS: float = Field(default=2.0, description="Piso del timeout adaptativo de lectura")
+    OPENAI_MIN_READ_TIMEOUT: float = Field(default=20.0, description="Piso del timeout adaptativo de lectura de OpenAI (la duracion depende del largo de la respuesta, no solo del servidor)")
+    RETRY_BUDGET_PERCENT: float = Field(default=20.0, description="Reintentos permitidos como porcentaje de las llamadas (presupuesto por proceso)")
+    RETRY_BUDGET_BURST: float = Field(default=10.0, description="Reintentos acumulables en el presupuesto para rafagas")
+
+    # --- Hedging de lecturas a FileMaker ---
+    FM_HEDGE_ENABLED: bool = Field(default=True, description="Cubrir lecturas idempotentes de FileMaker con una segunda request si superan el p90")
+    FM_HEDGE_BUDGET_PERCENT: float = Field(default=5.0, description="Maximo de requests de cobertura como porcentaje de las lecturas")
+    FM_HEDGE_MIN_DELAY_MS: float = Field(default=100.0, description="Espera minima antes de lanzar una cobertura, aunque el p90 sea menor")
+
+    # --- HTTP (un pool por upstream) ---
+    HTTP_FM_MAX_CONNECTIONS: int = Field(default=10, description="Conexiones maximas del pool HTTP de FileMaker")
+    HTTP_FM_READ_TIMEOUT: float = Field(default=20.0, description="Timeout de lectura (segundos) para FileMaker")
+    HTTP_META_MAX_CONNECTIONS: int = Field(default=20, description="Conexiones maximas del pool HTTP de Meta Graph API")
+    HTTP_META_READ_TIMEOUT: float = Field(default=15.0, description="Timeout de lectura (segundos) para Meta Graph API")
+    HTTP_OPENAI_MAX_CONNECTIONS: int = Field(default=20, description="Conexiones maximas del pool HTTP de OpenAI")
+    HTTP_OPENAI_READ_TIMEOUT: float = Field(default=30.0, description="Timeout de lectura (segundos) para OpenAI")
+    HTTP_KEEPALIVE_EXPIRY: float = Field(default=30.0, description="Segundos que una conexion ociosa se mantiene abierta")
+    HTTP2_ENABLED: bool = Field(default=True, description="Usar HTTP/2 con Meta y OpenAI (requiere httpx[http2])")
+
+    # --- Deadline por turno ---
+    TURN_DEADLINE_SECONDS: float = Field(default=45.0, description="Tiempo maximo para responder un mensaje; al agotarse se corta el turno y se pide intentar de nuevo")
+
+    # --- Circuit breakers ---
+    CB_WINDOW_SECONDS: int = Field(default=60, description="Ventana movil (segundos) para la tasa de error de los circuit breakers")
+    CB_ERROR_RATE_THRESHOLD: float = Field(default=0.5, description="Tasa de error en la ventana que abre el circuit breaker")
+    CB_MIN_CALLS: int = Field(default=10, description="Llamadas minimas en la ventana antes de evaluar la tasa de error")
+    CB_PROBE_LEASE_SECONDS: float = Field(default=15.0, description="Segundos que un worker retiene la llamada de prueba en semi-abierto")
+
+    # --- Warm-up ---
+    WARMUP_STEP_TIMEOUT_SECONDS: float = Field(default=15.0, description="Tiempo maximo de cada paso del warm-up al iniciar")
+
+    # --- Metricas ---
+    METRICS_TOKEN: str = Field(default="", description="Bearer token para GET /metrics (vacio = endpoint deshabilitado)")
+
+    # --- Tracing ---
+    TRACE_SLOW_TURN_SECONDS: float = Field(default=8.0, description="Turnos que duran al menos esto emiten un registro de resumen con el desglose por fase")
+    TRACE_OTLP_ENDPOINT: str = Field(default="", description="URL OTLP/HTTP del collector (ej. http://localhost:4318/v1/traces); vacio = sin exportar")
+    TRACE_SERVICE_NAME: str = Field(default="skinmed-bot", description="service.name de los spans exportados")
+
     # --- Logging ---
     LOG_LEVEL: str = Field(default="INFO", description="Nivel de logging (DEBUG, INFO, WARNING, ERROR)")
+    LOG_PAYLOAD_SAMPLE_RATE: float = Field(default=0.1, description="Fraccion de turnos (0-1) que registran payloads completos (mensajes, tools, respuestas LLM, payloads de WhatsApp); con LOG_LEVEL=DEBUG se registran siempre")
 
     # --- Entorno ---
     ENVIRONMENT: str = Field(default="production", description="Entorno de ejecucion (development, staging, production)")
 
     # --- Rate Limiting ---
-    RATE_LIMIT_MAX: int = Field(default=30, description="Maximo de mensajes por ventana de rate limit")
-    RATE_LIMIT_WINDOW: int = Field(default=60, description="Ventana de rate limit en segundos")
+    RATE_LIMIT_MAX: int = Field(default=30, gt=0, description="Maximo de mensajes por ventana de rate limit")
+    RATE_LIMIT_WINDOW: int = Field(default=60, gt=0, description="Ventana de rate limit en segundos")
+    RATE_LIMIT_RULES: str = Field(
+        default="*:texto=15/60,*:boton=30/60",
+        description="Limites por rol y ruta 'rol:ruta=capacidad/ventana' separados por coma ('*' = cualquier rol)",
+    )
 
     # --- Message Limits ---
     MAX_MESSAGE_LENGTH: int = Field(default=500, description="Longitud maxima de mensaje de texto aceptado")
 
+    # --- Autenticacion ---
+    AUTH_DIRECTORY_REFRESH_SECONDS: int = Field(default=300, description="Segundos entre recargas del directorio de usuarios desde FileMaker")
+    AUTH_NEGATIVE_TTL_SECONDS: int = Field(default=60, description="Segundos que se recuerda un telefono desconocido antes de volver a consultar FileMaker")
+
+    # --- Cache ---
+    CACHE_L1_MAX_ITEMS: int = Field(default=2048, description="Entradas maximas del cache en memoria (L1) por worker antes de descartar las menos usadas")
+    FM_AGENDA_CACHE_TTL_SECONDS: int = Field(default=60, description="Segundos que se cachean las agendas leidas de FileMaker (por doctor y general); el prefetch de sesion depende de este cache")
+    FM_LAST_GOOD_TTL_SECONDS: int = Field(default=86400, description="Segundos que se conserva el ultimo dato valido de agendas/recados para servirlo si FileMaker cae")
+    RENDER_CACHE_MAX_ITEMS: int = Field(default=1024, description="Mensajes renderizados (agendas, recados) que se conservan en memoria por worker, direccionados por recordId/modId")
+    RENDER_CACHE_TTL_SECONDS: int = Field(default=600, description="Vida maxima de un render cacheado: acota el desfase de campos relacionados (ej. nombre del paciente) que no cambian el modId de la cita")
+    RECADOS_PARSE_CACHE_MAX_ITEMS: int = Field(default=4096, description="Hilos de texto_Recado parseados que se conservan en memoria por worker (clave recordId/modId)")
+    RECADOS_VISTOS_TTL_SECONDS: int = Field(default=7776000, description="Vida de la marca de recados ya revisados por doctor (modo 'solo nuevos')")
+
     # --- Notificaciones ---
     CHIEF_NURSE_PHONE: str = Field(default="56939129139", description="Telefono de la jefa de enfermeria para notificaciones de recados")
+    NURSE_DIGEST_WINDOW_SECONDS: int = Field(default=120, description="Ventana en que los recados a enfermeria se agrupan en un solo resumen")
+    NURSE_NOTIFY_DEDUP_SECONDS: int = Field(default=600, description="Segundos en que un mismo recado no se vuelve a notificar (reintentos)")
+
+    # --- Outbox de recados ---
+    RECADOS_OUTBOX_MAX_ATTEMPTS: int = Field(default=5, description="Intentos de crear un recado en FileMaker antes de moverlo al dead-letter")
+    RECADOS_OUTBOX_RETRY_SECONDS: float = Field(default=30.0, description="Segundos antes de reintentar un recado que fallo")
+    RECADOS_OUTBOX_LOCK_SECONDS: float = Field(default=300.0, description="Lock por recado mientras se crea en FileMaker; debe superar el peor caso de una creacion (token + reintentos)")
 
     # --- Session ---
     SESSION_TIMEOUT_SECONDS: int = Field(default=120, description="Segundos de inactividad antes de cerrar la sesion automaticamente")
+    SESSION_TIMER_BACKEND: str = Field(default="redis", description="Backend de timers de inactividad: 'redis' (multi-worker) o 'local' (timer wheel en proceso, un solo worker)")
+    SESSION_SWEEP_INTERVAL_SECONDS: float = Field(default=1.0, description="Intervalo en segundos entre barridos de sesiones vencidas")
+    SESSION_SWEEP_BATCH_SIZE: int = Field(default=100, description="Maximo de sesiones vencidas reclamadas por lote en cada barrido")
+    SESSION_PREFETCH_ENABLED: bool = Field(default=True, description="Al primer mensaje de una sesion, precargar en segundo plano la agenda de hoy y los recados segun el rol")
 
     # --- LLM ---
     LLM_MODE_ENABLED: bool = Field(default=False, description="Habilitar modo LLM globalmente")
     OPENAI_API_KEY: str = Field(default="", description="API key de OpenAI para GPT-4o-mini")
     OPENAI_MODEL: str = Field(default="gpt-5.4", description="Modelo de OpenAI a utilizar")
+    OPENAI_API_BASE_URL: str = Field(default="https://api.openai.com/v1", description="URL base de la API de OpenAI (se reemplaza solo en pruebas locales)")
+    LLM_TRACE_PATH: str = Field(default="", description="Archivo JSONL donde grabar cada turno del agente (mensajes, respuestas del modelo, tools y tiempos) para reproducirlo con bench/replay.py. Vacio = desactivado. Incluye datos de pacientes: solo en entornos de prueba")
 
     # Fallback: roles que caen a legacy cuando el LLM falla (CSV: "medico,gerencia")
     LLM_LEGACY_FALLBACK_ROLES: str = Field(
@@ -15,3 +15,9 @@ class ServicioNoDisponibleError(Exception):
 class FileMakerAuthError(Exception):
     """Error de autenticacion con FileMaker (token expirado o credenciales invalidas)."""
     pass
+
+
+class DeadlineExcedido(ServicioNoDisponibleError):
+    """Se agoto el tiempo total del turno antes de completar la operacion."""
+    def __init__(self, operacion: str):
+        super().__init__(operacion, "se agoto el tiempo del turno")
@@ -1,4 +1,10 @@
-from typing import List, Dict, Optional, Tuple
+import functools
+import operator
+from dataclasses import dataclass
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app.formatters import cache_render
+from app.formatters.frescura import banner_frescura
 
 # Mapeo de concepto de cobro / actividad a abreviación
 _ABREVIACIONES = {
@@ -91,69 +97,168 @@ _GLOSARIO = {
 }
 
 
+# Citas que no se muestran en ninguna agenda
+_IGNORAR_TIPO = frozenset({"Eliminada", "Bloqueada", "No Viene"})
+_IGNORAR_ACTIVIDAD = frozenset({"RECORDATORIO", "VISITADOR MÉDICO", "LABORATORIO"})
+
+
+class Cita(NamedTuple):
+    """Registro de ListadoDeHoras_dapi ya filtrado y normalizado para renderizar."""
+    orden: str                  # Hora tal como viene de FileMaker (clave de orden)
+    hora: str                   # HH:MM
+    tipo: str
+    nombre: str
+    apellido: str
+    actividad: Optional[str]    # None si el registro no trae Actividad
+    doctor: str
+
+    @property
+    def paciente(self) -> str:
+        """"Nombre Apellido" tal como viene de FileMaker ("" si no hay)."""
+        return f"{self.nombre} {self.apellido}".strip()
+
+
+# Sin pasar por el __new__ de Python de NamedTuple: es el camino caliente de todas las agendas
+_nueva_cita = functools.partial(tuple.__new__, Cita)
+
+
+def citas_validas(data: List[Dict]) -> List[Cita]:
+    """
+    Descarta citas eliminadas, bloqueadas, de sistema o sin hora y normaliza
+    el resto en una sola pasada. Conserva el orden de FileMaker.
+    """
+    citas = []
+    append = citas.append
+    for registro in data:
+        f = registro["fieldData"]
+        hora = f.get("Hora", "00:00:00")
+        if hora == "00:00:00":
+            continue
+        tipo = f.get("Tipo")
+        if tipo in _IGNORAR_TIPO:
+            continue
+        actividad = f.get("Actividad")
+        if actividad is not None and _actividad_ignorada(actividad):
+            continue
+        append(_nueva_cita((
+            hora,
+            _hh_mm(hora),
+            tipo or "",
+            f.get("Pacientes::NOMBRE", ""),
+            f.get("Pacientes::APELLIDO PATERNO", ""),
+            actividad,
+            f.get("Recurso Humano::Nombre Lista", "").strip(),
+        )))
+    return citas
+
+
+def agrupar_por_doctor(citas: List[Cita]) -> Dict[str, List[Cita]]:
+    """Agrupa por doctor (en orden de aparicion) con las citas de cada uno ordenadas por hora."""
+    doctores: Dict[str, List[Cita]] = {}
+    for cita in citas:
+        if cita.doctor:
+            doctores.setdefault(cita.doctor, []).append(cita)
+    for lista in doctores.values():
+        lista.sort(key=_por_hora)
+    return doctores
+
+
+# Las horas y actividades se repiten mucho entre registros de un mismo dia
+@functools.lru_cache(maxsize=2048)
+def _hh_mm(hora: str) -> str:
+    return ":".join(hora.split(":", 2)[:2])
+
+
+@functools.lru_cache(maxsize=1024)
+def _actividad_ignorada(actividad: str) -> bool:
+    return actividad.upper() in _IGNORAR_ACTIVIDAD
+
+
+_por_hora = operator.itemgetter(0)
+
+
+@dataclass(frozen=True)
+class AgendaRender:
+    """
+    Cuerpo de una agenda formateada, sin encabezado: cada consumidor (doctor,
+    gerencia, tool ver_agenda_doctor) arma el suyo alrededor de estas partes.
+    """
+    lineas: Tuple[str, ...]     # una por cita, en orden de hora
+    glosario: Optional[str]     # None si no se uso ninguna abreviatura
+    banner: str                 # "" si los datos son frescos
+    con_registros: bool         # False si FileMaker no devolvio registros
+
+
 class AgendaFormatter:
     @staticmethod
+    @functools.lru_cache(maxsize=1024)
     def _abreviar(actividad: str) -> str:
         """Retorna la abreviación de la actividad, o el original si no existe."""
         return _ABREVIACIONES.get(actividad, _ABREVIACIONES.get(actividad.upper(), actividad))
 
     @staticmethod
-    def format(data: List[Dict], doctor_name: str) -> Tuple[str, Optional[str]]:
-        """Formatea la agenda y retorna (mensaje_agenda, mensaje_glosario).
-        El glosario es None si no hay abreviaciones que mostrar."""
+    def render(data: List[Dict], obtenido_en: Optional[float] = None) -> AgendaRender:
+        """
+        Lineas y glosario de la agenda. Si los registros no cambiaron desde el
+        ultimo render (mismos recordId/modId) se reutiliza el cacheado.
+        """
+        banner = banner_frescura(obtenido_en or getattr(data, "obtenido_en", None))
         if not data:
-            return "No hay citas agendadas para día solicitado.", None
-        
-        msg = f"*Hola Dr(a). {doctor_name}*\nAgenda para día solicitado:\n\n"
-        
-        ignorar_tipo = ["Eliminada", "Bloqueada", "No Viene"]
-        ignorar_actividad = ["RECORDATORIO", "VISITADOR MÉDICO", "LABORATORIO"]
-        
-        validos = [
-            r for r in data 
-            if r['fieldData'].get('Tipo') not in ignorar_tipo 
-            and r['fieldData'].get('Actividad', '').upper() not in ignorar_actividad
-            and r['fieldData'].get('Hora', '00:00:00') != '00:00:00'
-        ]
-        validos.sort(key=lambda x: x['fieldData']['Hora'])
-
-        if not validos:
-            return f"*Hola Dr(a). {doctor_name}*\nNo tienes citas agendadas día solicitado.", None
+            return AgendaRender(lineas=(), glosario=None, banner=banner, con_registros=False)
 
-        abreviaturas_usadas = set()
+        lineas, glosario = cache_render.renderizar("agenda", data, lambda: AgendaFormatter._cuerpo(data))
+        return AgendaRender(lineas=lineas, glosario=glosario, banner=banner, con_registros=True)
 
-        for reg in validos:
-            f = reg['fieldData']
-            hora = ":".join(f['Hora'].split(":")[:2])
-            tipo = f.get('Tipo', 'Desconocido')
-            
-            if tipo == "Disponible":
-                msg += f"*{hora}* - Disponible\n"
+    @staticmethod
+    def _cuerpo(data: List[Dict]) -> Tuple[Tuple[str, ...], Optional[str]]:
+        """Filtra, ordena y abrevia las citas en una pasada y arma las lineas y el glosario."""
+        citas = citas_validas(data)
+        citas.sort(key=_por_hora)
+
+        lineas = []
+        abreviaturas_usadas = set()
+        for cita in citas:
+            if cita.tipo == "Disponible":
+                lineas.append(f"*{cita.hora}* - Disponible")
                 continue
 
-            nombre = f.get('Pacientes::NOMBRE', '')
-            apellido = f.get('Pacientes::APELLIDO PATERNO', '')
-            paciente = f"{nombre} {apellido}".strip().title() or 'Sin paciente'
-            
-            motivo_raw = f.get('Actividad', 'Sin motivo')
+            paciente = cita.paciente.title() or "Sin paciente"
+            motivo_raw = cita.actividad if cita.actividad is not None else "Sin motivo"
             motivo = AgendaFormatter._abreviar(motivo_raw)
-            conjunto_tag = "(conj)" if tipo.lower() == "conjunto" else ""
+            conjunto_tag = "(conj)" if cita.tipo.lower() == "conjunto" else ""
 
             # Registrar abreviatura solo si fue abreviada (distinto al original)
             if motivo != motivo_raw:
                 abreviaturas_usadas.add(motivo)
-            
-            msg += f"*{hora}* - {paciente} - *{motivo}{conjunto_tag}*\n"
 
-        # Generar glosario solo con las abreviaturas usadas
-        glossary = None
+            lineas.append(f"*{cita.hora}* - {paciente} - *{motivo}{conjunto_tag}*")
+
+        # Glosario solo con las abreviaturas usadas
+        glosario = None
         if abreviaturas_usadas:
-            lines = []
-            for abr in sorted(abreviaturas_usadas):
-                nombre_completo = _GLOSARIO.get(abr, abr)
-                lines.append(f"*{abr}*: {nombre_completo}")
-            glossary = "\n".join(lines)
+            glosario = "\n".join(f"*{abr}*: {_GLOSARIO.get(abr, abr)}" for abr in sorted(abreviaturas_usadas))
+
+        return tuple(lineas), glosario
+
+    @staticmethod
+    def format(
+        data: List[Dict],
+        doctor_name: str,
+        obtenido_en: Optional[float] = None,
+        encabezado: Optional[str] = None,
+    ) -> Tuple[str, Optional[str]]:
+        """Formatea la agenda y retorna (mensaje_agenda, mensaje_glosario).
+        El glosario es None si no hay abreviaciones que mostrar.
+        Si los datos vienen del respaldo (obtenido_en), agrega "datos de hh:mm".
+        `encabezado` reemplaza el saludo por defecto ("*Hola Dr(a). X*")."""
+        render = AgendaFormatter.render(data, obtenido_en)
 
-        return msg, glossary
+        if not render.con_registros:
+            return "No hay citas agendadas para día solicitado." + render.banner, None
 
+        encabezado = encabezado or f"*Hola Dr(a). {doctor_name}*"
+        if not render.lineas:
+            return f"{encabezado}\nNo tienes citas agendadas día solicitado." + render.banner, None
 
+        msg = f"{encabezado}\nAgenda para día solicitado:\n\n" + "\n".join(render.lineas) + (render.banner or "\n")
+        return msg, render.glosario
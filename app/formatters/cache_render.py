@@ -0,0 +1,78 @@
+"""
+Cache en memoria de mensajes renderizados, direccionado por contenido.
+
+La clave es la variante de render ("agenda", "recados",
+"consultar_agenda.detalle", ...), sus parametros (nombre del doctor,
+fecha, ...) y la firma del set de registros de FileMaker: los pares
+`recordId:modId` en el orden recibido. Si FileMaker no cambio nada, un
+request repetido (ej. gerencia eligiendo otra vez el mismo doctor) no vuelve
+a filtrar ni formatear; cualquier registro nuevo, borrado o modificado
+cambia la firma y el render se recalcula solo.
+
+- Lo cacheado no incluye el aviso de respaldo (banner_frescura): depende
+  de cuando se leyeron los datos, no de los registros.
+- Los campos relacionados (ej. `Pacientes::NOMBRE`) no cambian el modId de
+  la cita: RENDER_CACHE_TTL_SECONDS acota cuanto puede durar ese desfase.
+- Registros sin recordId/modId (datos de prueba) no se cachean.
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, TypeVar
+
+from app.config import get_settings
+
+T = TypeVar("T")
+
+_cache: "OrderedDict[Tuple[Hashable, ...], Tuple[float, Any]]" = OrderedDict()
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "sin_firma": 0, "evicciones": 0}
+
+
+def firma_registros(data: List[Dict]) -> Optional[str]:
+    """Hash de los pares recordId:modId en orden; None si algun registro no los trae."""
+    try:
+        pares = "|".join(f"{r['recordId']}:{r['modId']}" for r in data)
+    except (KeyError, TypeError):
+        return None
+    return hashlib.blake2b(pares.encode(), digest_size=16).hexdigest()
+
+
+def renderizar(variante: str, data: List[Dict], render: Callable[[], T], *params: Hashable) -> T:
+    """
+    Retorna `render()` cacheado bajo (variante, params, firma de `data`).
+
+    `render` debe depender solo de `data` y `params`, y su resultado no se
+    debe mutar (se comparte entre requests).
+    """
+    firma = firma_registros(data)
+    if firma is None:
+        _stats["sin_firma"] += 1
+        return render()
+
+    clave = (variante, params, firma)
+    ahora = time.monotonic()
+    entrada = _cache.get(clave)
+    if entrada is not None and entrada[0] > ahora:
+        _cache.move_to_end(clave)
+        _stats["hits"] += 1
+        return entrada[1]
+
+    _stats["misses"] += 1
+    valor = render()
+    settings = get_settings()
+    _cache[clave] = (ahora + settings.RENDER_CACHE_TTL_SECONDS, valor)
+    _cache.move_to_end(clave)
+    while len(_cache) > settings.RENDER_CACHE_MAX_ITEMS:
+        _cache.popitem(last=False)
+        _stats["evicciones"] += 1
+    return valor
+
+
+def limpiar():
+    """Descarta todos los renders cacheados."""
+    _cache.clear()
+
+
+def get_stats() -> dict:
+    """Hits, misses, renders sin firma, evicciones y entradas actuales."""
+    return {**_stats, "items": len(_cache)}
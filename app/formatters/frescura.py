@@ -0,0 +1,18 @@
+from datetime import datetime
+from typing import Optional
+
+import pytz
+
+
+def banner_frescura(obtenido_en: Optional[float]) -> str:
+    """Pie de mensaje para datos servidos desde el respaldo ("" si son frescos)."""
+    if obtenido_en is None:
+        return ""
+
+    tz = pytz.timezone("America/Santiago")
+    leido = datetime.fromtimestamp(obtenido_en, tz)
+    if leido.date() == datetime.now(tz).date():
+        cuando = leido.strftime("%H:%M")
+    else:
+        cuando = leido.strftime("%d-%m %H:%M")
+    return f"\n\n⚠️ _FileMaker no disponible: datos de {cuando}_"
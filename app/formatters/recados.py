@@ -1,56 +1,151 @@
-from typing import List, Dict, Optional
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+
+from app.config import get_settings
+from app.formatters import cache_render
+from app.formatters.frescura import banner_frescura
+
+_SEPARADOR = "━━━━━━━━━━━━━━━\n"
+
+# Hilos de texto_Recado ya parseados, por (recordId, modId): un hilo solo
+# cambia si FileMaker le sube el modId, asi que solo se re-parsean esos
+_entradas_cache: "OrderedDict[Tuple[str, str], List[Dict[str, str]]]" = OrderedDict()
+_stats_parseo: Dict[str, int] = {"hits": 0, "misses": 0}
 
 
 class RecadosFormatter:
     """Formatea recados de FileMaker para WhatsApp."""
 
     @staticmethod
-    def format(data: List[Dict], doctor_name: str, doctor_lastname: str = "", pacient_names: Optional[Dict[str, str]] = None) -> str:
+    def format(
+        data: List[Dict],
+        doctor_name: str,
+        doctor_lastname: str = "",
+        pacient_names: Optional[Dict[str, str]] = None,
+        vistos: Optional[Dict[str, int]] = None,
+    ) -> str:
+        """
+        Mensaje de recados para WhatsApp.
+
+        Con `vistos` ({recordId: entradas ya vistas}, ver conteo_entradas) solo
+        se muestran los mensajes agregados despues de esa revision.
+        """
+        # Datos servidos desde el respaldo: agregar "datos de hh:mm"
+        banner = banner_frescura(getattr(data, "obtenido_en", None))
+
         if not data:
-            return f"*Hola Dr(a). {doctor_name} {doctor_lastname}*\nNo tienes recados pendientes."
+            return f"*Hola Dr(a). {doctor_name} {doctor_lastname}*\nNo tienes recados pendientes." + banner
 
         pacient_names = pacient_names or {}
 
+        # Mismos registros (recordId/modId), doctor, nombres de pacientes y marca: se reutiliza el render
+        texto = cache_render.renderizar(
+            "recados" if vistos is None else "recados.nuevos", data,
+            lambda: RecadosFormatter._cuerpo(data, doctor_name, doctor_lastname, pacient_names, vistos),
+            doctor_name, doctor_lastname, tuple(sorted(pacient_names.items())),
+            tuple(sorted(vistos.items())) if vistos is not None else None,
+        )
+        return texto + banner
+
+    @staticmethod
+    def _cuerpo(
+        data: List[Dict],
+        doctor_name: str,
+        doctor_lastname: str,
+        pacient_names: Dict[str, str],
+        vistos: Optional[Dict[str, int]],
+    ) -> str:
+        """Mensaje de recados sin el aviso de respaldo."""
         recados = []
         for record in data:
-            field_data = record.get("fieldData", {})
-            texto_raw = field_data.get("texto_Recado", "")
-            pac_id = field_data.get("_FK_IDPaciente", "")
-            pac_name = pacient_names.get(pac_id, "Paciente desconocido")
-            parsed = RecadosFormatter._parse_texto_recado(texto_raw)
+            parsed = RecadosFormatter.entradas(record)
+            if vistos is not None:
+                # Los hilos crecen agregando arriba: lo nuevo son las primeras entradas
+                nuevas = len(parsed) - vistos.get(str(record.get("recordId")), 0)
+                parsed = parsed[:nuevas] if nuevas > 0 else []
             if parsed:
+                pac_id = record.get("fieldData", {}).get("_FK_IDPaciente", "")
+                pac_name = pacient_names.get(pac_id, "Paciente desconocido")
                 recados.append({"entradas": parsed, "paciente": pac_name})
 
         if not recados:
+            if vistos is not None:
+                return f"*Hola Dr(a). {doctor_name} {doctor_lastname}*\nNo tienes recados nuevos desde tu última revisión."
             return f"*Hola Dr(a). {doctor_name} {doctor_lastname}*\nNo tienes recados pendientes."
 
-        msg = f"*Recados para Dr(a). {doctor_name} {doctor_lastname}*\n"
-        msg += f"_{len(recados)} recado(s) encontrado(s)_\n"
-        msg += "━━━━━━━━━━━━━━━\n"
+        if vistos is not None:
+            partes = [
+                f"*Recados nuevos para Dr(a). {doctor_name} {doctor_lastname}*\n",
+                f"_{len(recados)} recado(s) con mensajes nuevos_\n",
+                _SEPARADOR,
+            ]
+        else:
+            partes = [
+                f"*Recados para Dr(a). {doctor_name} {doctor_lastname}*\n",
+                f"_{len(recados)} recado(s) encontrado(s)_\n",
+                _SEPARADOR,
+            ]
 
         for i, recado in enumerate(recados, 1):
-            msg += f"\n*Recado #{i}* — {recado['paciente']}\n"
+            partes.append(f"\n*Recado #{i}* — {recado['paciente']}\n")
             # Los mensajes nuevos en FileMaker se agregan arriba (al principio).
             # Tomamos los 3 primeros (los más nuevos) y los damos vuelta para 
             # mostrarlos en orden cronológico (chat normal: el más nuevo al final).
             entradas = recado["entradas"]
-            visibles = entradas[:3] if len(entradas) > 3 else entradas[:]
-            visibles.reverse()
-
             if len(entradas) > 3:
-                msg += f"_... {len(entradas) - 3} mensaje(s) anterior(es)_\n"
+                partes.append(f"_... {len(entradas) - 3} mensaje(s) anterior(es)_\n")
 
-            for entrada in visibles:
-                autor = entrada["autor"]
-                fecha = entrada["fecha"]
-                hora = entrada["hora"]
-                mensaje = entrada["mensaje"]
-                msg += f"*{autor}* — {fecha} {hora}\n"
-                msg += f"   {mensaje}\n"
+            for entrada in reversed(entradas[:3]):
+                partes.append(f"*{entrada['autor']}* — {entrada['fecha']} {entrada['hora']}\n")
+                partes.append(f"   {entrada['mensaje']}\n")
 
-            msg += "━━━━━━━━━━━━━━━\n"
+            partes.append(_SEPARADOR)
 
-        return msg.rstrip("\n")
+        return "".join(partes).rstrip("\n")
+
+    @staticmethod
+    def entradas(record: Dict) -> List[Dict[str, str]]:
+        """
+        Entradas de texto_Recado de un registro (la mas nueva primero).
+        Cacheadas por recordId/modId; el resultado no se debe mutar.
+        """
+        texto = record.get("fieldData", {}).get("texto_Recado", "")
+        try:
+            clave = (record["recordId"], record["modId"])
+        except KeyError:
+            return RecadosFormatter._parse_texto_recado(texto)
+
+        parsed = _entradas_cache.get(clave)
+        if parsed is not None:
+            _entradas_cache.move_to_end(clave)
+            _stats_parseo["hits"] += 1
+            return parsed
+
+        _stats_parseo["misses"] += 1
+        parsed = RecadosFormatter._parse_texto_recado(texto)
+        _entradas_cache[clave] = parsed
+        while len(_entradas_cache) > get_settings().RECADOS_PARSE_CACHE_MAX_ITEMS:
+            _entradas_cache.popitem(last=False)
+        return parsed
+
+    @staticmethod
+    def conteo_entradas(data: List[Dict]) -> Dict[str, int]:
+        """{recordId: cantidad de entradas} de los recados, para marcar lo ya visto."""
+        return {
+            str(record["recordId"]): len(RecadosFormatter.entradas(record))
+            for record in data
+            if "recordId" in record
+        }
+
+    @staticmethod
+    def limpiar_parseo():
+        """Descarta los hilos parseados cacheados."""
+        _entradas_cache.clear()
+
+    @staticmethod
+    def get_stats_parseo() -> dict:
+        """Hits y misses del cache de hilos parseados y entradas actuales."""
+        return {**_stats_parseo, "items": len(_entradas_cache)}
 
     @staticmethod
     def _parse_texto_recado(texto: str) -> list:
@@ -2,33 +2,109 @@
 Configuracion de logging estructurado.
 En produccion usa formato JSON para integracion con herramientas de observabilidad.
 En desarrollo usa formato legible para humanos.
+
+Los handlers del logger raiz solo encolan el registro (QueueHandler); el
+formateo JSON y la escritura a stdout ocurren en el hilo de un
+QueueListener, fuera del event loop.
+
+Los payloads grandes (mensajes, argumentos y resultados de tools,
+respuestas del LLM, payloads de WhatsApp) se registran solo en una
+fraccion de los turnos (LOG_PAYLOAD_SAMPLE_RATE); en el resto se deja
+unicamente su largo. Ver `muestrear_payload` y `resumir_payload`.
 """
+import atexit
+import copy
 import logging
+import queue
 import sys
+import zlib
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Optional
 
 from pythonjsonlogger import json as jsonlogger
 
+from app.utils import tracing
+
+_listener: Optional[QueueListener] = None
+_tasa_payload: float = 1.0
+
+
+class _TraceIdFilter(logging.Filter):
+    """Agrega el trace_id del turno en curso a cada registro ("-" fuera de un turno)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = tracing.trace_id_actual() or "-"
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    """
+    Encola el registro con el mensaje ya interpolado (los argumentos pueden
+    mutar despues de loguearlos) pero sin formatear: el formatter del
+    listener genera el JSON completo, incluidos `extra` y la excepcion.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # El traceback no se puede formatear mas tarde en otro hilo
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def muestrear_payload(clave: str) -> bool:
+    """
+    True si en este turno se registran los payloads completos.
 
-def setup_logging(log_level: str = "INFO", environment: str = "production"):
+    La decision es deterministica por turno (trace_id) o, fuera de un turno,
+    por `clave` (ej. el telefono): un turno muestreado queda completo en los logs.
+    """
+    if _tasa_payload >= 1.0 or logging.getLogger().isEnabledFor(logging.DEBUG):
+        return True
+    if _tasa_payload <= 0.0:
+        return False
+    semilla = tracing.trace_id_actual() or clave
+    return zlib.crc32(semilla.encode()) % 10000 < _tasa_payload * 10000
+
+
+def resumir_payload(valor: Any, incluir: bool, limite: Optional[int] = None) -> str:
+    """Texto de un payload para un log: completo (o truncado a `limite`) si `incluir`, si no solo su largo."""
+    if not incluir:
+        return f"<omitido, {len(valor)} {'chars' if isinstance(valor, str) else 'elementos'}>"
+    texto = valor if isinstance(valor, str) else str(valor)
+    if limite is not None and len(texto) > limite:
+        return texto[:limite] + "..."
+    return texto
+
+
+def setup_logging(log_level: str = "INFO", environment: str = "production", payload_sample_rate: float = 1.0):
     """
     Configura el sistema de logging.
 
     Args:
         log_level: Nivel de logging (DEBUG, INFO, WARNING, ERROR)
         environment: Entorno de ejecucion (production, development, staging)
+        payload_sample_rate: Fraccion de turnos (0-1) con payloads grandes en los logs
     """
+    global _listener, _tasa_payload
+
     nivel = getattr(logging, log_level.upper(), logging.INFO)
     raiz = logging.getLogger()
     raiz.setLevel(nivel)
+    _tasa_payload = payload_sample_rate
 
     # Limpiar handlers previos para evitar duplicados en recargas
+    detener_logging()
     raiz.handlers.clear()
 
     handler = logging.StreamHandler(sys.stdout)
 
     if environment == "production":
         formatter = jsonlogger.JsonFormatter(
-            fmt="%(asctime)s %(levelname)s %(name)s %(message)s",
+            fmt="%(asctime)s %(levelname)s %(name)s %(trace_id)s %(message)s",
             datefmt="%Y-%m-%dT%H:%M:%S",
             rename_fields={
                 "asctime": "timestamp",
@@ -38,14 +114,33 @@ def setup_logging(log_level: str = "INFO", environment: str = "production"):
         )
     else:
         formatter = logging.Formatter(
-            fmt="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+            fmt="%(asctime)s [%(levelname)s] %(name)s [%(trace_id).8s]: %(message)s",
             datefmt="%Y-%m-%d %H:%M:%S",
         )
 
     handler.setFormatter(formatter)
-    raiz.addHandler(handler)
+
+    # El trace_id vive en un contextvar: se lee en el hilo que loguea, no en el listener
+    cola = queue.SimpleQueue()
+    encolador = _QueueHandler(cola)
+    encolador.addFilter(_TraceIdFilter())
+    raiz.addHandler(encolador)
+
+    _listener = QueueListener(cola, handler, respect_handler_level=True)
+    _listener.start()
 
     # Reducir ruido de librerias externas
     logging.getLogger("httpx").setLevel(logging.WARNING)
     logging.getLogger("httpcore").setLevel(logging.WARNING)
     logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
+
+
+def detener_logging():
+    """Detiene el listener escribiendo antes los registros pendientes."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(detener_logging)
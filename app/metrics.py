@@ -0,0 +1,164 @@
+"""
+Metricas Prometheus expuestas en GET /metrics (requiere METRICS_TOKEN).
+
+- Histogramas de latencia del hot path: webhook, autenticacion, cada metodo
+  de FileMakerService, cada paso de chat_completion, cada tool y cada envio
+  de WhatsApp. En los metodos cacheados de FileMakerService el decorador va
+  bajo @cached/@con_respaldo: se mide solo la ida a FileMaker, no los hits
+  ni los respaldos servidos.
+- Contadores: hits/misses del cache (leidos de cache.get_stats() al
+  exportar, sin costo en el hot path), fallbacks a legacy, rechazos de rate
+  limit y descartes por idempotencia.
+- Gauges: estado de los circuit breakers, timers de sesion armados y
+  profundidad de colas; se actualizan al momento del scrape.
+
+Instrumentacion:
+    @metrics.medir(metrics.FM_LATENCIA, operacion="get_recados")
+    async def get_recados(...): ...
+
+    with metrics.cronometro(metrics.TOOL_LATENCIA, tool=nombre):
+        ...
+
+Cada worker expone sus propias metricas (sin modo multiproceso).
+"""
+import functools
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Buckets para llamadas a OpenAI (segundos a decenas de segundos)
+_BUCKETS_LLM = (0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 13.0, 20.0, 30.0, 60.0)
+
+# ──────────────────────────────────────────────
+# Histogramas
+# ──────────────────────────────────────────────
+
+WEBHOOK_LATENCIA = Histogram(
+    "skinmed_webhook_seconds", "Tiempo de manejo de un POST /webhook",
+)
+AUTH_LATENCIA = Histogram(
+    "skinmed_auth_seconds", "Tiempo de resolver el usuario de un telefono",
+)
+FM_LATENCIA = Histogram(
+    "skinmed_filemaker_seconds", "Tiempo de cada metodo de FileMakerService (sin hits de cache ni respaldos)", ["operacion"],
+)
+LLM_LATENCIA = Histogram(
+    "skinmed_llm_step_seconds", "Tiempo de cada llamada a chat_completion del agente", ["paso"],
+    buckets=_BUCKETS_LLM,
+)
+TOOL_LATENCIA = Histogram(
+    "skinmed_tool_seconds", "Tiempo de ejecucion de cada tool del LLM", ["tool"],
+)
+WSP_LATENCIA = Histogram(
+    "skinmed_whatsapp_send_seconds", "Tiempo de cada envio a la Graph API", ["tipo"],
+)
+
+# ──────────────────────────────────────────────
+# Contadores
+# ──────────────────────────────────────────────
+
+FALLBACKS_LEGACY = Counter(
+    "skinmed_llm_fallbacks_total", "Sesiones que pasaron del LLM al flujo legacy",
+)
+RATE_LIMIT_RECHAZOS = Counter(
+    "skinmed_rate_limit_rejections_total", "Mensajes rechazados por rate limit", ["ruta"],
+)
+IDEMPOTENCIA_DESCARTES = Counter(
+    "skinmed_idempotency_drops_total", "Eventos descartados por ya haber sido procesados", ["origen"],
+)
+
+# ──────────────────────────────────────────────
+# Gauges (actualizados en cada scrape)
+# ──────────────────────────────────────────────
+
+CIRCUIT_BREAKER_ESTADO = Gauge(
+    "skinmed_circuit_breaker_state", "Estado del circuit breaker (0 cerrado, 1 semi-abierto, 2 abierto)", ["nombre"],
+)
+SESIONES_ACTIVAS = Gauge(
+    "skinmed_session_timers", "Timers de inactividad de sesion armados",
+)
+PROFUNDIDAD_COLA = Gauge(
+    "skinmed_queue_depth", "Elementos pendientes por cola", ["cola"],
+)
+
+_VALOR_ESTADO = {"cerrado": 0, "semi_abierto": 1, "abierto": 2}
+
+
+def medir(histograma: Histogram, **labels) -> Callable:
+    """Decorador para funciones async: observa su duracion (tambien si fallan)."""
+    observado = histograma.labels(**labels) if labels else histograma
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                observado.observe(time.perf_counter() - inicio)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def cronometro(histograma: Histogram, **labels):
+    """Context manager que observa la duracion del bloque."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        (histograma.labels(**labels) if labels else histograma).observe(time.perf_counter() - inicio)
+
+
+class _ColectorCache:
+    """Expone los contadores que cache.py ya lleva, leyendolos al exportar."""
+
+    def collect(self):
+        from app.services import cache
+
+        stats = cache.get_stats()
+        eventos = CounterMetricFamily("skinmed_cache_events", "Eventos del cache de dos niveles", labels=["evento"])
+        for evento in ("l1_hits", "l2_hits", "misses", "negativos", "stale_servidos", "invalidaciones"):
+            eventos.add_metric([evento], stats.get(evento, 0))
+        eventos.add_metric(["l1_evicciones"], stats.get("l1_evicciones", 0))
+        yield eventos
+
+        items = GaugeMetricFamily("skinmed_cache_l1_items", "Entradas en el cache en memoria (L1)")
+        items.add_metric([], stats.get("l1_items", 0))
+        yield items
+
+
+REGISTRY.register(_ColectorCache())
+
+
+async def actualizar_gauges():
+    """Refresca los gauges que dependen de estado externo (Redis, colas)."""
+    from app.services import recados_outbox, whatsapp_dispatcher
+    from app.utils import circuit_breaker
+    from app.workflows import session_timer
+
+    for info in circuit_breaker.get_info():
+        CIRCUIT_BREAKER_ESTADO.labels(nombre=info["nombre"]).set(_VALOR_ESTADO[info["estado"]])
+
+    for carril, pendientes in whatsapp_dispatcher.get_stats()["profundidad"].items():
+        PROFUNDIDAD_COLA.labels(cola=f"whatsapp_{carril}").set(pendientes)
+
+    try:
+        SESIONES_ACTIVAS.set((await session_timer.get_info())["timers_armados"])
+        outbox = await recados_outbox.get_stats()
+        PROFUNDIDAD_COLA.labels(cola="recados_outbox").set(outbox["pendientes"])
+        PROFUNDIDAD_COLA.labels(cola="recados_dead_letter").set(outbox["dead_letter"])
+    except Exception:
+        # Sin Redis se exportan los ultimos valores conocidos
+        pass
+
+
+def exportar() -> bytes:
+    """Metricas en formato de texto de Prometheus."""
+    return generate_latest(REGISTRY)
+
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
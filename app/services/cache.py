@@ -0,0 +1,336 @@
+"""
+Cache de dos niveles: LRU en proceso (L1) delante de Redis (L2).
+
+- L1: OrderedDict acotado (CACHE_L1_MAX_ITEMS) con TTL por entrada. Un hit
+  no paga round trip de red.
+- L2: Redis, compartido por todos los workers. Un hit en L2 rellena L1.
+- Cache negativa: los resultados None se guardan con un TTL propio.
+- Stale-if-error: una entrada vencida se sigue sirviendo durante una
+  ventana extra si la fuente falla con ServicioNoDisponibleError.
+- Invalidacion: `invalidate()` borra L1 y L2 y publica las claves en un
+  canal pub/sub para que cada worker descarte su copia en L1.
+- Los valores se entregan como copia profunda (listas y dicts anidados,
+  ej. los fieldData de cada registro): un consumidor que los modifique no
+  altera lo cacheado en L1.
+
+Uso:
+    @staticmethod
+    @cached(ttl=3600, key=lambda pacient_id: f"fm:paciente:{pacient_id}")
+    async def get_pacient_by_id(pacient_id: str): ...
+"""
+import asyncio
+import functools
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Type, Union
+
+from app.config import get_settings
+from app.services import redis as redis_svc
+from app.exceptions import ServicioNoDisponibleError
+
+logger = logging.getLogger(__name__)
+
+# Canal pub/sub para invalidar L1 en todos los workers
+_CANAL_INVALIDACION = "cache:invalidate"
+
+
+@dataclass
+class _Entrada:
+    """Valor cacheado con su vencimiento y el limite para servirlo stale (epoch)."""
+    valor: Any
+    expira_en: float
+    stale_hasta: float
+
+    def vigente(self, ahora: float) -> bool:
+        return self.expira_en > ahora
+
+    def servible_stale(self, ahora: float) -> bool:
+        return self.stale_hasta > ahora
+
+
+class LRUCache:
+    """LRU acotado en memoria. Descarta la entrada menos usada al llenarse."""
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._datos: "OrderedDict[str, _Entrada]" = OrderedDict()
+        self.evicciones = 0
+
+    def __len__(self) -> int:
+        return len(self._datos)
+
+    def get(self, clave: str) -> Optional[_Entrada]:
+        entrada = self._datos.get(clave)
+        if entrada is None:
+            return None
+        if not entrada.servible_stale(time.time()):
+            del self._datos[clave]
+            return None
+        self._datos.move_to_end(clave)
+        return entrada
+
+    def set(self, clave: str, entrada: _Entrada):
+        self._datos[clave] = entrada
+        self._datos.move_to_end(clave)
+        while len(self._datos) > self.max_items:
+            self._datos.popitem(last=False)
+            self.evicciones += 1
+
+    def delete(self, clave: str):
+        self._datos.pop(clave, None)
+
+    def clear(self):
+        self._datos.clear()
+
+
+_l1: Optional[LRUCache] = None
+_listener_task: Optional[asyncio.Task] = None
+
+# Callbacks por prefijo de clave, ejecutados al recibir una invalidacion
+_listeners: List[Tuple[str, Callable[[str], None]]] = []
+
+_stats: Dict[str, int] = {
+    "l1_hits": 0,
+    "l2_hits": 0,
+    "misses": 0,
+    "negativos": 0,
+    "stale_servidos": 0,
+    "invalidaciones": 0,
+}
+
+
+def _get_l1() -> LRUCache:
+    global _l1
+    if _l1 is None:
+        _l1 = LRUCache(get_settings().CACHE_L1_MAX_ITEMS)
+    return _l1
+
+
+# ──────────────────────────────────────────────
+# Lectura / escritura
+# ──────────────────────────────────────────────
+
+async def _leer(clave: str) -> Optional[_Entrada]:
+    """Busca la entrada en L1 y luego en L2 (rellenando L1)."""
+    entrada = _get_l1().get(clave)
+    if entrada is not None:
+        _stats["l1_hits"] += 1
+        return entrada
+
+    try:
+        raw = await redis_svc.get_json(clave)
+    except Exception as e:
+        logger.debug("Cache L2 no disponible al leer '%s': %s", clave, e)
+        raw = None
+
+    if not isinstance(raw, dict) or "e" not in raw:
+        _stats["misses"] += 1
+        return None
+
+    entrada = _Entrada(valor=raw.get("v"), expira_en=raw["e"], stale_hasta=raw.get("s", raw["e"]))
+    if not entrada.servible_stale(time.time()):
+        _stats["misses"] += 1
+        return None
+
+    _stats["l2_hits"] += 1
+    _get_l1().set(clave, entrada)
+    return entrada
+
+
+def _copia(valor: Any) -> Any:
+    """
+    Copia profunda de un valor JSON (listas y dicts anidados): L1 comparte el
+    mismo objeto entre requests. Los valores son JSON-serializables (L2), asi
+    que basta recorrer contenedores; ~4x mas rapido que copy.deepcopy.
+    """
+    if isinstance(valor, list):
+        return [_copia(v) for v in valor]
+    if isinstance(valor, dict):
+        return {k: _copia(v) for k, v in valor.items()}
+    return valor
+
+
+async def _escribir(clave: str, valor: Any, ttl: int, stale_ttl: int = 0):
+    """Guarda el valor en L1 y L2."""
+    ahora = time.time()
+    entrada = _Entrada(valor=valor, expira_en=ahora + ttl, stale_hasta=ahora + ttl + stale_ttl)
+    _get_l1().set(clave, entrada)
+
+    try:
+        await redis_svc.set_json(
+            clave,
+            {"v": valor, "e": entrada.expira_en, "s": entrada.stale_hasta},
+            ttl=ttl + stale_ttl,
+        )
+    except Exception as e:
+        logger.debug("Cache L2 no disponible al escribir '%s': %s", clave, e)
+
+
+async def obtener(clave: str) -> Optional[Any]:
+    """Retorna el valor vigente de una clave (L1 o L2), o None."""
+    entrada = await _leer(clave)
+    if entrada is None or not entrada.vigente(time.time()):
+        return None
+    return _copia(entrada.valor)
+
+
+async def guardar(clave: str, valor: Any, ttl: int, stale_ttl: int = 0, propagar: bool = False):
+    """
+    Guarda un valor JSON-serializable en ambos niveles.
+
+    Con `propagar`, los demas workers descartan su copia en L1 y leen el
+    valor nuevo desde L2 (ej. un token renovado antes de su TTL).
+    """
+    await _escribir(clave, _copia(valor), ttl, stale_ttl)
+    if propagar:
+        try:
+            await redis_svc.publish(_CANAL_INVALIDACION, json.dumps([clave]))
+        except Exception as e:
+            logger.warning("No se pudo propagar el reemplazo de '%s': %s", clave, e)
+
+
+async def invalidate(*claves: str):
+    """Elimina claves de L1 y L2, y avisa a los demas workers por pub/sub."""
+    if not claves:
+        return
+
+    for clave in claves:
+        _invalidar_local(clave)
+
+    try:
+        for clave in claves:
+            await redis_svc.delete(clave)
+        await redis_svc.publish(_CANAL_INVALIDACION, json.dumps(list(claves)))
+    except Exception as e:
+        logger.warning("No se pudo propagar invalidacion de %s: %s", claves, e)
+
+
+def on_invalidate(prefijo: str, callback: Callable[[str], None]):
+    """Registra un callback para las invalidaciones de claves con un prefijo."""
+    _listeners.append((prefijo, callback))
+
+
+def _invalidar_local(clave: str):
+    _get_l1().delete(clave)
+    _stats["invalidaciones"] += 1
+    for prefijo, callback in _listeners:
+        if clave.startswith(prefijo):
+            try:
+                callback(clave)
+            except Exception:
+                logger.exception("Error en listener de invalidacion para '%s'", clave)
+
+
+# ──────────────────────────────────────────────
+# Decorador
+# ──────────────────────────────────────────────
+
+def cached(
+    ttl: Union[int, Callable[[], int]],
+    key: Callable[..., str],
+    ttl_negativo: Optional[int] = None,
+    stale_if_error: int = 0,
+    excepciones_stale: Tuple[Type[Exception], ...] = (ServicioNoDisponibleError,),
+):
+    """
+    Decorador para cachear funciones async en L1 + L2.
+
+    Args:
+        ttl: Segundos de vigencia de un resultado, o funcion sin argumentos que
+             los retorna (para leerlos de la configuracion en cada escritura).
+        key: Funcion que recibe los mismos argumentos y retorna la clave.
+        ttl_negativo: Si se indica, los resultados None se cachean por este TTL.
+        stale_if_error: Segundos extra en que un valor vencido se sirve si la
+                        funcion falla con alguna de `excepciones_stale`.
+    """
+    def decorator(func: Callable[..., Awaitable[Any]]):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            clave = key(*args, **kwargs)
+            entrada = await _leer(clave)
+            ahora = time.time()
+
+            if entrada is not None and entrada.vigente(ahora):
+                if entrada.valor is None:
+                    _stats["negativos"] += 1
+                return _copia(entrada.valor)
+
+            try:
+                valor = await func(*args, **kwargs)
+            except excepciones_stale as e:
+                if entrada is not None and entrada.servible_stale(ahora):
+                    _stats["stale_servidos"] += 1
+                    logger.warning("Sirviendo '%s' desde cache vencida: %s", clave, e)
+                    return _copia(entrada.valor)
+                raise
+
+            if valor is None:
+                if ttl_negativo:
+                    await _escribir(clave, None, ttl_negativo)
+            else:
+                await _escribir(clave, _copia(valor), ttl() if callable(ttl) else ttl, stale_if_error)
+            return valor
+
+        return wrapper
+    return decorator
+
+
+# ──────────────────────────────────────────────
+# Invalidacion distribuida
+# ──────────────────────────────────────────────
+
+async def start():
+    """Inicia la suscripcion al canal de invalidaciones."""
+    global _listener_task
+    if _listener_task is None:
+        _listener_task = asyncio.create_task(_escuchar_invalidaciones())
+
+
+async def stop():
+    """Detiene la suscripcion al canal de invalidaciones."""
+    global _listener_task
+    if _listener_task is None:
+        return
+    _listener_task.cancel()
+    try:
+        await _listener_task
+    except asyncio.CancelledError:
+        pass
+    _listener_task = None
+
+
+async def _escuchar_invalidaciones():
+    """Escucha el canal pub/sub y descarta de L1 las claves invalidadas."""
+    while True:
+        pubsub = None
+        try:
+            pubsub = redis_svc.pubsub()
+            await pubsub.subscribe(_CANAL_INVALIDACION)
+            logger.info("Suscrito a invalidaciones de cache")
+            async for mensaje in pubsub.listen():
+                if mensaje.get("type") != "message":
+                    continue
+                for clave in json.loads(mensaje["data"]):
+                    _invalidar_local(clave)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Mientras no estemos suscritos, L1 podria quedar desactualizado
+            _get_l1().clear()
+            logger.warning("Suscripcion de invalidaciones interrumpida: %s. Reintentando...", e)
+            await asyncio.sleep(1.0)
+        finally:
+            if pubsub is not None:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+
+def get_stats() -> dict:
+    """Retorna contadores de hits/misses y el tamaño actual de L1."""
+    l1 = _get_l1()
+    return {**_stats, "l1_items": len(l1), "l1_evicciones": l1.evicciones}
@@ -1,27 +1,63 @@
 import logging
 from datetime import datetime
+from typing import Optional
 
 import httpx
 import pytz
 
+from app import metrics
 from app.config import get_settings
 from app.auth.models import User
-from app.services import redis as redis_svc
 from app.services import http as http_svc
+from app.services import cache
+from app.services.cache import cached
+from app.services.ultimo_valido import con_respaldo
 from app.exceptions import ServicioNoDisponibleError
-from app.utils.retry import con_reintentos
-from app.utils.circuit_breaker import CircuitBreaker, CircuitBreakerAbierto
+from app.utils.retry import PoliticaReintentos, con_reintentos
+from app.utils import deadline
+from app.utils import latencia
+from app.utils import tracing
+from app.utils.hedging import PresupuestoCobertura, con_cobertura
+from app.utils.circuit_breaker import CircuitBreakerDistribuido, CircuitBreakerAbierto
 
 logger = logging.getLogger(__name__)
 
-# Circuit breaker para proteger llamadas a FileMaker
-_fm_circuit_breaker = CircuitBreaker(
+# Circuit breaker (compartido entre workers) para proteger llamadas a FileMaker
+_fm_circuit_breaker = CircuitBreakerDistribuido(
     nombre="filemaker",
     umbral_fallos=5,
     timeout_recuperacion=30.0,
     excepciones_monitoreadas=(httpx.RequestError, httpx.HTTPStatusError, ServicioNoDisponibleError),
 )
 
+# Politicas de reintento (backoff con full jitter y presupuesto global de reintentos)
+_POLITICA_TOKEN = PoliticaReintentos(max_intentos=3, backoff_base=1.0)
+_POLITICA_LECTURA = PoliticaReintentos(max_intentos=2, backoff_base=1.0)
+_POLITICA_CREACION = PoliticaReintentos(
+    max_intentos=2,
+    backoff_base=1.0,
+    excepciones_reintentables=frozenset({httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout}),
+)
+
+# Presupuesto compartido de requests de cobertura (hedging)
+_presupuesto_cobertura: Optional[PresupuestoCobertura] = None
+
+
+def _get_presupuesto_cobertura() -> PresupuestoCobertura:
+    global _presupuesto_cobertura
+    if _presupuesto_cobertura is None:
+        _presupuesto_cobertura = PresupuestoCobertura(get_settings().FM_HEDGE_BUDGET_PERCENT)
+    return _presupuesto_cobertura
+
+
+def _ttl_agenda() -> int:
+    return get_settings().FM_AGENDA_CACHE_TTL_SECONDS
+
+
+def _fecha_hoy() -> str:
+    """Fecha de hoy en Chile, en el formato de FileMaker (MM-DD-YYYY)."""
+    return datetime.now(pytz.timezone("America/Santiago")).strftime("%m-%d-%Y")
+
 
 def _es_sin_registros(resp: httpx.Response) -> bool:
     """Verifica si la respuesta de FileMaker indica 'sin registros encontrados'."""
@@ -33,54 +69,98 @@ def _es_sin_registros(resp: httpx.Response) -> bool:
         return False
 
 
+def _user_desde_field_data(user_data: dict, phone: str) -> User:
+    """Construye un User desde el fieldData del layout de autenticacion."""
+    user_id = str(user_data.get('XUsuarioRRHH_Pk', ''))
+    nombre = user_data.get('Nombre')
+    apellido = user_data.get('Apellido', '')
+    rol_str = user_data.get('ROL', '').lower().strip()
+    return User(phone=phone, id=user_id, name=nombre, last_name=apellido, role=rol_str)
+
+
 class FileMakerService:
     @classmethod
     async def get_token(cls, force_refresh: bool = False) -> str:
         if not force_refresh:
-            cached = await redis_svc.get("fm:token")
-            if cached:
-                return cached
+            token_cacheado = await cache.obtener("fm:token")
+            if token_cacheado:
+                return token_cacheado
 
         async def _solicitar_token():
             settings = get_settings()
-            client = http_svc.get_client()
-            url = f"https://{settings.FM_HOST}/fmi/data/v1/databases/{settings.FM_DB}/sessions"
-            resp = await client.post(url, auth=(settings.FM_USER, settings.FM_PASS), json={})
+            client = http_svc.get_client(http_svc.FM)
+            url = f"{settings.FM_SCHEME}://{settings.FM_HOST}/fmi/data/v1/databases/{settings.FM_DB}/sessions"
+            hist = latencia.historial(http_svc.FM, "get_token")
+            with hist.medir(), tracing.span("filemaker.get_token", fase="filemaker"):
+                resp = await client.post(
+                    url, auth=(settings.FM_USER, settings.FM_PASS), json={},
+                    timeout=deadline.timeout_httpx(client, "FileMaker get_token", read=hist.timeout_sugerido()),
+                )
             resp.raise_for_status()
             return resp.json()['response']['token']
 
-        token = await con_reintentos(
-            _solicitar_token,
-            max_intentos=3,
-            backoff_base=1.0,
-            nombre_operacion="FileMaker get_token",
-        )
+        # Solo se mide la ida a FileMaker, no el token servido desde cache
+        with metrics.cronometro(metrics.FM_LATENCIA, operacion="get_token"):
+            token = await con_reintentos(
+                _solicitar_token,
+                politica=_POLITICA_TOKEN,
+                nombre_operacion="FileMaker get_token",
+            )
 
-        await redis_svc.set("fm:token", token, ttl=840)  # 14 minutos
+        # Un refresh forzado (401) reemplaza el token en todos los workers, no solo en este
+        await cache.guardar("fm:token", token, ttl=840, propagar=force_refresh)  # 14 minutos
         return token
 
     @classmethod
-    async def _fm_find(cls, layout: str, query: dict, intentar_reauth: bool = True) -> httpx.Response:
+    async def _fm_find(
+        cls, layout: str, query: dict, intentar_reauth: bool = True, cobertura: Optional[str] = None,
+    ) -> httpx.Response:
         """
         Ejecuta una busqueda en FileMaker con reintento automatico de token.
         Si recibe HTTP 401, refresca el token y reintenta una vez.
+
+        Con `cobertura` (nombre de la operacion) la lectura se cubre con una
+        segunda request si tarda mas que el p90 observado para esa operacion.
+        Solo para lecturas idempotentes.
+
+        El timeout de lectura se adapta a la latencia observada de la operacion.
         """
         settings = get_settings()
-        client = http_svc.get_client()
+        client = http_svc.get_client(http_svc.FM)
         token = await cls.get_token()
-        url = f"https://{settings.FM_HOST}/fmi/data/v1/databases/{settings.FM_DB}/layouts/{layout}/_find"
+        url = f"{settings.FM_SCHEME}://{settings.FM_HOST}/fmi/data/v1/databases/{settings.FM_DB}/layouts/{layout}/_find"
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {token}",
         }
 
-        async with _fm_circuit_breaker:
-            resp = await client.post(url, json=query, headers=headers)
+        hist = latencia.historial(http_svc.FM, cobertura or f"find:{layout}")
+
+        operacion = f"FileMaker find {layout}"
+
+        async def _post() -> httpx.Response:
+            # Fuera del breaker: quedarse sin tiempo de turno no es una falla de FileMaker
+            timeout, acotado = deadline.timeout_acotado(client, operacion, read=hist.timeout_sugerido())
+            async with _fm_circuit_breaker:
+                with hist.medir(), tracing.span("filemaker.find", fase="filemaker", layout=layout), \
+                        deadline.timeout_del_turno(operacion, acotado):
+                    return await client.post(url, json=query, headers=headers, timeout=timeout)
+
+        if cobertura is None:
+            resp = await _post()
+        else:
+            resp = await con_cobertura(
+                _post,
+                hist,
+                _get_presupuesto_cobertura(),
+                espera_minima=settings.FM_HEDGE_MIN_DELAY_MS / 1000,
+                habilitado=settings.FM_HEDGE_ENABLED,
+            )
 
         if resp.status_code == 401 and intentar_reauth:
             logger.info("Token FM expirado, refrescando...")
             await cls.get_token(force_refresh=True)
-            return await cls._fm_find(layout, query, intentar_reauth=False)
+            return await cls._fm_find(layout, query, intentar_reauth=False, cobertura=cobertura)
 
         return resp
 
@@ -91,17 +171,22 @@ class FileMakerService:
         Si recibe HTTP 401, refresca el token y reintenta una vez.
         """
         settings = get_settings()
-        client = http_svc.get_client()
+        client = http_svc.get_client(http_svc.FM)
         token = await cls.get_token()
-        url = f"https://{settings.FM_HOST}/fmi/data/v1/databases/{settings.FM_DB}/layouts/{layout}/records"
+        url = f"{settings.FM_SCHEME}://{settings.FM_HOST}/fmi/data/v1/databases/{settings.FM_DB}/layouts/{layout}/records"
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {token}",
         }
         payload = {"fieldData": field_data}
 
+        hist = latencia.historial(http_svc.FM, f"create:{layout}")
+        operacion = f"FileMaker create {layout}"
+        timeout, acotado = deadline.timeout_acotado(client, operacion, read=hist.timeout_sugerido())
         async with _fm_circuit_breaker:
-            resp = await client.post(url, json=payload, headers=headers)
+            with hist.medir(), tracing.span("filemaker.create", fase="filemaker", layout=layout), \
+                    deadline.timeout_del_turno(operacion, acotado):
+                resp = await client.post(url, json=payload, headers=headers, timeout=timeout)
 
         if resp.status_code == 401 and intentar_reauth:
             logger.info("Token FM expirado, refrescando...")
@@ -111,6 +196,7 @@ class FileMakerService:
         return resp
 
     @staticmethod
+    @metrics.medir(metrics.FM_LATENCIA, operacion="create_recado")
     async def create_recado(doctor_id: str, texto: str, categoria: str, fecha: str, hora: str) -> bool:
         """
         Crea un recado en FileMaker.
@@ -140,16 +226,18 @@ class FileMakerService:
                 settings.FM_RECADOS_CREATE_LAYOUT, field_data
             )
             if resp.status_code in (200, 201):
+                await cache.invalidate(f"fm:recados:{doctor_id}")
                 return True
             raise ServicioNoDisponibleError(
                 "FileMaker", f"create_recado: HTTP {resp.status_code}"
             )
 
         try:
+            # Solo se reintenta si la request no llego a enviarse: tras un
+            # timeout de lectura el recado pudo haberse creado igual
             return await con_reintentos(
                 _crear,
-                max_intentos=2,
-                backoff_base=1.0,
+                politica=_POLITICA_CREACION,
                 nombre_operacion="FileMaker create_recado",
             )
         except ServicioNoDisponibleError:
@@ -162,6 +250,52 @@ class FileMakerService:
             logger.error("Error inesperado al crear recado: %s", e)
             raise ServicioNoDisponibleError("FileMaker", f"Error inesperado: {e}")
 
+    @staticmethod
+    @metrics.medir(metrics.FM_LATENCIA, operacion="existe_recado")
+    async def existe_recado(doctor_id: str, texto: str, fecha: str, hora: str) -> bool:
+        """
+        Verifica si un recado ya fue creado en FileMaker (doctor + fecha + hora
+        + texto). Se usa antes de reintentar una creacion que pudo haber
+        llegado a FileMaker aunque la respuesta se perdiera.
+        """
+        settings = get_settings()
+        query = {
+            "query": [
+                {
+                    "_FK_IDRRHH": f"=={doctor_id}",
+                    "FechaRecado": fecha,
+                    "HoraRecado": hora,
+                }
+            ]
+        }
+
+        async def _buscar():
+            resp = await FileMakerService._fm_find(settings.FM_RECADOS_CREATE_LAYOUT, query)
+            return await FileMakerService._parsear_respuesta_find(resp, "existe_recado")
+
+        try:
+            registros = await con_reintentos(
+                _buscar,
+                politica=_POLITICA_LECTURA,
+                nombre_operacion="FileMaker existe_recado",
+            )
+        except ServicioNoDisponibleError:
+            raise
+        except CircuitBreakerAbierto as e:
+            raise ServicioNoDisponibleError("FileMaker", str(e))
+        except httpx.RequestError as e:
+            raise ServicioNoDisponibleError("FileMaker", f"Error de conexion: {e}")
+        except Exception as e:
+            logger.error("Error inesperado al verificar recado: %s", e)
+            raise ServicioNoDisponibleError("FileMaker", f"Error inesperado: {e}")
+
+        # FileMaker puede normalizar el salto de linea del texto
+        normalizado = texto.replace("\r", "\n").strip()
+        return any(
+            r.get("fieldData", {}).get("texto_Recado", "").replace("\r", "\n").strip() == normalizado
+            for r in registros
+        )
+
     @staticmethod
     async def _parsear_respuesta_find(resp: httpx.Response, contexto: str) -> list:
         """Parsea respuesta de _fm_find, diferenciando datos vacios de errores."""
@@ -174,11 +308,13 @@ class FileMakerService:
         raise ServicioNoDisponibleError("FileMaker", f"{contexto}: HTTP {resp.status_code}")
 
     @staticmethod
+    @con_respaldo(lambda id, date=None: f"agenda:{id}:{date or _fecha_hoy()}")
+    @cached(ttl=_ttl_agenda, key=lambda id, date=None: f"fm:agenda:{id}:{date or _fecha_hoy()}")
+    @metrics.medir(metrics.FM_LATENCIA, operacion="get_agenda_raw")
     async def get_agenda_raw(id: str, date: str = None) -> list:
         """Obtiene datos crudos de agenda desde FileMaker."""
         settings = get_settings()
-        tz = pytz.timezone("America/Santiago")
-        today_str = date if date else datetime.now(tz).strftime("%m-%d-%Y")
+        today_str = date if date else _fecha_hoy()
 
         query = {
             "query": [
@@ -190,14 +326,13 @@ class FileMakerService:
         }
 
         async def _buscar():
-            resp = await FileMakerService._fm_find(settings.FM_AGENDA_LAYOUT, query)
+            resp = await FileMakerService._fm_find(settings.FM_AGENDA_LAYOUT, query, cobertura="get_agenda_raw")
             return await FileMakerService._parsear_respuesta_find(resp, "get_agenda_raw")
 
         try:
             return await con_reintentos(
                 _buscar,
-                max_intentos=2,
-                backoff_base=1.0,
+                politica=_POLITICA_LECTURA,
                 nombre_operacion="FileMaker get_agenda_raw",
             )
         except ServicioNoDisponibleError:
@@ -211,11 +346,13 @@ class FileMakerService:
             raise ServicioNoDisponibleError("FileMaker", f"Error inesperado: {e}")
 
     @staticmethod
+    @con_respaldo(lambda date=None: f"agenda:all:{date or _fecha_hoy()}")
+    @cached(ttl=_ttl_agenda, key=lambda date=None: f"fm:agenda:all:{date or _fecha_hoy()}")
+    @metrics.medir(metrics.FM_LATENCIA, operacion="get_agenda_all_doctors")
     async def get_agenda_all_doctors(date: str = None) -> list:
         """Obtiene agenda de TODOS los doctores para una fecha dada."""
         settings = get_settings()
-        tz = pytz.timezone("America/Santiago")
-        today_str = date if date else datetime.now(tz).strftime("%m-%d-%Y")
+        today_str = date if date else _fecha_hoy()
 
         query = {
             "query": [
@@ -227,14 +364,15 @@ class FileMakerService:
         }
 
         async def _buscar():
-            resp = await FileMakerService._fm_find(settings.FM_AGENDA_LAYOUT, query)
+            resp = await FileMakerService._fm_find(
+                settings.FM_AGENDA_LAYOUT, query, cobertura="get_agenda_all_doctors"
+            )
             return await FileMakerService._parsear_respuesta_find(resp, "get_agenda_all_doctors")
 
         try:
             return await con_reintentos(
                 _buscar,
-                max_intentos=2,
-                backoff_base=1.0,
+                politica=_POLITICA_LECTURA,
                 nombre_operacion="FileMaker get_agenda_all_doctors",
             )
         except ServicioNoDisponibleError:
@@ -247,11 +385,12 @@ class FileMakerService:
             logger.error("Error inesperado al obtener agenda general: %s", e)
             raise ServicioNoDisponibleError("FileMaker", f"Error inesperado: {e}")
     @staticmethod
+    @cached(ttl=300, key=lambda date=None: f"fm:bloqueados:{date or _fecha_hoy()}", stale_if_error=3600)
+    @metrics.medir(metrics.FM_LATENCIA, operacion="get_dias_bloqueados")
     async def get_dias_bloqueados(date: str = None) -> list:
         """Obtiene dias bloqueados de TODOS los doctores para una fecha dada."""
         settings = get_settings()
-        tz = pytz.timezone("America/Santiago")
-        today_str = date if date else datetime.now(tz).strftime("%m-%d-%Y")
+        today_str = date if date else _fecha_hoy()
 
         query = {
             "query": [
@@ -269,8 +408,7 @@ class FileMakerService:
         try:
             return await con_reintentos(
                 _buscar,
-                max_intentos=2,
-                backoff_base=1.0,
+                politica=_POLITICA_LECTURA,
                 nombre_operacion="FileMaker get_dias_bloqueados",
             )
         except ServicioNoDisponibleError:
@@ -284,6 +422,9 @@ class FileMakerService:
             raise ServicioNoDisponibleError("FileMaker", f"Error inesperado: {e}")
 
     @staticmethod
+    @con_respaldo(lambda doctor_id: f"recados:{doctor_id}")
+    @cached(ttl=60, key=lambda doctor_id: f"fm:recados:{doctor_id}")
+    @metrics.medir(metrics.FM_LATENCIA, operacion="get_recados")
     async def get_recados(doctor_id: str) -> list:
         """Obtiene recados de un doctor por su ID de FileMaker."""
         settings = get_settings()
@@ -298,14 +439,13 @@ class FileMakerService:
         }
 
         async def _buscar():
-            resp = await FileMakerService._fm_find(settings.FM_RECADOS_LAYOUT, query)
+            resp = await FileMakerService._fm_find(settings.FM_RECADOS_LAYOUT, query, cobertura="get_recados")
             return await FileMakerService._parsear_respuesta_find(resp, "get_recados")
 
         try:
             return await con_reintentos(
                 _buscar,
-                max_intentos=2,
-                backoff_base=1.0,
+                politica=_POLITICA_LECTURA,
                 nombre_operacion="FileMaker get_recados",
             )
         except ServicioNoDisponibleError:
@@ -319,6 +459,7 @@ class FileMakerService:
             raise ServicioNoDisponibleError("FileMaker", f"Error inesperado: {e}")
 
     @staticmethod
+    @metrics.medir(metrics.FM_LATENCIA, operacion="get_user_by_phone")
     async def get_user_by_phone(phone: str):
         """Busca usuario por telefono en FileMaker."""
         settings = get_settings()
@@ -331,17 +472,12 @@ class FileMakerService:
         }
 
         async def _buscar():
-            resp = await FileMakerService._fm_find(settings.FM_AUTH_LAYOUT, query)
+            resp = await FileMakerService._fm_find(settings.FM_AUTH_LAYOUT, query, cobertura="get_user_by_phone")
 
             if resp.status_code == 200:
                 data = resp.json()['response']['data']
                 if data:
-                    user_data = data[0]['fieldData']
-                    user_id = str(user_data.get('XUsuarioRRHH_Pk', ''))
-                    nombre = user_data.get('Nombre')
-                    apellido = user_data.get('Apellido', '')
-                    rol_str = user_data.get('ROL', '').lower().strip()
-                    return User(phone=phone, id=user_id, name=nombre, last_name=apellido, role=rol_str)
+                    return _user_desde_field_data(data[0]['fieldData'], phone)
                 return None
 
             if resp.status_code == 500 and _es_sin_registros(resp):
@@ -352,8 +488,7 @@ class FileMakerService:
         try:
             return await con_reintentos(
                 _buscar,
-                max_intentos=2,
-                backoff_base=1.0,
+                politica=_POLITICA_LECTURA,
                 nombre_operacion="FileMaker get_user_by_phone",
             )
         except ServicioNoDisponibleError:
@@ -367,6 +502,54 @@ class FileMakerService:
             raise ServicioNoDisponibleError("FileMaker", f"Error inesperado: {e}")
 
     @staticmethod
+    @metrics.medir(metrics.FM_LATENCIA, operacion="get_all_users")
+    async def get_all_users() -> list:
+        """Obtiene el directorio completo de usuarios con telefono (AuthUsuarios_dapi)."""
+        settings = get_settings()
+        query = {
+            "query": [
+                {
+                    "Telefono": "*",
+                }
+            ],
+            "limit": 1000
+        }
+
+        async def _buscar():
+            resp = await FileMakerService._fm_find(settings.FM_AUTH_LAYOUT, query)
+            data = await FileMakerService._parsear_respuesta_find(resp, "get_all_users")
+            usuarios = []
+            for record in data:
+                field_data = record.get('fieldData', {})
+                telefono = str(field_data.get('Telefono', '')).strip()
+                if telefono:
+                    usuarios.append(_user_desde_field_data(field_data, telefono))
+            return usuarios
+
+        try:
+            return await con_reintentos(
+                _buscar,
+                politica=_POLITICA_LECTURA,
+                nombre_operacion="FileMaker get_all_users",
+            )
+        except ServicioNoDisponibleError:
+            raise
+        except CircuitBreakerAbierto as e:
+            raise ServicioNoDisponibleError("FileMaker", str(e))
+        except httpx.RequestError as e:
+            raise ServicioNoDisponibleError("FileMaker", f"Error de conexion: {e}")
+        except Exception as e:
+            logger.error("Error inesperado al obtener directorio de usuarios: %s", e)
+            raise ServicioNoDisponibleError("FileMaker", f"Error inesperado: {e}")
+
+    @staticmethod
+    @cached(
+        ttl=3600,
+        key=lambda pacient_id: f"fm:paciente:{pacient_id}",
+        ttl_negativo=300,
+        stale_if_error=86400,
+    )
+    @metrics.medir(metrics.FM_LATENCIA, operacion="get_pacient_by_id")
     async def get_pacient_by_id(pacient_id: str) -> str | None:
         """Busca paciente por ID en FileMaker. Retorna el nombre completo o None."""
         settings = get_settings()
@@ -395,8 +578,7 @@ class FileMakerService:
         try:
             return await con_reintentos(
                 _buscar,
-                max_intentos=2,
-                backoff_base=1.0,
+                politica=_POLITICA_LECTURA,
                 nombre_operacion="FileMaker get_pacient_by_id",
             )
         except ServicioNoDisponibleError:
@@ -407,4 +589,9 @@ class FileMakerService:
             raise ServicioNoDisponibleError("FileMaker", f"Error de conexion: {e}")
         except Exception as e:
             logger.error("Error inesperado al buscar paciente: %s", e)
-            raise ServicioNoDisponibleError("FileMaker", f"Error inesperado: {e}")
\ No newline at end of file
+            raise ServicioNoDisponibleError("FileMaker", f"Error inesperado: {e}")
+
+    @staticmethod
+    def get_hedging_stats() -> dict:
+        """Coberturas lanzadas, ganadas y negadas por presupuesto (el p90 esta en latencias)."""
+        return dict(_get_presupuesto_cobertura().stats)
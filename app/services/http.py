@@ -1,38 +1,211 @@
 """
-Cliente HTTP compartido (httpx.AsyncClient singleton).
-Reutiliza conexiones TCP+TLS para FileMaker y WhatsApp APIs.
+Clientes HTTP por upstream (un httpx.AsyncClient por servicio externo).
+
+Cada upstream tiene su propio pool, timeouts y keep-alive, para que una
+dependencia lenta (ej: completions largos de OpenAI) no agote las
+conexiones de las demas:
+
+    fm      -> FileMaker Data API
+    meta    -> Meta Graph API (WhatsApp)
+    openai  -> OpenAI Chat Completions
+
+HTTP/2 se habilita en los upstreams que lo soportan si el paquete `h2`
+esta instalado (httpx[http2]); si no, se usa HTTP/1.1.
+
+Cada pool reporta conexiones en uso y el tiempo que las requests esperan
+por una conexion libre (medido con la extension "trace" de httpcore).
 """
 import logging
-from typing import Optional
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict
 
 import httpx
 
+from app.config import get_settings
+
 logger = logging.getLogger(__name__)
 
-_client: Optional[httpx.AsyncClient] = None
+FM = "fm"
+META = "meta"
+OPENAI = "openai"
+
+# Muestras de espera por pool usadas para promedio y maximo
+_MUESTRAS_ESPERA = 200
+
+
+@dataclass(frozen=True)
+class ConfigPool:
+    """Limites y timeouts de un pool."""
+    max_connections: int
+    read_timeout: float
+    http2: bool
+    connect_timeout: float = 10.0
+    write_timeout: float = 10.0
+    pool_timeout: float = 10.0
+
+
+class _TransporteMedido(httpx.AsyncHTTPTransport):
+    """
+    Transporte que mide la espera por conexion del pool.
+
+    La espera termina con el primer evento trace de httpcore (conexion TCP
+    nueva o envio de headers por una conexion reutilizada), que solo ocurre
+    una vez que el pool asigno una conexion a la request.
+    """
+
+    def __init__(self, nombre: str, http2: bool, **kwargs):
+        super().__init__(http2=http2, **kwargs)
+        self.nombre = nombre
+        self.http2 = http2
+        self.esperando = 0
+        self.requests_total = 0
+        self.pool_timeouts = 0
+        self.esperas: Deque[float] = deque(maxlen=_MUESTRAS_ESPERA)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        inicio = time.perf_counter()
+        asignada = False
+        trace_original = request.extensions.get("trace")
+
+        async def _trace(evento: str, info: dict):
+            nonlocal asignada
+            if not asignada:
+                asignada = True
+                self.esperando -= 1
+                self.esperas.append(time.perf_counter() - inicio)
+            if trace_original is not None:
+                await trace_original(evento, info)
+
+        request.extensions["trace"] = _trace
+        self.requests_total += 1
+        self.esperando += 1
+        try:
+            return await super().handle_async_request(request)
+        except httpx.PoolTimeout:
+            self.pool_timeouts += 1
+            logger.warning("Pool HTTP '%s' agotado: timeout esperando conexion", self.nombre)
+            raise
+        finally:
+            if not asignada:
+                self.esperando -= 1
+
+    def get_stats(self) -> dict:
+        conexiones = self._pool.connections
+        en_uso = sum(1 for c in conexiones if not c.is_idle())
+        esperas = list(self.esperas)
+        return {
+            "conexiones_abiertas": len(conexiones),
+            "conexiones_en_uso": en_uso,
+            "requests_esperando": self.esperando,
+            "requests_total": self.requests_total,
+            "pool_timeouts": self.pool_timeouts,
+            "espera_promedio_ms": round(sum(esperas) / len(esperas) * 1000, 2) if esperas else 0.0,
+            "espera_max_ms": round(max(esperas) * 1000, 2) if esperas else 0.0,
+        }
+
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_transportes: Dict[str, _TransporteMedido] = {}
+_configs: Dict[str, ConfigPool] = {}
+
+
+def _http2_disponible() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _configs_desde_settings() -> Dict[str, ConfigPool]:
+    settings = get_settings()
+    return {
+        FM: ConfigPool(
+            max_connections=settings.HTTP_FM_MAX_CONNECTIONS,
+            read_timeout=settings.HTTP_FM_READ_TIMEOUT,
+            # FileMaker Server atiende la Data API solo sobre HTTP/1.1
+            http2=False,
+        ),
+        META: ConfigPool(
+            max_connections=settings.HTTP_META_MAX_CONNECTIONS,
+            read_timeout=settings.HTTP_META_READ_TIMEOUT,
+            http2=settings.HTTP2_ENABLED,
+        ),
+        OPENAI: ConfigPool(
+            max_connections=settings.HTTP_OPENAI_MAX_CONNECTIONS,
+            read_timeout=settings.HTTP_OPENAI_READ_TIMEOUT,
+            http2=settings.HTTP2_ENABLED,
+        ),
+    }
 
 
 async def init():
-    """Inicializa el cliente HTTP con pool de conexiones."""
-    global _client
-    _client = httpx.AsyncClient(
-        timeout=httpx.Timeout(connect=10.0, read=30.0, write=10.0, pool=10.0),
-        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
-    )
-    logger.info("Cliente HTTP inicializado")
+    """Inicializa un cliente HTTP con pool propio para cada upstream."""
+    settings = get_settings()
+    h2_ok = _http2_disponible()
+
+    for nombre, config in _configs_desde_settings().items():
+        http2 = config.http2 and h2_ok
+        if config.http2 and not h2_ok:
+            logger.warning("Paquete 'h2' no instalado: pool '%s' usara HTTP/1.1", nombre)
+
+        limits = httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_connections,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+        )
+        transporte = _TransporteMedido(nombre, http2=http2, limits=limits)
+        _clients[nombre] = httpx.AsyncClient(
+            transport=transporte,
+            timeout=httpx.Timeout(
+                connect=config.connect_timeout,
+                read=config.read_timeout,
+                write=config.write_timeout,
+                pool=config.pool_timeout,
+            ),
+        )
+        _transportes[nombre] = transporte
+        _configs[nombre] = config
+        logger.info(
+            "Cliente HTTP '%s' inicializado (max_conexiones=%d, read_timeout=%.0fs, http2=%s)",
+            nombre, config.max_connections, config.read_timeout, http2,
+        )
 
 
 async def close():
-    """Cierra el cliente HTTP y libera conexiones."""
-    global _client
-    if _client:
-        await _client.aclose()
-        _client = None
-        logger.info("Cliente HTTP cerrado")
-
-
-def get_client() -> httpx.AsyncClient:
-    """Retorna el cliente HTTP, lanzando error si no esta inicializado."""
-    if _client is None:
-        raise RuntimeError("Cliente HTTP no inicializado. Llamar a init() primero.")
-    return _client
+    """Cierra todos los clientes HTTP y libera conexiones."""
+    for nombre, client in list(_clients.items()):
+        await client.aclose()
+        logger.info("Cliente HTTP '%s' cerrado", nombre)
+    _clients.clear()
+    _transportes.clear()
+    _configs.clear()
+
+
+def get_client(nombre: str) -> httpx.AsyncClient:
+    """Retorna el cliente HTTP del upstream, lanzando error si no esta inicializado."""
+    client = _clients.get(nombre)
+    if client is None:
+        raise RuntimeError(f"Cliente HTTP '{nombre}' no inicializado. Llamar a init() primero.")
+    return client
+
+
+def peor_caso_request(nombre: str) -> float:
+    """Segundos maximos de una request al upstream: espera de pool + connect + write + read."""
+    config = _configs.get(nombre) or _configs_desde_settings()[nombre]
+    return config.pool_timeout + config.connect_timeout + config.write_timeout + config.read_timeout
+
+
+def get_stats() -> Dict[str, dict]:
+    """Retorna, por pool, conexiones en uso y tiempos de espera por conexion."""
+    return {
+        nombre: {
+            "max_conexiones": _configs[nombre].max_connections,
+            "http2": transporte.http2,
+            **transporte.get_stats(),
+        }
+        for nombre, transporte in _transportes.items()
+    }
+
@@ -6,13 +6,24 @@ import json
 import logging
 from typing import Any, Dict, List, Optional
 
+import httpx
+
 from app.config import get_settings
 from app.services import http as http_svc
 from app.exceptions import ServicioNoDisponibleError
+from app.utils import deadline
+from app.utils import latencia
+from app.utils.circuit_breaker import CircuitBreakerDistribuido, CircuitBreakerAbierto
 
 logger = logging.getLogger(__name__)
 
-OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
+# Solo errores de conexion y 5xx cuentan como fallo (un 429 no indica caida)
+_openai_circuit_breaker = CircuitBreakerDistribuido(
+    nombre="openai",
+    umbral_fallos=5,
+    timeout_recuperacion=30.0,
+    excepciones_monitoreadas=(httpx.RequestError, ServicioNoDisponibleError),
+)
 
 
 async def chat_completion(
@@ -39,7 +50,7 @@ async def chat_completion(
     if not settings.OPENAI_API_KEY:
         raise ServicioNoDisponibleError("OpenAI", "OPENAI_API_KEY no configurada")
 
-    client = http_svc.get_client()
+    client = http_svc.get_client(http_svc.OPENAI)
 
     headers = {
         "Content-Type": "application/json",
@@ -55,13 +66,26 @@ async def chat_completion(
     if tools:
         payload["tools"] = tools
 
+    # Timeout de lectura adaptado a la latencia observada (p99 x factor). Una
+    # misma operacion cubre respuestas cortas y largas, asi que lleva un piso alto
+    hist = latencia.historial(http_svc.OPENAI, "chat_completion")
+    read = hist.timeout_sugerido(piso=settings.OPENAI_MIN_READ_TIMEOUT)
+
     try:
-        resp = await client.post(
-            OPENAI_API_URL,
-            json=payload,
-            headers=headers,
-            timeout=30.0,
-        )
+        # Fuera del breaker: quedarse sin tiempo de turno no es una falla de OpenAI
+        timeout, acotado = deadline.timeout_acotado(client, "OpenAI", read=read)
+        async with _openai_circuit_breaker:
+            with hist.medir(), deadline.timeout_del_turno("OpenAI", acotado):
+                resp = await client.post(
+                    f"{settings.OPENAI_API_BASE_URL}/chat/completions",
+                    json=payload,
+                    headers=headers,
+                    timeout=timeout,
+                )
+
+            if resp.status_code >= 500:
+                logger.error("Error del servidor OpenAI: HTTP %d", resp.status_code)
+                raise ServicioNoDisponibleError("OpenAI", f"Error del servidor: HTTP {resp.status_code}")
 
         if resp.status_code == 200:
             data = resp.json()
@@ -72,16 +96,15 @@ async def chat_completion(
             logger.warning("OpenAI rate limit alcanzado")
             raise ServicioNoDisponibleError("OpenAI", "Rate limit alcanzado")
 
-        if resp.status_code >= 500:
-            logger.error("Error del servidor OpenAI: HTTP %d", resp.status_code)
-            raise ServicioNoDisponibleError("OpenAI", f"Error del servidor: HTTP {resp.status_code}")
-
         # Otros errores
         logger.error("Error inesperado de OpenAI: HTTP %d — %s", resp.status_code, resp.text[:200])
         raise ServicioNoDisponibleError("OpenAI", f"HTTP {resp.status_code}")
 
     except ServicioNoDisponibleError:
         raise
+    except CircuitBreakerAbierto as e:
+        logger.warning("OpenAI no disponible (circuit breaker abierto): %s", e)
+        raise ServicioNoDisponibleError("OpenAI", "Circuit breaker abierto")
     except Exception as e:
         logger.error("Error de conexion con OpenAI: %s", e)
         raise ServicioNoDisponibleError("OpenAI", f"Error de conexion: {e}")
@@ -0,0 +1,234 @@
+"""
+Notificaciones de recados a la jefa de enfermería (CHIEF_NURSE_PHONE).
+
+En vez de enviar una plantilla por recado desde el request del doctor, las
+notificaciones pasan por un agregador compartido en Redis:
+
+- Inactivo: si no se notificó nada en la última ventana
+  (NURSE_DIGEST_WINDOW_SECONDS), el recado se envía de inmediato y se abre
+  una ventana nueva.
+- Bajo carga: dentro de la ventana los recados se acumulan en una lista
+  Redis y, al cerrarse, salen juntos en un resumen. Si no caben en el
+  cuerpo de una plantilla se envían en varias partes, sin cortar recados.
+- Idempotencia: cada recado se registra con SET NX bajo su clave del
+  outbox (`idempotency_key`, una por recado); un reintento del mismo recado
+  dentro de NURSE_NOTIFY_DEDUP_SECONDS no vuelve a notificar. Dos recados
+  distintos con el mismo texto se notifican ambos. Los recados sin outbox
+  (ej. "Bloquear agenda") usan una clave derivada del doctor, la categoría,
+  el día y el texto. Si el envío falla la marca se borra, para que un
+  reintento sí notifique.
+
+Si Redis no responde se envía directo: es preferible una notificación
+duplicada a una perdida.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+import pytz
+
+from app import metrics
+from app.config import get_settings
+from app.services import redis as redis_svc
+from app.services.whatsapp import WhatsAppService
+from app.services.whatsapp_dispatcher import NOTIFICACION
+
+logger = logging.getLogger(__name__)
+
+_TEMPLATE = "reenviar_recado_secretaria"
+
+# Recados acumulados esperando el cierre de la ventana
+_PENDIENTES_KEY = "nurse:digest:pending"
+
+# Existe mientras la ventana de agregación está abierta
+_VENTANA_KEY = "nurse:digest:window"
+
+# Los parametros de plantilla de Meta tienen largo limitado
+_MAX_HEADER = 60
+_MAX_BODY = 1000
+
+# Toma y borra todos los pendientes de forma atómica (un solo worker los envía)
+_TOMAR_PENDIENTES_LUA = """
+local items = redis.call('LRANGE', KEYS[1], 0, -1)
+redis.call('DEL', KEYS[1])
+return items
+"""
+
+_flush_task: Optional[asyncio.Task] = None
+
+
+def _idempotencia_key(clave: str) -> str:
+    return f"nurse:notified:{clave}"
+
+
+def _clave_contenido(user, categoria: str, mensaje: str) -> str:
+    """Clave estable de un recado sin outbox: mismo doctor, categoría y texto en el día."""
+    fecha = datetime.now(pytz.timezone("America/Santiago")).strftime("%Y-%m-%d")
+    digest = hashlib.sha256(f"{user.id}|{categoria}|{fecha}|{mensaje}".encode()).hexdigest()[:32]
+    return f"contenido:{digest}"
+
+
+async def notificar_recado(user, categoria: str, mensaje: str, idempotency_key: Optional[str] = None):
+    """
+    Notifica un recado a enfermería: inmediato si el agregador está
+    inactivo, o dentro del próximo resumen si hay una ventana abierta.
+
+    `idempotency_key` es la clave del recado en el outbox; para los recados
+    que no pasan por FileMaker (ej. "Bloquear agenda") se deriva del contenido.
+    """
+    settings = get_settings()
+    clave = idempotency_key or _clave_contenido(user, categoria, mensaje)
+    recado = {"doctor": user.name, "categoria": categoria, "mensaje": mensaje, "clave": clave}
+
+    try:
+        nuevo = await redis_svc.set_nx(
+            _idempotencia_key(clave), "1",
+            ttl=settings.NURSE_NOTIFY_DEDUP_SECONDS,
+        )
+        if not nuevo:
+            metrics.IDEMPOTENCIA_DESCARTES.labels(origen="notificacion_enfermeria").inc()
+            logger.info("Recado de %s ya notificado a enfermeria, se omite duplicado", user.name)
+            return
+
+        abierta = await redis_svc.set_nx(_VENTANA_KEY, "1", ttl=settings.NURSE_DIGEST_WINDOW_SECONDS)
+        if not abierta:
+            await redis_svc.rpush(_PENDIENTES_KEY, json.dumps(recado))
+            logger.info("Recado de %s acumulado para el resumen de enfermeria", user.name)
+            return
+
+        # Ventana nueva: enviar ahora, junto con lo que haya quedado de la anterior
+        crudos = await redis_svc.eval_script(_TOMAR_PENDIENTES_LUA, [_PENDIENTES_KEY], [])
+        recados = [json.loads(raw) for raw in crudos or []] + [recado]
+    except Exception as e:
+        logger.warning("Agregador de notificaciones no disponible, envio directo: %s", e)
+        recados = [recado]
+
+    await _liberar(await _enviar(recados))
+
+
+async def _liberar(recados: List[dict]):
+    """Borra la marca de idempotencia de recados cuyo envío falló."""
+    for recado in recados:
+        if not recado.get("clave"):
+            continue
+        try:
+            await redis_svc.delete(_idempotencia_key(recado["clave"]))
+        except Exception as e:
+            logger.warning("No se pudo liberar la marca del recado de %s: %s", recado["doctor"], e)
+
+
+async def _enviar(recados: List[dict]) -> List[dict]:
+    """Envía un recado individual o un resumen con varios. Retorna los que no se entregaron."""
+    telefono = get_settings().CHIEF_NURSE_PHONE
+
+    if len(recados) == 1:
+        recado = recados[0]
+        enviado = await WhatsAppService.send_template(
+            telefono,
+            recado["doctor"],
+            _TEMPLATE,
+            include_header=False,
+            include_body=False,
+            header_params=[recado["categoria"]],
+            body_params=[recado["doctor"], recado["mensaje"]],
+            prioridad=NOTIFICACION,
+        )
+        return [] if enviado else [recado]
+
+    fallidos: List[dict] = []
+    partes = _partir_resumen(recados)
+    for i, parte in enumerate(partes, 1):
+        doctores = list(dict.fromkeys(r["doctor"] for r in parte))
+        cuerpo = " | ".join(_linea(r) for r in parte)
+        header = f"{len(parte)} recados" if len(partes) == 1 else f"{len(parte)} recados ({i}/{len(partes)})"
+
+        enviado = await WhatsAppService.send_template(
+            telefono,
+            doctores[0],
+            _TEMPLATE,
+            include_header=False,
+            include_body=False,
+            header_params=[header[:_MAX_HEADER]],
+            body_params=[", ".join(doctores), cuerpo],
+            prioridad=NOTIFICACION,
+        )
+        if not enviado:
+            fallidos.extend(parte)
+    logger.info("Resumen de %d recados enviado a enfermeria en %d parte(s)", len(recados), len(partes))
+    return fallidos
+
+
+def _linea(recado: dict) -> str:
+    linea = f"{recado['doctor']} ({recado['categoria']}): {recado['mensaje']}"
+    # Un recado que por si solo excede el cuerpo es lo unico que se recorta
+    if len(linea) > _MAX_BODY:
+        linea = linea[:_MAX_BODY - 3] + "..."
+    return linea
+
+
+def _partir_resumen(recados: List[dict]) -> List[List[dict]]:
+    """Agrupa los recados en partes cuyo cuerpo (" | ".join) cabe en _MAX_BODY."""
+    partes: List[List[dict]] = []
+    actual: List[dict] = []
+    largo = 0
+    for recado in recados:
+        extra = len(_linea(recado)) + (3 if actual else 0)
+        if actual and largo + extra > _MAX_BODY:
+            partes.append(actual)
+            actual, largo = [], 0
+            extra = len(_linea(recado))
+        actual.append(recado)
+        largo += extra
+    if actual:
+        partes.append(actual)
+    return partes
+
+
+async def _flush():
+    """Si la ventana se cerró y hay pendientes, envía el resumen y abre otra ventana."""
+    settings = get_settings()
+    if not await redis_svc.llen(_PENDIENTES_KEY):
+        return
+    if not await redis_svc.set_nx(_VENTANA_KEY, "1", ttl=settings.NURSE_DIGEST_WINDOW_SECONDS):
+        return
+
+    crudos = await redis_svc.eval_script(_TOMAR_PENDIENTES_LUA, [_PENDIENTES_KEY], [])
+    if not crudos:
+        # Otro worker se llevó los pendientes: no retener la ventana
+        await redis_svc.delete(_VENTANA_KEY)
+        return
+    await _liberar(await _enviar([json.loads(raw) for raw in crudos]))
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(1.0)
+        try:
+            await _flush()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Error enviando resumen de recados a enfermeria")
+
+
+async def start():
+    """Inicia el loop que envía los resúmenes al cerrarse cada ventana."""
+    global _flush_task
+    if _flush_task is None:
+        _flush_task = asyncio.create_task(_flush_loop())
+
+
+async def stop():
+    """Detiene el loop de resúmenes (los pendientes quedan en Redis)."""
+    global _flush_task
+    if _flush_task is None:
+        return
+    _flush_task.cancel()
+    try:
+        await _flush_task
+    except asyncio.CancelledError:
+        pass
+    _flush_task = None
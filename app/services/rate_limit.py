@@ -0,0 +1,138 @@
+"""
+Rate limiting por telefono, rol y ruta con token buckets atomicos en Redis.
+
+Rutas:
+    global -> Todo mensaje entrante, antes de autenticar (RATE_LIMIT_MAX/WINDOW).
+              Descarta floods antes de cualquier trabajo en FileMaker u OpenAI.
+    texto  -> Mensajes de texto (pueden gatillar llamadas al LLM).
+    boton  -> Botones e interacciones (mas baratos, limite mas holgado).
+
+Los limites por rol/ruta se configuran en RATE_LIMIT_RULES como CSV de
+reglas "rol:ruta=capacidad/ventana", donde '*' actua como comodin:
+
+    RATE_LIMIT_RULES="*:texto=15/60,*:boton=30/60,gerencia:texto=30/60"
+
+Se aplica la regla mas especifica (rol:ruta > *:ruta > limite global).
+"""
+import logging
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+from app import metrics
+from app.config import get_settings
+from app.services import redis as redis_svc
+
+logger = logging.getLogger(__name__)
+
+RUTA_GLOBAL = "global"
+RUTA_TEXTO = "texto"
+RUTA_BOTON = "boton"
+
+_COMODIN = "*"
+
+
+@dataclass(frozen=True)
+class LimiteRate:
+    """Capacidad del bucket y segundos en que se recarga por completo."""
+    capacidad: int
+    ventana: int
+
+
+@dataclass(frozen=True)
+class ResultadoRateLimit:
+    """Resultado de consumir un token: si se permite y la cuota restante."""
+    permitido: bool
+    restantes: int
+    reintentar_en: float
+    limite: LimiteRate
+
+
+# Contadores en proceso para observabilidad
+_stats: Dict[str, int] = {"permitidos": 0, "rechazados": 0}
+
+
+@lru_cache()
+def _parsear_reglas(reglas_csv: str) -> Dict[Tuple[str, str], LimiteRate]:
+    """Parsea RATE_LIMIT_RULES. Las reglas invalidas se ignoran con warning."""
+    reglas: Dict[Tuple[str, str], LimiteRate] = {}
+    for regla in reglas_csv.split(","):
+        regla = regla.strip()
+        if not regla:
+            continue
+        try:
+            selector, limite = regla.split("=", 1)
+            rol, ruta = selector.split(":", 1)
+            capacidad, ventana = limite.split("/", 1)
+            capacidad, ventana = int(capacidad), int(ventana)
+            # Con capacidad o ventana 0 el token bucket divide por cero en cada mensaje
+            if capacidad <= 0 or ventana <= 0:
+                raise ValueError("capacidad y ventana deben ser positivas")
+            reglas[(rol.strip().lower(), ruta.strip().lower())] = LimiteRate(
+                capacidad=capacidad, ventana=ventana,
+            )
+        except ValueError:
+            logger.warning("Regla de rate limit invalida ignorada: '%s'", regla)
+    return reglas
+
+
+def resolver_limite(ruta: str, rol: Optional[str] = None) -> LimiteRate:
+    """Retorna el limite aplicable a una ruta y rol (regla mas especifica)."""
+    settings = get_settings()
+    ruta = ruta.lower().strip()
+
+    if ruta != RUTA_GLOBAL:
+        reglas = _parsear_reglas(settings.RATE_LIMIT_RULES)
+        if rol:
+            especifica = reglas.get((rol.lower().strip(), ruta))
+            if especifica:
+                return especifica
+        general = reglas.get((_COMODIN, ruta))
+        if general:
+            return general
+
+    return LimiteRate(capacidad=settings.RATE_LIMIT_MAX, ventana=settings.RATE_LIMIT_WINDOW)
+
+
+def _key(phone: str, ruta: str) -> str:
+    # Tambien la ruta global lleva prefijo: "ratelimit:{phone}" era un
+    # contador INCR (string) y usarlo como hash da WRONGTYPE tras un deploy
+    return f"ratelimit:{ruta}:{phone}"
+
+
+async def verificar(phone: str, ruta: str = RUTA_GLOBAL, rol: Optional[str] = None) -> ResultadoRateLimit:
+    """
+    Consume un token del bucket (telefono, ruta) en un solo round trip.
+
+    Returns:
+        ResultadoRateLimit con el veredicto y la cuota restante.
+    """
+    limite = resolver_limite(ruta, rol)
+    permitido, restantes, espera = await redis_svc.token_bucket(
+        _key(phone, ruta), limite.capacidad, limite.ventana,
+    )
+
+    _stats["permitidos" if permitido else "rechazados"] += 1
+    if not permitido:
+        metrics.RATE_LIMIT_RECHAZOS.labels(ruta=ruta).inc()
+        logger.warning(
+            "Rate limit excedido para %s (ruta=%s, rol=%s, limite=%d/%ds, reintentar en %.1fs)",
+            phone, ruta, rol or "-", limite.capacidad, limite.ventana, espera,
+        )
+    else:
+        logger.debug(
+            "Rate limit %s (ruta=%s): %d/%d restantes",
+            phone, ruta, restantes, limite.capacidad,
+        )
+
+    return ResultadoRateLimit(
+        permitido=permitido,
+        restantes=restantes,
+        reintentar_en=espera,
+        limite=limite,
+    )
+
+
+def get_stats() -> dict:
+    """Retorna los contadores de decisiones de rate limit de este proceso."""
+    return dict(_stats)
@@ -0,0 +1,282 @@
+"""
+Outbox de recados (write-behind a FileMaker).
+
+El doctor recibe la confirmación apenas el recado queda en un Redis Stream
+(recados:outbox); un worker de fondo lo escribe en FM_RECADOS_CREATE_LAYOUT.
+
+- Idempotencia: cada recado lleva una clave generada al encolarlo. Tras
+  crearlo se marca como hecho en Redis, y antes de cualquier reintento se
+  verifica en FileMaker si el recado ya existe (la creación pudo llegar a
+  FileMaker aunque la respuesta se perdiera). Así un reintento nunca
+  duplica un recado.
+- Reintentos: una entrada sin ACK se vuelve a reclamar (XAUTOCLAIM) tras
+  RECADOS_OUTBOX_RETRY_SECONDS, también si el worker que la tenía murió.
+- En vuelo: la creación se hace con un lock por clave (SET NX PX,
+  RECADOS_OUTBOX_LOCK_SECONDS). Una creación lenta puede seguir en curso
+  cuando otro consumer reclama la entrada; ese consumer la deja pendiente
+  en vez de crearla de nuevo antes de que FileMaker muestre el registro.
+- Dead-letter: tras RECADOS_OUTBOX_MAX_ATTEMPTS fallos la entrada pasa a
+  la lista recados:outbox:dead y se avisa al doctor. `replay_recados.py`
+  las re-encola una vez resuelto el problema.
+
+Si Redis no está disponible al encolar, el recado se crea de forma
+síncrona como antes.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from typing import Dict, Optional
+
+from app import metrics
+from app.config import get_settings
+from app.services import http as http_svc
+from app.services import redis as redis_svc
+from app.services.filemaker import FileMakerService
+from app.services.whatsapp import WhatsAppService
+from app.services.whatsapp_dispatcher import NOTIFICACION
+from app.exceptions import ServicioNoDisponibleError
+
+logger = logging.getLogger(__name__)
+
+_STREAM = "recados:outbox"
+_GRUPO = "recados-writers"
+_DEAD_LETTER_KEY = "recados:outbox:dead"
+
+# El stream se recorta de forma aproximada a este largo (entradas ya confirmadas)
+_STREAM_MAXLEN = 10000
+
+# Las marcas de idempotencia y contadores de intentos viven un dia
+_TTL_MARCAS = 86400
+
+_LOTE = 10
+
+# Toma y borra todas las entradas del dead-letter de forma atómica
+_TOMAR_DEAD_LETTERS_LUA = """
+local items = redis.call('LRANGE', KEYS[1], 0, -1)
+redis.call('DEL', KEYS[1])
+return items
+"""
+
+# Libera el lock de creacion solo si sigue siendo de este intento
+_LIBERAR_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Creacion de un recado en el peor caso: token + reautenticacion + 2 intentos
+# de creacion (_POLITICA_CREACION), mas el backoff entre ellos
+_REQUESTS_POR_CREACION = 4
+_BACKOFF_CREACION = 2.0
+
+_CONSUMER = f"{socket.gethostname()}:{os.getpid()}"
+
+_worker_task: Optional[asyncio.Task] = None
+
+
+def _hecho_key(clave: str) -> str:
+    return f"recados:outbox:done:{clave}"
+
+
+def _intentos_key(clave: str) -> str:
+    return f"recados:outbox:attempts:{clave}"
+
+
+def _lock_key(clave: str) -> str:
+    return f"recados:outbox:inflight:{clave}"
+
+
+async def encolar(
+    doctor_id: str, phone: str, texto: str, categoria: str, fecha: str, hora: str,
+) -> str:
+    """
+    Encola un recado para crearlo en FileMaker en segundo plano.
+
+    Returns:
+        La clave de idempotencia del recado.
+
+    Raises:
+        ServicioNoDisponibleError: Si Redis no responde y la creación
+        síncrona en FileMaker también falla.
+    """
+    clave = uuid.uuid4().hex
+    campos = {
+        "idempotency_key": clave,
+        "doctor_id": doctor_id,
+        "phone": phone,
+        "texto": texto,
+        "categoria": categoria,
+        "fecha": fecha,
+        "hora": hora,
+    }
+
+    try:
+        await redis_svc.xadd(_STREAM, campos, maxlen=_STREAM_MAXLEN)
+    except Exception as e:
+        logger.warning("Outbox de recados no disponible, creando en FileMaker directo: %s", e)
+        await FileMakerService.create_recado(
+            doctor_id=doctor_id, texto=texto, categoria=categoria, fecha=fecha, hora=hora,
+        )
+        return clave
+
+    logger.info("Recado %s encolado para doctor %s", clave, doctor_id)
+    return clave
+
+
+async def _procesar(entry_id: str, campos: Dict[str, str]):
+    """Crea en FileMaker un recado del outbox, sin duplicarlo en reintentos."""
+    settings = get_settings()
+    clave = campos["idempotency_key"]
+
+    # Otro consumer la esta creando: queda pendiente hasta que confirme o falle
+    token = uuid.uuid4().hex
+    if not await redis_svc.set_nx_ms(_lock_key(clave), token, int(settings.RECADOS_OUTBOX_LOCK_SECONDS * 1000)):
+        logger.info("Recado %s en creacion por otro consumer, se omite el reclamo", clave)
+        return
+
+    try:
+        await _crear(entry_id, campos, clave)
+    finally:
+        await redis_svc.eval_script(_LIBERAR_LOCK_LUA, [_lock_key(clave)], [token])
+
+
+async def _crear(entry_id: str, campos: Dict[str, str], clave: str):
+    settings = get_settings()
+
+    # Con el lock tomado: la marca de hecho ya refleja cualquier creacion anterior
+    if await redis_svc.get(_hecho_key(clave)):
+        metrics.IDEMPOTENCIA_DESCARTES.labels(origen="recados_outbox").inc()
+        await redis_svc.xack(_STREAM, _GRUPO, entry_id)
+        return
+
+    intento = await redis_svc.incr(_intentos_key(clave), ttl=_TTL_MARCAS)
+    try:
+        # En un reintento (o replay) la creacion anterior pudo haber llegado a FileMaker
+        ya_intentado = intento > 1 or campos.get("replay") == "1"
+        if ya_intentado and await FileMakerService.existe_recado(
+            campos["doctor_id"], campos["texto"], campos["fecha"], campos["hora"],
+        ):
+            logger.info("Recado %s ya existia en FileMaker, no se vuelve a crear", clave)
+        else:
+            await FileMakerService.create_recado(
+                doctor_id=campos["doctor_id"],
+                texto=campos["texto"],
+                categoria=campos["categoria"],
+                fecha=campos["fecha"],
+                hora=campos["hora"],
+            )
+    except ServicioNoDisponibleError as e:
+        if intento >= settings.RECADOS_OUTBOX_MAX_ATTEMPTS:
+            await _dead_letter(entry_id, campos, str(e))
+        else:
+            # Sin ACK: la entrada se vuelve a reclamar tras RECADOS_OUTBOX_RETRY_SECONDS
+            logger.warning(
+                "Recado %s no se pudo crear (intento %d/%d): %s",
+                clave, intento, settings.RECADOS_OUTBOX_MAX_ATTEMPTS, e,
+            )
+        return
+
+    await redis_svc.set(_hecho_key(clave), "1", ttl=_TTL_MARCAS)
+    await redis_svc.xack(_STREAM, _GRUPO, entry_id)
+    logger.info("Recado %s creado en FileMaker (intento %d)", clave, intento)
+
+
+async def _dead_letter(entry_id: str, campos: Dict[str, str], error: str):
+    """Mueve un recado agotado al dead-letter y avisa al doctor."""
+    await redis_svc.rpush(_DEAD_LETTER_KEY, json.dumps({**campos, "error": error}))
+    await redis_svc.xack(_STREAM, _GRUPO, entry_id)
+    logger.error("Recado %s movido a dead-letter: %s", campos["idempotency_key"], error)
+
+    mensaje = campos["texto"].split("\r", 1)[-1]
+    await WhatsAppService.send_message(
+        campos["phone"],
+        "No pudimos registrar tu recado en FileMaker:\n\n"
+        f"_{mensaje}_\n\n"
+        "El equipo técnico lo revisará. Si es urgente, comunícate directamente con enfermería.",
+        prioridad=NOTIFICACION,
+    )
+
+
+async def _worker_loop():
+    settings = get_settings()
+    reintento_ms = int(settings.RECADOS_OUTBOX_RETRY_SECONDS * 1000)
+    grupo_creado = False
+
+    while True:
+        try:
+            if not grupo_creado:
+                await redis_svc.xgroup_create(_STREAM, _GRUPO)
+                grupo_creado = True
+
+            # Primero los pendientes vencidos (fallidos o de workers caidos)
+            entradas = await redis_svc.xautoclaim(_STREAM, _GRUPO, _CONSUMER, reintento_ms, _LOTE)
+            if not entradas:
+                entradas = await redis_svc.xreadgroup(_GRUPO, _CONSUMER, _STREAM, _LOTE, block_ms=5000)
+            for entry_id, campos in entradas:
+                await _procesar(entry_id, campos)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Error en worker del outbox de recados")
+            await asyncio.sleep(1.0)
+
+
+def _verificar_lock():
+    """Avisa si el lock puede vencer antes que una creacion lenta (habria duplicados)."""
+    peor_caso = _REQUESTS_POR_CREACION * http_svc.peor_caso_request(http_svc.FM) + _BACKOFF_CREACION
+    lock = get_settings().RECADOS_OUTBOX_LOCK_SECONDS
+    if lock <= peor_caso:
+        logger.warning(
+            "RECADOS_OUTBOX_LOCK_SECONDS=%.0f es menor que el peor caso de una creacion en FileMaker "
+            "(%.0fs): un reclamo podria duplicar recados",
+            lock, peor_caso,
+        )
+
+
+async def start():
+    """Inicia el worker que escribe los recados en FileMaker."""
+    global _worker_task
+    _verificar_lock()
+    if _worker_task is None:
+        _worker_task = asyncio.create_task(_worker_loop())
+        logger.info("Worker del outbox de recados iniciado (consumer=%s)", _CONSUMER)
+
+
+async def stop():
+    """Detiene el worker (las entradas sin ACK las retoma otro worker)."""
+    global _worker_task
+    if _worker_task is None:
+        return
+    _worker_task.cancel()
+    try:
+        await _worker_task
+    except asyncio.CancelledError:
+        pass
+    _worker_task = None
+
+
+async def reprocesar_dead_letters() -> int:
+    """
+    Re-encola todos los recados del dead-letter con su clave original (el
+    chequeo de idempotencia evita duplicados). Retorna cuántos se re-encolaron.
+    """
+    crudos = await redis_svc.eval_script(_TOMAR_DEAD_LETTERS_LUA, [_DEAD_LETTER_KEY], [])
+    for raw in crudos or []:
+        campos = json.loads(raw)
+        campos.pop("error", None)
+        campos["replay"] = "1"
+        await redis_svc.delete(_intentos_key(campos["idempotency_key"]))
+        await redis_svc.xadd(_STREAM, campos, maxlen=_STREAM_MAXLEN)
+    return len(crudos or [])
+
+
+async def get_stats() -> dict:
+    """Entradas pendientes de escribir en FileMaker y en dead-letter."""
+    return {
+        "pendientes": await redis_svc.xpending_count(_STREAM, _GRUPO),
+        "dead_letter": await redis_svc.llen(_DEAD_LETTER_KEY),
+    }
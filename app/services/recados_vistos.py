@@ -0,0 +1,42 @@
+"""
+Marca por doctor de los recados ya revisados (modo "solo nuevos").
+
+Los hilos de texto_Recado solo crecen agregando entradas arriba, asi que
+basta guardar cuantas entradas tenia cada recado ({recordId: cantidad}) la
+ultima vez que el doctor los reviso: lo nuevo son las primeras
+`actual - vistas` entradas de cada hilo.
+
+La marca se guarda en Redis (compartida entre workers) con TTL
+RECADOS_VISTOS_TTL_SECONDS y se reemplaza completa en cada revision, por
+lo que los recados que dejaron de estar vigentes salen solos. Si Redis no
+responde, la revision muestra todo y la marca no se actualiza.
+"""
+import logging
+from typing import Dict
+
+from app.config import get_settings
+from app.services import redis as redis_svc
+
+logger = logging.getLogger(__name__)
+
+
+def _key(doctor_id: str) -> str:
+    return f"recados_vistos:{doctor_id}"
+
+
+async def obtener(doctor_id: str) -> Dict[str, int]:
+    """{recordId: entradas vistas} de la ultima revision ({} si no hay marca)."""
+    try:
+        vistos = await redis_svc.get_json(_key(doctor_id))
+    except Exception as e:
+        logger.warning("No se pudo leer la marca de recados vistos de %s: %s", doctor_id, e)
+        return {}
+    return vistos or {}
+
+
+async def registrar(doctor_id: str, conteos: Dict[str, int]):
+    """Guarda los conteos de la revision actual como nueva marca."""
+    try:
+        await redis_svc.set_json(_key(doctor_id), conteos, ttl=get_settings().RECADOS_VISTOS_TTL_SECONDS)
+    except Exception as e:
+        logger.warning("No se pudo guardar la marca de recados vistos de %s: %s", doctor_id, e)
@@ -4,7 +4,7 @@ Provee conexion asincrona y metodos utilitarios para get/set con TTL.
 """
 import json
 import logging
-from typing import Any, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import redis.asyncio as aioredis
 
@@ -12,6 +12,9 @@ logger = logging.getLogger(__name__)
 
 _redis: Optional[aioredis.Redis] = None
 
+# Scripts Lua registrados (se invocan por SHA, cargandolos si Redis no los tiene)
+_scripts: Dict[str, Any] = {}
+
 
 async def init(url: str):
     """Inicializa la conexion a Redis."""
@@ -27,6 +30,7 @@ async def close():
     if _redis:
         await _redis.close()
         _redis = None
+        _scripts.clear()
         logger.info("Conexion a Redis cerrada")
 
 
@@ -50,11 +54,175 @@ async def set(key: str, value: str, ttl: Optional[int] = None):
         await _get_client().set(key, value)
 
 
+async def get_set(key: str, value: str, ttl: int) -> Optional[str]:
+    """Guarda un valor con TTL y retorna el anterior (None si no existia), en un MULTI/EXEC."""
+    async with _get_client().pipeline(transaction=True) as pipe:
+        pipe.get(key)
+        pipe.setex(key, ttl, value)
+        anterior, _ = await pipe.execute()
+    return anterior
+
+
 async def delete(key: str):
     """Elimina una clave."""
     await _get_client().delete(key)
 
 
+async def mget(keys: List[str]) -> List[Optional[str]]:
+    """Obtiene varios valores string en un solo round trip."""
+    if not keys:
+        return []
+    return await _get_client().mget(keys)
+
+
+async def set_nx(key: str, value: str, ttl: int) -> bool:
+    """Guarda un valor solo si la clave no existe. Retorna True si se guardo."""
+    return bool(await _get_client().set(key, value, ex=ttl, nx=True))
+
+
+async def set_nx_ms(key: str, value: str, ttl_ms: int) -> bool:
+    """SET NX con TTL en milisegundos. Retorna True si la clave no existia."""
+    return bool(await _get_client().set(key, value, nx=True, px=ttl_ms))
+
+
+async def zadd(key: str, mapping: Dict[str, float]):
+    """Agrega (o actualiza el score de) miembros en un sorted set."""
+    await _get_client().zadd(key, mapping)
+
+
+async def zrem(key: str, *members: str):
+    """Elimina miembros de un sorted set."""
+    await _get_client().zrem(key, *members)
+
+
+async def zcard(key: str) -> int:
+    """Retorna la cantidad de miembros de un sorted set."""
+    return await _get_client().zcard(key)
+
+
+async def rpush(key: str, *values: str) -> int:
+    """Agrega valores al final de una lista. Retorna el largo resultante."""
+    return await _get_client().rpush(key, *values)
+
+
+async def llen(key: str) -> int:
+    """Retorna el largo de una lista."""
+    return await _get_client().llen(key)
+
+
+async def lrange(key: str, start: int, end: int) -> List[str]:
+    """Retorna un rango de elementos de una lista."""
+    return await _get_client().lrange(key, start, end)
+
+
+async def incr(key: str, ttl: Optional[int] = None) -> int:
+    """Incrementa un contador y (opcionalmente) renueva su TTL."""
+    async with _get_client().pipeline(transaction=True) as pipe:
+        pipe.incr(key)
+        if ttl:
+            pipe.expire(key, ttl)
+        resultados = await pipe.execute()
+    return resultados[0]
+
+
+async def xadd(stream: str, fields: Dict[str, str], maxlen: Optional[int] = None) -> str:
+    """Agrega una entrada a un stream (recortado aproximadamente a maxlen)."""
+    return await _get_client().xadd(stream, fields, maxlen=maxlen, approximate=True)
+
+
+async def xgroup_create(stream: str, group: str):
+    """Crea un consumer group (y el stream si no existe). Idempotente."""
+    try:
+        await _get_client().xgroup_create(stream, group, id="0", mkstream=True)
+    except aioredis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def xreadgroup(
+    group: str, consumer: str, stream: str, count: int, block_ms: int,
+) -> List[Tuple[str, Dict[str, str]]]:
+    """Lee entradas nuevas de un stream para un consumer group."""
+    respuesta = await _get_client().xreadgroup(group, consumer, {stream: ">"}, count=count, block=block_ms)
+    if not respuesta:
+        return []
+    return respuesta[0][1]
+
+
+async def xautoclaim(
+    stream: str, group: str, consumer: str, min_idle_ms: int, count: int,
+) -> List[Tuple[str, Dict[str, str]]]:
+    """Reclama entradas pendientes (sin ACK) ociosas por mas de min_idle_ms."""
+    respuesta = await _get_client().xautoclaim(stream, group, consumer, min_idle_ms, count=count)
+    # Entradas borradas del stream vuelven como None
+    return [(entry_id, campos) for entry_id, campos in respuesta[1] if campos]
+
+
+async def xack(stream: str, group: str, *ids: str):
+    """Confirma entradas procesadas de un consumer group."""
+    await _get_client().xack(stream, group, *ids)
+
+
+async def xpending_count(stream: str, group: str) -> int:
+    """Cantidad de entradas entregadas y aun sin ACK en un consumer group."""
+    try:
+        info = await _get_client().xpending(stream, group)
+    except aioredis.ResponseError:
+        return 0
+    return info["pending"]
+
+
+async def publish(channel: str, message: str):
+    """Publica un mensaje en un canal pub/sub."""
+    await _get_client().publish(channel, message)
+
+
+def pubsub() -> aioredis.client.PubSub:
+    """Crea un objeto PubSub para suscribirse a canales."""
+    return _get_client().pubsub(ignore_subscribe_messages=True)
+
+
+async def eval_script(script: str, keys: List[str], args: List[Any]) -> Any:
+    """
+    Ejecuta un script Lua de forma atomica en Redis.
+    El script se registra una sola vez y luego se invoca por SHA (EVALSHA).
+    """
+    registrado = _scripts.get(script)
+    if registrado is None:
+        registrado = _get_client().register_script(script)
+        _scripts[script] = registrado
+    return await registrado(keys=keys, args=args)
+
+
+async def hget(key: str, field: str) -> Optional[str]:
+    """Obtiene un campo de un hash."""
+    return await _get_client().hget(key, field)
+
+
+async def hgetall(key: str) -> Dict[str, str]:
+    """Obtiene todos los campos de un hash."""
+    return await _get_client().hgetall(key)
+
+
+async def hset(key: str, field: str, value: str):
+    """Guarda un campo de un hash."""
+    await _get_client().hset(key, field, value)
+
+
+async def hdel(key: str, *fields: str):
+    """Elimina campos de un hash."""
+    await _get_client().hdel(key, *fields)
+
+
+async def hash_replace(key: str, mapping: Dict[str, str]):
+    """Reemplaza atomicamente (MULTI/EXEC) todo el contenido de un hash."""
+    async with _get_client().pipeline(transaction=True) as pipe:
+        pipe.delete(key)
+        if mapping:
+            pipe.hset(key, mapping=mapping)
+        await pipe.execute()
+
+
 async def get_json(key: str) -> Optional[Any]:
     """Obtiene y deserializa un valor JSON."""
     raw = await get(key)
@@ -68,20 +236,57 @@ async def set_json(key: str, value: Any, ttl: Optional[int] = None):
     await set(key, json.dumps(value), ttl=ttl)
 
 
-async def verificar_rate_limit(key: str, limite: int, ventana_ttl: int) -> bool:
+# Token bucket atomico. Recarga ARGV[2] tokens/segundo hasta ARGV[1] y
+# consume ARGV[3]. Usa el reloj de Redis para que todos los workers
+# compartan la misma referencia de tiempo.
+_TOKEN_BUCKET_LUA = """
+local capacidad = tonumber(ARGV[1])
+local tasa = tonumber(ARGV[2])
+local costo = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local ahora = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local estado = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(estado[1])
+local ts = tonumber(estado[2])
+if tokens == nil or ts == nil then
+    tokens = capacidad
+    ts = ahora
+end
+tokens = math.min(capacidad, tokens + math.max(0, ahora - ts) * tasa)
+local permitido = 0
+local espera = 0
+if tokens >= costo then
+    tokens = tokens - costo
+    permitido = 1
+else
+    espera = (costo - tokens) / tasa
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(ahora))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacidad / tasa) + 1)
+return {permitido, math.floor(tokens), tostring(espera)}
+"""
+
+
+async def token_bucket(
+    key: str,
+    capacidad: int,
+    ventana_ttl: int,
+    costo: int = 1,
+) -> Tuple[bool, int, float]:
     """
-    Verifica rate limit usando contador simple en Redis.
+    Rate limiting con token bucket atomico (un solo round trip, script Lua).
 
     Args:
-        key: Clave de Redis (ej: 'ratelimit:5691234567')
-        limite: Numero maximo de operaciones permitidas en la ventana
-        ventana_ttl: Duracion de la ventana en segundos
+        key: Clave de Redis (ej: 'ratelimit:texto:5691234567')
+        capacidad: Maximo de operaciones en rafaga (tamaño del bucket)
+        ventana_ttl: Segundos en que el bucket se recarga por completo
+        costo: Tokens que consume la operacion
 
     Returns:
-        True si la operacion esta permitida, False si se excede el limite
+        Tupla (permitido, tokens_restantes, segundos_para_reintentar)
     """
-    cliente = _get_client()
-    conteo = await cliente.incr(key)
-    if conteo == 1:
-        await cliente.expire(key, ventana_ttl)
-    return conteo <= limite
+    tasa = capacidad / ventana_ttl
+    permitido, restantes, espera = await eval_script(
+        _TOKEN_BUCKET_LUA, [key], [capacidad, tasa, costo],
+    )
+    return bool(permitido), int(restantes), float(espera)
@@ -0,0 +1,120 @@
+"""
+Respaldo "último dato válido" (last-known-good) para lecturas de FileMaker.
+
+Cada lectura exitosa de agendas y recados se guarda en Redis con un TTL
+largo (FM_LAST_GOOD_TTL_SECONDS). Si después FileMaker falla (circuit
+breaker abierto, timeout, reinicio del servidor), se sirve ese respaldo
+como `DatosFM` con `obtenido_en` marcado, para que los formatters muestren
+"datos de hh:mm" en vez de "el sistema no está disponible".
+
+Cada llamada sigue intentando FileMaker primero: cuando el breaker pasa a
+half-open la lectura de prueba refresca el respaldo y se vuelve a servir
+datos frescos sin intervención.
+
+Uso:
+    @staticmethod
+    @con_respaldo(lambda doctor_id: f"recados:{doctor_id}")
+    async def get_recados(doctor_id: str) -> list: ...
+"""
+import functools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.config import get_settings
+from app.services import redis as redis_svc
+from app.exceptions import ServicioNoDisponibleError
+
+logger = logging.getLogger(__name__)
+
+# Segundos mínimos entre escrituras del respaldo de una misma clave
+_INTERVALO_ESCRITURA = 30.0
+
+_ultima_escritura: Dict[str, float] = {}
+
+_stats: Dict[str, int] = {"servidos": 0, "sin_respaldo": 0}
+
+
+class DatosFM(list):
+    """
+    Registros de FileMaker servidos desde el respaldo.
+
+    `obtenido_en` es el epoch en que se leyeron de FileMaker; las listas
+    normales (datos frescos) no tienen este atributo.
+    """
+
+    def __init__(self, registros: List[Any], obtenido_en: float):
+        super().__init__(registros)
+        self.obtenido_en = obtenido_en
+
+
+def obtenido_en(datos: Any) -> Optional[float]:
+    """Epoch de los datos si vienen del respaldo, o None si son frescos."""
+    return getattr(datos, "obtenido_en", None)
+
+
+def _key(clave: str) -> str:
+    return f"lkg:{clave}"
+
+
+async def _guardar(clave: str, registros: list):
+    ahora = time.time()
+    if ahora - _ultima_escritura.get(clave, 0.0) < _INTERVALO_ESCRITURA:
+        return
+    try:
+        await redis_svc.set_json(
+            _key(clave),
+            {"t": ahora, "d": registros},
+            ttl=get_settings().FM_LAST_GOOD_TTL_SECONDS,
+        )
+        _ultima_escritura[clave] = ahora
+    except Exception as e:
+        logger.debug("No se pudo guardar respaldo de '%s': %s", clave, e)
+
+
+async def _leer(clave: str) -> Optional[DatosFM]:
+    try:
+        raw = await redis_svc.get_json(_key(clave))
+    except Exception as e:
+        logger.debug("No se pudo leer respaldo de '%s': %s", clave, e)
+        return None
+    if not isinstance(raw, dict) or "t" not in raw:
+        return None
+    return DatosFM(raw.get("d") or [], obtenido_en=raw["t"])
+
+
+def con_respaldo(key: Callable[..., str]):
+    """
+    Decorador para lecturas de FileMaker que retornan listas de registros.
+
+    Args:
+        key: Función que recibe los mismos argumentos y retorna la clave.
+    """
+    def decorator(func: Callable[..., Awaitable[list]]):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            clave = key(*args, **kwargs)
+            try:
+                registros = await func(*args, **kwargs)
+            except ServicioNoDisponibleError as e:
+                respaldo = await _leer(clave)
+                if respaldo is None:
+                    _stats["sin_respaldo"] += 1
+                    raise
+                _stats["servidos"] += 1
+                logger.warning(
+                    "FileMaker no disponible (%s), sirviendo respaldo de '%s' (%.0fs de antigüedad)",
+                    e, clave, time.time() - respaldo.obtenido_en,
+                )
+                return respaldo
+
+            await _guardar(clave, registros)
+            return registros
+
+        return wrapper
+    return decorator
+
+
+def get_stats() -> dict:
+    """Respaldos servidos y fallos sin respaldo disponible en este proceso."""
+    return dict(_stats)
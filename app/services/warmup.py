@@ -0,0 +1,138 @@
+"""
+Warm-up al iniciar el servicio.
+
+Tras un deploy, el primer usuario pagaba DNS, handshakes TLS, el login de
+FileMaker y la importación de configs de rol. El warm-up hace ese trabajo
+antes de que /health/ready reporte el servicio como listo:
+
+    1. Abre conexiones keep-alive a FileMaker, Meta Graph API y OpenAI
+    2. Obtiene el token de FileMaker
+    3. Importa las configs de rol y pre-renderiza la parte fija de cada
+       system prompt
+
+Un paso que falla se registra y no bloquea a los demás: el servicio queda
+listo igual (el primer request pagará ese costo, como antes).
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from app.config import get_settings
+from app.services import http as http_svc
+
+logger = logging.getLogger(__name__)
+
+_task: Optional[asyncio.Task] = None
+_listo = False
+_resultados: Dict[str, str] = {}
+_duracion: Optional[float] = None
+
+
+async def _abrir_conexiones():
+    """Hace una request liviana a cada upstream para dejar la conexión en el pool."""
+    settings = get_settings()
+    destinos = {
+        http_svc.FM: f"{settings.FM_SCHEME}://{settings.FM_HOST}/fmi/data/v1/productInfo",
+        http_svc.META: f"{settings.META_API_BASE_URL}/{settings.META_API_VERSION}/",
+        http_svc.OPENAI: f"{settings.OPENAI_API_BASE_URL}/models",
+    }
+
+    async def _abrir(nombre: str, url: str):
+        # El status no importa (401/400 es esperable): solo se busca el handshake
+        await http_svc.get_client(nombre).head(url)
+
+    resultados = await asyncio.gather(
+        *(_abrir(nombre, url) for nombre, url in destinos.items()),
+        return_exceptions=True,
+    )
+    fallidos = [
+        f"{nombre}: {resultado}"
+        for nombre, resultado in zip(destinos, resultados)
+        if isinstance(resultado, Exception)
+    ]
+    if fallidos:
+        raise RuntimeError("; ".join(fallidos))
+
+
+async def _token_filemaker():
+    from app.services.filemaker import FileMakerService
+    await FileMakerService.get_token()
+
+
+async def _prompts_por_rol():
+    # Importar app.workflows registra los workflows y las configs LLM de cada rol
+    import app.workflows  # noqa: F401
+    from app.workflows.llm.config import prerender_system_prompts
+    roles = prerender_system_prompts()
+    logger.info("System prompts pre-renderizados para %d roles", roles)
+
+
+_PASOS: Dict[str, Callable[[], Awaitable[None]]] = {
+    "conexiones": _abrir_conexiones,
+    "filemaker_token": _token_filemaker,
+    "prompts": _prompts_por_rol,
+}
+
+
+async def ejecutar():
+    """Ejecuta todos los pasos del warm-up y marca el servicio como listo."""
+    global _duracion, _listo
+    timeout = get_settings().WARMUP_STEP_TIMEOUT_SECONDS
+    inicio = time.perf_counter()
+
+    for nombre, paso in _PASOS.items():
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(paso(), timeout=timeout)
+            _resultados[nombre] = "ok"
+            logger.info("Warm-up '%s' completado en %.0f ms", nombre, (time.perf_counter() - t0) * 1000)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            _resultados[nombre] = f"error: timeout ({timeout:.0f}s)"
+            logger.warning("Warm-up '%s' excedió %.0fs", nombre, timeout)
+        except Exception as e:
+            _resultados[nombre] = f"error: {e}"
+            logger.warning("Warm-up '%s' falló: %s", nombre, e)
+
+    _duracion = time.perf_counter() - inicio
+    _listo = True
+    logger.info("Warm-up completado en %.0f ms", _duracion * 1000)
+
+
+async def start():
+    """Lanza el warm-up en segundo plano (el servidor acepta requests mientras tanto)."""
+    global _task, _listo
+    if _task is None:
+        _listo = False
+        _resultados.clear()
+        _task = asyncio.create_task(ejecutar())
+
+
+async def stop():
+    """Cancela el warm-up si sigue en curso."""
+    global _task
+    if _task is None:
+        return
+    if not _task.done():
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+    _task = None
+
+
+def esta_listo() -> bool:
+    """True cuando el warm-up terminó (con o sin pasos fallidos)."""
+    return _listo
+
+
+def get_info() -> dict:
+    """Estado del warm-up para /health/ready."""
+    return {
+        "listo": esta_listo(),
+        "pasos": dict(_resultados),
+        "duracion_ms": round(_duracion * 1000) if _duracion is not None else None,
+    }
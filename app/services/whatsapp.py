@@ -3,12 +3,35 @@ import re
 
 import httpx
 
+from app import metrics
 from app.config import get_settings
+from app.logging_config import muestrear_payload, resumir_payload
 from app.services import http as http_svc
-from app.utils.retry import con_reintentos
+from app.services import whatsapp_dispatcher as dispatcher
+from app.services.whatsapp_dispatcher import INTERACTIVA
+from app.utils.retry import PoliticaReintentos, con_reintentos
+from app.utils import deadline
+from app.utils import latencia
+from app.utils import tracing
+from app.utils.circuit_breaker import CircuitBreakerDistribuido
 
 logger = logging.getLogger(__name__)
 
+# Circuit breaker (compartido entre workers) para la Graph API; cuentan errores de conexion y 5xx
+_meta_circuit_breaker = CircuitBreakerDistribuido(
+    nombre="meta",
+    umbral_fallos=5,
+    timeout_recuperacion=30.0,
+    excepciones_monitoreadas=(httpx.RequestError, httpx.HTTPStatusError),
+)
+
+
+_POLITICA_ENVIO = PoliticaReintentos(
+    max_intentos=2,
+    backoff_base=0.5,
+    excepciones_reintentables=frozenset({httpx.RequestError, httpx.HTTPStatusError}),
+)
+
 
 def _sanitize_template_param(text: str) -> str:
     """Sanitiza texto para parametros de template de WhatsApp.
@@ -18,38 +41,21 @@ def _sanitize_template_param(text: str) -> str:
     return text.strip()
 
 
+def _messages_url() -> str:
+    settings = get_settings()
+    return f"{settings.META_API_BASE_URL}/{settings.META_API_VERSION}/{settings.WSP_PHONE_ID}/messages"
+
+
 class WhatsAppService:
     @staticmethod
-    async def send_message(to_phone: str, text: str):
-        settings = get_settings()
-        url = f"https://graph.facebook.com/{settings.META_API_VERSION}/{settings.WSP_PHONE_ID}/messages"
-        headers = {"Authorization": f"Bearer {settings.WSP_TOKEN}"}
+    async def send_message(to_phone: str, text: str, prioridad: int = INTERACTIVA):
         payload = {
             "messaging_product": "whatsapp",
             "to": to_phone,
             "type": "text",
             "text": {"body": text}
         }
-
-        async def _enviar():
-            client = http_svc.get_client()
-            resp = await client.post(url, json=payload, headers=headers)
-            logger.info("[WSP] send_message a %s -> status=%d", to_phone, resp.status_code)
-            if resp.status_code >= 400:
-                logger.error("[WSP] send_message error response: %s", resp.text)
-            if resp.status_code >= 500:
-                resp.raise_for_status()
-
-        try:
-            await con_reintentos(
-                _enviar,
-                max_intentos=2,
-                backoff_base=0.5,
-                excepciones_reintentables={httpx.RequestError, httpx.HTTPStatusError},
-                nombre_operacion="WhatsApp send_message",
-            )
-        except Exception as e:
-            logger.error("Error al enviar mensaje a %s: %s", to_phone, e)
+        await WhatsAppService._despachar(to_phone, payload, prioridad)
 
     @staticmethod
     async def send_template(
@@ -60,11 +66,9 @@ class WhatsAppService:
         include_body: bool = False,
         header_params: list[str] | None = None,
         body_params: list[str] | None = None,
-    ):
-        settings = get_settings()
-        url = f"https://graph.facebook.com/{settings.META_API_VERSION}/{settings.WSP_PHONE_ID}/messages"
-        headers = {"Authorization": f"Bearer {settings.WSP_TOKEN}"}
-
+        prioridad: int = INTERACTIVA,
+    ) -> bool:
+        """Envia una plantilla. Retorna False si no se pudo entregar (ver `_despachar`)."""
         template_config = {
             "name": template_name,
             "language": {"code": "es"}
@@ -97,27 +101,90 @@ class WhatsAppService:
             "type": "template",
             "template": template_config
         }
+        return await WhatsAppService._despachar(to_phone, payload, prioridad)
 
-        async def _enviar():
-            client = http_svc.get_client()
-            logger.info("[WSP] send_template payload: %s", payload)
-            resp = await client.post(url, json=payload, headers=headers)
-            logger.info("[WSP] send_template '%s' a %s -> status=%d, body=%s", template_name, to_phone, resp.status_code, resp.text)
-            if resp.status_code >= 500:
-                resp.raise_for_status()
-            elif resp.status_code >= 400:
-                logger.error(
-                    "[WSP] send_template error response %d: %s",
-                    resp.status_code, resp.text
+    @staticmethod
+    async def _despachar(to_phone: str, payload: dict, prioridad: int) -> bool:
+        """
+        Encola el payload en el dispatcher, o lo envia inline si no esta activo.
+        Retorna True si quedo encolado o Meta lo acepto.
+        """
+        if dispatcher.activo():
+            with tracing.span("whatsapp.encolar", fase="whatsapp", tipo=payload.get("type")):
+                dispatcher.encolar(to_phone, payload, prioridad)
+            return True
+        return await WhatsAppService.enviar_payload(payload)
+
+    @staticmethod
+    async def enviar_payload(payload: dict) -> bool:
+        """
+        Envia un payload a la Graph API con reintentos. Los errores se
+        registran, no se propagan: retorna False si Meta no lo acepto.
+        """
+        url = _messages_url()
+        headers = {"Authorization": f"Bearer {get_settings().WSP_TOKEN}"}
+        to_phone = payload["to"]
+        hist = latencia.historial(http_svc.META, "messages")
+
+        if payload.get("type") == "template":
+            template_name = payload["template"]["name"]
+            con_payload = muestrear_payload(to_phone)
+
+            async def _enviar():
+                client = http_svc.get_client(http_svc.META)
+                logger.info("[WSP] send_template payload: %s", resumir_payload(payload, con_payload))
+                # Fuera del breaker: quedarse sin tiempo de turno no es una falla de Meta
+                timeout, acotado = deadline.timeout_acotado(client, "WhatsApp send_template", read=hist.timeout_sugerido())
+                async with _meta_circuit_breaker:
+                    with hist.medir(), metrics.cronometro(metrics.WSP_LATENCIA, tipo="template"), \
+                            tracing.span("whatsapp.enviar", fase="whatsapp", tipo="template"), \
+                            deadline.timeout_del_turno("WhatsApp send_template", acotado):
+                        resp = await client.post(url, json=payload, headers=headers, timeout=timeout)
+                    logger.info(
+                        "[WSP] send_template '%s' a %s -> status=%d, body=%s",
+                        template_name, to_phone, resp.status_code, resumir_payload(resp.text, con_payload),
+                    )
+                    if resp.status_code >= 500:
+                        resp.raise_for_status()
+                if resp.status_code >= 400:
+                    logger.error(
+                        "[WSP] send_template error response %d: %s",
+                        resp.status_code, resp.text
+                    )
+                return resp.status_code < 400
+
+            try:
+                return await con_reintentos(
+                    _enviar,
+                    politica=_POLITICA_ENVIO,
+                    nombre_operacion="WhatsApp send_template",
                 )
+            except Exception as e:
+                logger.error("Error al enviar template '%s' a %s: %s", template_name, to_phone, e)
+                return False
+
+        async def _enviar():
+            client = http_svc.get_client(http_svc.META)
+            # Fuera del breaker: quedarse sin tiempo de turno no es una falla de Meta
+            timeout, acotado = deadline.timeout_acotado(client, "WhatsApp send_message", read=hist.timeout_sugerido())
+            async with _meta_circuit_breaker:
+                with hist.medir(), metrics.cronometro(metrics.WSP_LATENCIA, tipo="texto"), \
+                        tracing.span("whatsapp.enviar", fase="whatsapp", tipo="texto"), \
+                        deadline.timeout_del_turno("WhatsApp send_message", acotado):
+                    resp = await client.post(url, json=payload, headers=headers, timeout=timeout)
+                logger.info("[WSP] send_message a %s -> status=%d", to_phone, resp.status_code)
+                if resp.status_code >= 400:
+                    logger.error("[WSP] send_message error response: %s", resp.text)
+                if resp.status_code >= 500:
+                    resp.raise_for_status()
+            return resp.status_code < 400
 
         try:
-            await con_reintentos(
+            return await con_reintentos(
                 _enviar,
-                max_intentos=2,
-                backoff_base=0.5,
-                excepciones_reintentables={httpx.RequestError, httpx.HTTPStatusError},
-                nombre_operacion="WhatsApp send_template",
+                politica=_POLITICA_ENVIO,
+                nombre_operacion="WhatsApp send_message",
             )
         except Exception as e:
-            logger.error("Error al enviar template '%s' a %s: %s", template_name, to_phone, e)
+            logger.error("Error al enviar mensaje a %s: %s", to_phone, e)
+            return False
@@ -0,0 +1,254 @@
+"""
+Dispatcher de mensajes salientes de WhatsApp.
+
+WhatsAppService encola cada envío aquí en vez de llamar a la Graph API
+desde la corrutina que responde al usuario:
+
+- Cola ordenada por destinatario: los mensajes a un mismo teléfono salen en
+  el orden en que se encolaron, con un solo envío en vuelo por teléfono.
+- Carriles de prioridad: los destinatarios con respuestas interactivas se
+  atienden antes que los de notificaciones (plantillas a enfermería,
+  cierres por inactividad). El carril lo define el mensaje en la cabeza de
+  la cola del teléfono.
+- Token bucket global en Redis (WSP_MAX_MESSAGES_PER_SECOND), compartido
+  por todos los workers, para respetar el tier de throughput de Meta.
+- Fusión opcional (WSP_COALESCE_WINDOW_MS): textos consecutivos al mismo
+  teléfono encolados dentro de la ventana salen en un solo mensaje, hasta
+  el máximo de 4096 caracteres de la API.
+
+Si el dispatcher no está iniciado (scripts, tests), los envíos se hacen
+inline como antes.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+
+from app.config import get_settings
+from app.services import redis as redis_svc
+from app.utils import tracing
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVA = 0
+NOTIFICACION = 1
+
+_CARRILES = (INTERACTIVA, NOTIFICACION)
+_NOMBRE_CARRIL = {INTERACTIVA: "interactiva", NOTIFICACION: "notificacion"}
+
+# Largo maximo del cuerpo de un mensaje de texto en la Graph API
+_MAX_TEXTO = 4096
+
+# Separador entre textos fusionados
+_SEPARADOR = "\n\n"
+
+_BUCKET_KEY = "wsp:throughput"
+
+# Muestras de latencia (encolado -> enviado) para percentiles
+_MUESTRAS_LATENCIA = 500
+
+
+@dataclass
+class _Envio:
+    """Un mensaje pendiente para un destinatario."""
+    payload: dict
+    prioridad: int
+    encolado_en: float = field(default_factory=time.monotonic)
+    # Turno que lo encoló, para que los logs del envío queden asociados a su traza
+    trace_id: Optional[str] = field(default_factory=tracing.trace_id_actual)
+
+    @property
+    def es_texto(self) -> bool:
+        return self.payload.get("type") == "text"
+
+
+_colas: Dict[str, Deque[_Envio]] = {}
+_listos: Dict[int, Deque[str]] = {carril: deque() for carril in _CARRILES}
+_en_vuelo: set = set()
+_hay_trabajo: Optional[asyncio.Event] = None
+_workers: List[asyncio.Task] = []
+
+_latencias: Deque[float] = deque(maxlen=_MUESTRAS_LATENCIA)
+_stats: Dict[str, int] = {"encolados": 0, "enviados": 0, "fusionados": 0, "errores": 0}
+
+
+def activo() -> bool:
+    """True si el dispatcher está corriendo (si no, los envíos son inline)."""
+    return bool(_workers)
+
+
+def encolar(phone: str, payload: dict, prioridad: int = INTERACTIVA):
+    """Encola un payload para el teléfono. No espera el envío."""
+    cola = _colas.setdefault(phone, deque())
+    cola.append(_Envio(payload=payload, prioridad=prioridad))
+    _stats["encolados"] += 1
+
+    # Un teléfono está en un carril si tiene pendientes y nada en vuelo
+    if len(cola) == 1 and phone not in _en_vuelo:
+        _listos[prioridad].append(phone)
+        _hay_trabajo.set()
+
+
+def _siguiente() -> Optional[str]:
+    for carril in _CARRILES:
+        if _listos[carril]:
+            return _listos[carril].popleft()
+    return None
+
+
+def _fusionar(phone: str, primero: _Envio) -> _Envio:
+    """Une al primer texto los textos consecutivos de la misma prioridad."""
+    cola = _colas.get(phone)
+    textos = [primero.payload["text"]["body"]]
+    largo = len(textos[0])
+
+    while cola:
+        siguiente = cola[0]
+        if not siguiente.es_texto or siguiente.prioridad != primero.prioridad:
+            break
+        cuerpo = siguiente.payload["text"]["body"]
+        if largo + len(_SEPARADOR) + len(cuerpo) > _MAX_TEXTO:
+            break
+        cola.popleft()
+        textos.append(cuerpo)
+        largo += len(_SEPARADOR) + len(cuerpo)
+
+    if len(textos) == 1:
+        return primero
+
+    _stats["fusionados"] += len(textos) - 1
+    payload = {**primero.payload, "text": {"body": _SEPARADOR.join(textos)}}
+    return _Envio(
+        payload=payload, prioridad=primero.prioridad, encolado_en=primero.encolado_en, trace_id=primero.trace_id,
+    )
+
+
+async def _esperar_token():
+    """Consume un token del bucket global, esperando si no hay cupo."""
+    capacidad = get_settings().WSP_MAX_MESSAGES_PER_SECOND
+    while True:
+        try:
+            permitido, _, espera = await redis_svc.token_bucket(_BUCKET_KEY, capacidad, 1)
+        except Exception as e:
+            # Sin Redis no se bloquean los envíos (Meta aplica su propio limite)
+            logger.debug("Token bucket de WhatsApp no disponible: %s", e)
+            return
+        if permitido:
+            return
+        await asyncio.sleep(max(espera, 0.001))
+
+
+async def _procesar(phone: str):
+    from app.services.whatsapp import WhatsAppService
+
+    cola = _colas[phone]
+    envio = cola.popleft()
+
+    ventana = get_settings().WSP_COALESCE_WINDOW_MS / 1000
+    if ventana > 0 and envio.es_texto:
+        restante = envio.encolado_en + ventana - time.monotonic()
+        if restante > 0:
+            await asyncio.sleep(restante)
+        envio = _fusionar(phone, envio)
+
+    await _esperar_token()
+    with tracing.con_trace_id(envio.trace_id):
+        try:
+            await WhatsAppService.enviar_payload(envio.payload)
+            _stats["enviados"] += 1
+        except Exception as e:
+            _stats["errores"] += 1
+            logger.error("[WSP] Error en envio encolado a %s: %s", phone, e)
+    _latencias.append(time.monotonic() - envio.encolado_en)
+
+
+async def _worker():
+    while True:
+        phone = _siguiente()
+        if phone is None:
+            _hay_trabajo.clear()
+            await _hay_trabajo.wait()
+            continue
+
+        _en_vuelo.add(phone)
+        try:
+            await _procesar(phone)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Error en dispatcher de WhatsApp para %s", phone)
+        finally:
+            _en_vuelo.discard(phone)
+            cola = _colas.get(phone)
+            if cola:
+                _listos[cola[0].prioridad].append(phone)
+                _hay_trabajo.set()
+            else:
+                _colas.pop(phone, None)
+
+
+def _pendientes() -> int:
+    return sum(len(cola) for cola in _colas.values())
+
+
+async def start():
+    """Inicia los workers del dispatcher."""
+    global _hay_trabajo
+    if _workers:
+        return
+    _hay_trabajo = asyncio.Event()
+    n = get_settings().WSP_DISPATCH_WORKERS
+    _workers.extend(asyncio.create_task(_worker()) for _ in range(n))
+    logger.info("Dispatcher de WhatsApp iniciado (%d workers)", n)
+
+
+async def stop():
+    """Espera a que se vacíen las colas (con limite) y detiene los workers."""
+    if not _workers:
+        return
+
+    limite = time.monotonic() + get_settings().WSP_DISPATCH_DRAIN_SECONDS
+    while (_pendientes() or _en_vuelo) and time.monotonic() < limite:
+        await asyncio.sleep(0.05)
+    if _pendientes():
+        logger.warning("Dispatcher de WhatsApp detenido con %d mensajes sin enviar", _pendientes())
+
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _colas.clear()
+    for carril in _CARRILES:
+        _listos[carril].clear()
+    _en_vuelo.clear()
+    logger.info("Dispatcher de WhatsApp detenido")
+
+
+def _percentil(valores: List[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, int(round(p * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+def get_stats() -> dict:
+    """Profundidad de cola por carril y latencia de envío (encolado -> enviado)."""
+    profundidad = {_NOMBRE_CARRIL[c]: 0 for c in _CARRILES}
+    for cola in _colas.values():
+        for envio in cola:
+            profundidad[_NOMBRE_CARRIL[envio.prioridad]] += 1
+
+    latencias = list(_latencias)
+    return {
+        "activo": activo(),
+        "profundidad": profundidad,
+        "destinatarios_pendientes": len(_colas),
+        "en_vuelo": len(_en_vuelo),
+        **_stats,
+        "latencia_p50_ms": round(_percentil(latencias, 0.50) * 1000, 1),
+        "latencia_p95_ms": round(_percentil(latencias, 0.95) * 1000, 1),
+        "latencia_max_ms": round(max(latencias) * 1000, 1) if latencias else 0.0,
+    }
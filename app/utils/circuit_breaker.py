@@ -6,12 +6,39 @@ Estados:
     CERRADO  -> Funcionando normal. Tras N fallos consecutivos, pasa a ABIERTO.
     ABIERTO  -> Rechaza llamadas inmediatamente. Tras un timeout, pasa a SEMI-ABIERTO.
     SEMI_ABIERTO -> Permite una llamada de prueba. Si tiene exito, pasa a CERRADO. Si falla, vuelve a ABIERTO.
+
+`CircuitBreaker` guarda el estado en memoria del proceso. `CircuitBreakerDistribuido`
+lo comparte entre workers via Redis:
+
+- Transiciones atomicas con scripts Lua (cb:{nombre}).
+- En SEMI_ABIERTO una sola llamada de prueba en todo el cluster (lease con
+  vencimiento, por si el worker que la tenia muere).
+- Ademas de N fallos consecutivos, abre si la tasa de error en una ventana
+  movil (CB_WINDOW_SECONDS, buckets de 1s) supera CB_ERROR_RATE_THRESHOLD
+  con al menos CB_MIN_CALLS llamadas.
+- Cada transicion se publica en el canal cb:estado: todos los workers abren
+  y se recuperan juntos, y en estado CERRADO no se consulta Redis al entrar.
+- Los exitos en CERRADO se cuentan en memoria y se envian a Redis en lote
+  (cada segundo, o junto al siguiente fallo): una llamada exitosa no paga
+  round trip. Fallos y resultados de la llamada de prueba se registran de
+  inmediato.
+
+Si Redis no responde, cada breaker cae a un `CircuitBreaker` local y solo
+vuelve a probar Redis cada pocos segundos; cada llamada sale por el mismo
+breaker (local o distribuido) por el que entro.
 """
 import asyncio
+import json
 import logging
 import time
+import uuid
+from contextvars import ContextVar
 from enum import Enum
-from typing import Optional
+from typing import Dict, Optional
+
+from app.config import get_settings
+from app.exceptions import DeadlineExcedido
+from app.services import redis as redis_svc
 
 logger = logging.getLogger(__name__)
 
@@ -86,7 +113,8 @@ class CircuitBreaker:
             await self._registrar_exito()
             return False
 
-        if isinstance(exc_val, self.excepciones_monitoreadas):
+        # Un turno sin tiempo no dice nada de la salud del servicio
+        if isinstance(exc_val, self.excepciones_monitoreadas) and not isinstance(exc_val, DeadlineExcedido):
             await self._registrar_fallo()
 
         return False  # No suprimimos la excepcion
@@ -126,3 +154,444 @@ class CircuitBreaker:
             "umbral_fallos": self.umbral_fallos,
             "timeout_recuperacion": self.timeout_recuperacion,
         }
+
+
+# ──────────────────────────────────────────────
+# Circuit breaker distribuido (Redis)
+# ──────────────────────────────────────────────
+
+_CANAL_ESTADO = "cb:estado"
+
+# Admite una llamada. Retorna {admitido, estado, espera_ms}:
+# admitido 1 = llamada normal, 2 = llamada de prueba (lease tomado), 0 = rechazada
+_ADMITIR_LUA = """
+local ahora = tonumber(ARGV[1])
+local estado = redis.call('HGET', KEYS[1], 'estado') or 'cerrado'
+if estado == 'cerrado' then
+    return {1, estado, 0}
+end
+if estado == 'abierto' then
+    local hasta = tonumber(redis.call('HGET', KEYS[1], 'hasta') or '0')
+    if ahora < hasta then
+        return {0, estado, hasta - ahora}
+    end
+    estado = 'semi_abierto'
+    redis.call('HSET', KEYS[1], 'estado', estado)
+end
+local lease = tonumber(redis.call('HGET', KEYS[1], 'sonda_hasta') or '0')
+if ahora < lease then
+    return {0, estado, lease - ahora}
+end
+redis.call('HSET', KEYS[1], 'sonda', ARGV[2], 'sonda_hasta', ahora + tonumber(ARGV[3]))
+return {2, estado, 0}
+"""
+
+# Registra el resultado de una llamada (ARGV[2]: '1' exito, '0' fallo, '' solo
+# lote) junto con los exitos acumulados en el worker (ARGV[9]: "seg:n,seg:n").
+# Retorna {estado, hasta_ms, hubo_transicion}
+_REGISTRAR_LUA = """
+local ahora = tonumber(ARGV[1])
+local exito = ARGV[2] == '1'
+local estado = redis.call('HGET', KEYS[1], 'estado') or 'cerrado'
+local recuperacion = tonumber(ARGV[8])
+local ventana = tonumber(ARGV[4])
+
+local acumulados = 0
+for seg_lote, n in string.gmatch(ARGV[9], '(%d+):(%d+)') do
+    redis.call('HINCRBY', KEYS[2], seg_lote .. ':ok', tonumber(n))
+    acumulados = acumulados + tonumber(n)
+end
+if acumulados > 0 then
+    redis.call('HSET', KEYS[1], 'consecutivos', 0)
+    redis.call('EXPIRE', KEYS[2], ventana * 2)
+end
+if ARGV[2] == '' then
+    return {estado, tonumber(redis.call('HGET', KEYS[1], 'hasta') or '0'), 0}
+end
+
+if ARGV[3] ~= '' and estado == 'semi_abierto' and redis.call('HGET', KEYS[1], 'sonda') == ARGV[3] then
+    redis.call('HDEL', KEYS[1], 'sonda', 'sonda_hasta')
+    if exito then
+        redis.call('HSET', KEYS[1], 'estado', 'cerrado', 'consecutivos', 0)
+        redis.call('DEL', KEYS[2])
+        return {'cerrado', 0, 1}
+    end
+    redis.call('HSET', KEYS[1], 'estado', 'abierto', 'hasta', ahora + recuperacion)
+    return {'abierto', ahora + recuperacion, 1}
+end
+
+local seg = math.floor(ahora / 1000)
+redis.call('HINCRBY', KEYS[2], seg .. (exito and ':ok' or ':err'), 1)
+redis.call('EXPIRE', KEYS[2], ventana * 2)
+
+local hasta = tonumber(redis.call('HGET', KEYS[1], 'hasta') or '0')
+if exito then
+    redis.call('HSET', KEYS[1], 'consecutivos', 0)
+    return {estado, hasta, 0}
+end
+local consecutivos = redis.call('HINCRBY', KEYS[1], 'consecutivos', 1)
+if estado ~= 'cerrado' then
+    return {estado, hasta, 0}
+end
+
+local ok, err = 0, 0
+local campos = redis.call('HGETALL', KEYS[2])
+for i = 1, #campos, 2 do
+    local bucket, tipo = string.match(campos[i], '(%d+):(%a+)')
+    if tonumber(bucket) <= seg - ventana then
+        redis.call('HDEL', KEYS[2], campos[i])
+    elseif tipo == 'ok' then
+        ok = ok + tonumber(campos[i + 1])
+    else
+        err = err + tonumber(campos[i + 1])
+    end
+end
+local total = ok + err
+if consecutivos >= tonumber(ARGV[7]) or (total >= tonumber(ARGV[6]) and err / total >= tonumber(ARGV[5])) then
+    redis.call('HSET', KEYS[1], 'estado', 'abierto', 'hasta', ahora + recuperacion)
+    return {'abierto', ahora + recuperacion, 1}
+end
+return {estado, hasta, 0}
+"""
+
+# Libera el lease de una llamada de prueba cancelada (ej. perdedora de un hedge)
+_LIBERAR_SONDA_LUA = """
+if redis.call('HGET', KEYS[1], 'sonda') == ARGV[1] then
+    redis.call('HDEL', KEYS[1], 'sonda', 'sonda_hasta')
+    return 1
+end
+return 0
+"""
+
+# Segundos entre envios del lote de exitos
+_INTERVALO_LOTE = 1.0
+
+# Segundos entre intentos de volver a Redis mientras el breaker esta degradado
+_REINTENTO_REDIS = 5.0
+
+_registro: Dict[str, "CircuitBreakerDistribuido"] = {}
+
+_listener_task: Optional[asyncio.Task] = None
+_lote_task: Optional[asyncio.Task] = None
+
+
+def _ms(segundos: float) -> int:
+    return int(segundos * 1000)
+
+
+class CircuitBreakerDistribuido:
+    """
+    Circuit breaker con estado compartido en Redis. Misma interfaz que
+    `CircuitBreaker`:
+
+        cb = CircuitBreakerDistribuido("filemaker", umbral_fallos=5, timeout_recuperacion=30)
+
+        async with cb:
+            return await servicio_externo()
+
+    Los parametros de la ventana movil toman su valor de la configuracion
+    (CB_*) si no se indican.
+    """
+
+    def __init__(
+        self,
+        nombre: str,
+        umbral_fallos: int = 5,
+        timeout_recuperacion: float = 30.0,
+        excepciones_monitoreadas: Optional[tuple] = None,
+        ventana_segundos: Optional[int] = None,
+        umbral_tasa_error: Optional[float] = None,
+        min_llamadas: Optional[int] = None,
+    ):
+        self.nombre = nombre
+        self.umbral_fallos = umbral_fallos
+        self.timeout_recuperacion = timeout_recuperacion
+        self.excepciones_monitoreadas = excepciones_monitoreadas or (Exception,)
+        self._ventana_segundos = ventana_segundos
+        self._umbral_tasa_error = umbral_tasa_error
+        self._min_llamadas = min_llamadas
+
+        self._key = f"cb:{nombre}"
+        self._key_ventana = f"cb:{nombre}:ventana"
+
+        # Vista local del estado en Redis (actualizada por pub/sub y por cada llamada)
+        self._vista = EstadoCircuito.CERRADO
+        self._abierto_hasta: float = 0.0
+
+        # Respaldo en memoria mientras Redis no responde
+        self._local = CircuitBreaker(nombre, umbral_fallos, timeout_recuperacion, excepciones_monitoreadas)
+        self._degradado = False
+        self._reintentar_redis_en: float = 0.0
+
+        # Exitos en CERRADO aun no enviados a Redis, por segundo (epoch)
+        self._exitos_pendientes: Dict[int, int] = {}
+
+        # Lease de prueba de la llamada en curso ("" si no es la llamada de prueba)
+        self._sonda: ContextVar[str] = ContextVar(f"cb_sonda_{nombre}", default="")
+        # True si la llamada en curso entro por el breaker local
+        self._por_local: ContextVar[bool] = ContextVar(f"cb_local_{nombre}", default=False)
+
+        _registro[nombre] = self
+
+    @property
+    def estado(self) -> EstadoCircuito:
+        if self._degradado:
+            return self._local.estado
+        if self._vista == EstadoCircuito.ABIERTO and time.time() >= self._abierto_hasta:
+            return EstadoCircuito.SEMI_ABIERTO
+        return self._vista
+
+    def _actualizar_vista(self, estado: str, hasta_ms: float):
+        self._vista = EstadoCircuito(estado)
+        self._abierto_hasta = hasta_ms / 1000
+
+    def _degradar(self, error: Exception):
+        if not self._degradado:
+            logger.warning(
+                "Redis no disponible para circuit breaker '%s', usando estado local: %s",
+                self.nombre, error,
+            )
+            self._degradado = True
+        self._reintentar_redis_en = time.monotonic() + _REINTENTO_REDIS
+
+    async def _reconectar(self) -> bool:
+        """Con el breaker degradado, prueba Redis como maximo cada _REINTENTO_REDIS segundos."""
+        if time.monotonic() < self._reintentar_redis_en:
+            return False
+        try:
+            await self.sincronizar()
+        except Exception as e:
+            self._degradar(e)
+            return False
+        logger.info("Circuit breaker '%s' vuelve a usar el estado en Redis", self.nombre)
+        self._degradado = False
+        return True
+
+    async def _entrar_local(self):
+        self._por_local.set(True)
+        await self._local.__aenter__()
+        return self
+
+    async def __aenter__(self):
+        self._sonda.set("")
+        self._por_local.set(False)
+
+        if self._degradado and not await self._reconectar():
+            return await self._entrar_local()
+
+        ahora = time.time()
+        if self._vista == EstadoCircuito.CERRADO:
+            return self
+        if self._vista == EstadoCircuito.ABIERTO and ahora < self._abierto_hasta:
+            raise CircuitBreakerAbierto(self.nombre, self._abierto_hasta - ahora)
+
+        settings = get_settings()
+        token = uuid.uuid4().hex
+        try:
+            admitido, estado, espera_ms = await redis_svc.eval_script(
+                _ADMITIR_LUA,
+                [self._key],
+                [_ms(ahora), token, _ms(settings.CB_PROBE_LEASE_SECONDS)],
+            )
+        except Exception as e:
+            self._degradar(e)
+            return await self._entrar_local()
+
+        if estado == EstadoCircuito.ABIERTO.value:
+            self._actualizar_vista(estado, _ms(ahora) + espera_ms)
+        else:
+            self._vista = EstadoCircuito(estado)
+
+        if not admitido:
+            raise CircuitBreakerAbierto(self.nombre, espera_ms / 1000)
+
+        if admitido == 2:
+            self._sonda.set(token)
+            logger.info("Circuit breaker '%s' semi-abierto, intentando llamada de prueba", self.nombre)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._por_local.get():
+            return await self._local.__aexit__(exc_type, exc_val, exc_tb)
+
+        sonda = self._sonda.get()
+        if exc_type is asyncio.CancelledError or isinstance(exc_val, DeadlineExcedido):
+            # Ni la cancelacion ni el deadline del turno son fallos del servicio:
+            # la llamada de prueba queda libre para otro
+            if sonda:
+                await self._liberar_sonda(sonda)
+            return False
+        if exc_type is not None and not isinstance(exc_val, self.excepciones_monitoreadas):
+            return False
+
+        if exc_type is None and not sonda:
+            # Exito en CERRADO: se acumula y sale en el proximo lote
+            seg = int(time.time())
+            self._exitos_pendientes[seg] = self._exitos_pendientes.get(seg, 0) + 1
+            return False
+
+        await self._registrar("1" if exc_type is None else "0", sonda)
+        return False  # No suprimimos la excepcion
+
+    def _tomar_lote(self) -> str:
+        """Exitos pendientes dentro de la ventana, como "seg:n,seg:n" (y los descarta)."""
+        if not self._exitos_pendientes:
+            return ""
+        desde = int(time.time()) - (self._ventana_segundos or get_settings().CB_WINDOW_SECONDS)
+        lote = ",".join(f"{seg}:{n}" for seg, n in self._exitos_pendientes.items() if seg > desde)
+        self._exitos_pendientes = {}
+        return lote
+
+    async def _registrar(self, resultado: str, sonda: str = ""):
+        """Envia a Redis un resultado ('1', '0' o '' para solo el lote) junto con los exitos pendientes."""
+        settings = get_settings()
+        lote = self._tomar_lote()
+        if resultado == "" and not lote:
+            return
+        try:
+            estado, hasta_ms, transicion = await redis_svc.eval_script(
+                _REGISTRAR_LUA,
+                [self._key, self._key_ventana],
+                [
+                    _ms(time.time()),
+                    resultado,
+                    sonda,
+                    self._ventana_segundos or settings.CB_WINDOW_SECONDS,
+                    self._umbral_tasa_error or settings.CB_ERROR_RATE_THRESHOLD,
+                    self._min_llamadas or settings.CB_MIN_CALLS,
+                    self.umbral_fallos,
+                    _ms(self.timeout_recuperacion),
+                    lote,
+                ],
+            )
+        except Exception as e:
+            self._degradar(e)
+            if resultado == "1":
+                await self._local._registrar_exito()
+            elif resultado == "0":
+                await self._local._registrar_fallo()
+            return
+
+        self._actualizar_vista(estado, hasta_ms)
+        if transicion:
+            await self._publicar_transicion(estado, hasta_ms)
+
+    async def _liberar_sonda(self, sonda: str):
+        """Una llamada de prueba cancelada no cuenta como resultado: libera el lease para otra."""
+        try:
+            await redis_svc.eval_script(_LIBERAR_SONDA_LUA, [self._key], [sonda])
+        except Exception as e:
+            logger.debug("No se pudo liberar la prueba del circuit breaker '%s': %s", self.nombre, e)
+
+    async def enviar_lote(self):
+        """Envia a Redis los exitos acumulados (no-op si no hay o el breaker esta degradado)."""
+        if self._degradado:
+            self._exitos_pendientes = {}
+            return
+        await self._registrar("")
+
+    async def _publicar_transicion(self, estado: str, hasta_ms: float):
+        if estado == EstadoCircuito.ABIERTO.value:
+            logger.warning("Circuit breaker '%s' -> ABIERTO (compartido)", self.nombre)
+        else:
+            logger.info("Circuit breaker '%s' recuperado -> CERRADO (compartido)", self.nombre)
+        try:
+            await redis_svc.publish(
+                _CANAL_ESTADO,
+                json.dumps({"nombre": self.nombre, "estado": estado, "hasta": hasta_ms}),
+            )
+        except Exception as e:
+            logger.warning("No se pudo publicar estado del circuit breaker '%s': %s", self.nombre, e)
+
+    async def sincronizar(self):
+        """Carga el estado actual desde Redis (al iniciar o reconectar)."""
+        datos = await redis_svc.hgetall(self._key)
+        self._actualizar_vista(datos.get("estado", "cerrado"), float(datos.get("hasta", 0)))
+
+    def get_info(self) -> dict:
+        """Retorna info del estado actual del circuit breaker."""
+        return {
+            "nombre": self.nombre,
+            "estado": self.estado.value,
+            "distribuido": not self._degradado,
+            "umbral_fallos": self.umbral_fallos,
+            "timeout_recuperacion": self.timeout_recuperacion,
+        }
+
+
+async def start():
+    """Inicia la suscripcion a los cambios de estado y el envio de exitos en lote."""
+    global _listener_task, _lote_task
+    if _listener_task is None:
+        _listener_task = asyncio.create_task(_escuchar_estados())
+    if _lote_task is None:
+        _lote_task = asyncio.create_task(_lote_loop())
+
+
+async def stop():
+    """Detiene la suscripcion y envia el ultimo lote de exitos."""
+    global _listener_task, _lote_task
+    for task in (_listener_task, _lote_task):
+        if task is None:
+            continue
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _listener_task = None
+    _lote_task = None
+    for cb in _registro.values():
+        try:
+            await cb.enviar_lote()
+        except Exception:
+            pass
+
+
+async def _lote_loop():
+    """Envia cada _INTERVALO_LOTE segundos los exitos acumulados de cada breaker."""
+    while True:
+        await asyncio.sleep(_INTERVALO_LOTE)
+        for cb in list(_registro.values()):
+            try:
+                await cb.enviar_lote()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error enviando lote del circuit breaker '%s'", cb.nombre)
+
+
+async def _escuchar_estados():
+    """Escucha el canal pub/sub y actualiza la vista local de cada breaker."""
+    while True:
+        pubsub = None
+        try:
+            pubsub = redis_svc.pubsub()
+            await pubsub.subscribe(_CANAL_ESTADO)
+            # Transiciones ocurridas mientras no estabamos suscritos
+            for cb in _registro.values():
+                await cb.sincronizar()
+            logger.info("Suscrito a estados de circuit breakers")
+            async for mensaje in pubsub.listen():
+                if mensaje.get("type") != "message":
+                    continue
+                datos = json.loads(mensaje["data"])
+                cb = _registro.get(datos["nombre"])
+                if cb is not None:
+                    cb._actualizar_vista(datos["estado"], datos["hasta"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Suscripcion de circuit breakers interrumpida: %s. Reintentando...", e)
+            await asyncio.sleep(1.0)
+        finally:
+            if pubsub is not None:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+
+def get_info() -> list:
+    """Estado de todos los circuit breakers distribuidos registrados."""
+    return [cb.get_info() for cb in _registro.values()]
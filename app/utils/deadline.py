@@ -0,0 +1,124 @@
+"""
+Deadline por turno, propagado en un contextvar.
+
+Al recibir un mensaje se fija un plazo total (TURN_DEADLINE_SECONDS) y
+todas las llamadas aguas abajo lo respetan:
+
+- `timeout_httpx(client)` acota los timeouts del pool (o el adaptativo) al
+  tiempo restante. Con `timeout_acotado` + `timeout_del_turno`, un timeout
+  que vencio porque se acorto al turno sale como DeadlineExcedido y no
+  cuenta como falla del servicio en los circuit breakers.
+- `con_reintentos` no inicia un reintento que no alcanza a terminar.
+- `verificar(operacion)` corta antes de empezar una llamada si ya no queda
+  tiempo.
+
+Al agotarse el plazo se lanza DeadlineExcedido (un ServicioNoDisponibleError),
+y el usuario recibe un "intenta de nuevo" en vez de esperar minutos.
+
+Fuera de un turno (workers de fondo, scripts) no hay deadline y todo se
+comporta como antes.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Optional, Tuple
+
+import httpx
+
+from app.exceptions import DeadlineExcedido
+
+# Instante (time.monotonic) en que vence el turno actual
+_vence_en: ContextVar[Optional[float]] = ContextVar("deadline_turno", default=None)
+
+
+def iniciar(segundos: float) -> Token:
+    """Fija el deadline del turno. Retorna el token para `terminar()`."""
+    return _vence_en.set(time.monotonic() + segundos)
+
+
+def terminar(token: Token):
+    """Restaura el deadline anterior (normalmente ninguno)."""
+    _vence_en.reset(token)
+
+
+@contextmanager
+def sin_limite():
+    """Ejecuta un bloque sin deadline (ej: avisar al usuario que se agoto el tiempo)."""
+    token = _vence_en.set(None)
+    try:
+        yield
+    finally:
+        _vence_en.reset(token)
+
+
+def restante() -> Optional[float]:
+    """Segundos que quedan del turno, o None si no hay deadline."""
+    vence_en = _vence_en.get()
+    if vence_en is None:
+        return None
+    return vence_en - time.monotonic()
+
+
+def verificar(operacion: str):
+    """Lanza DeadlineExcedido si el turno ya no tiene tiempo."""
+    quedan = restante()
+    if quedan is not None and quedan <= 0:
+        raise DeadlineExcedido(operacion)
+
+
+def timeout_httpx(client: httpx.AsyncClient, operacion: str, read: Optional[float] = None):
+    """
+    Timeout para un request: los del pool acotados al tiempo restante, o
+    USE_CLIENT_DEFAULT si no hay deadline ni timeout adaptativo.
+
+    Args:
+        read: Timeout de lectura sugerido por la latencia observada; nunca
+            supera el del pool.
+    """
+    return timeout_acotado(client, operacion, read=read)[0]
+
+
+def timeout_acotado(client: httpx.AsyncClient, operacion: str, read: Optional[float] = None) -> Tuple[object, bool]:
+    """
+    Como `timeout_httpx`, y ademas si algun timeout quedo mas corto por el
+    deadline del turno (y no por el pool o el timeout adaptativo).
+    """
+    quedan = restante()
+    if quedan is None and read is None:
+        return httpx.USE_CLIENT_DEFAULT, False
+    if quedan is not None and quedan <= 0:
+        raise DeadlineExcedido(operacion)
+
+    base = client.timeout
+    if read is not None and base.read is not None:
+        base = httpx.Timeout(connect=base.connect, read=min(read, base.read), write=base.write, pool=base.pool)
+
+    valores = (base.connect, base.read, base.write, base.pool)
+    acotado = quedan is not None and any(v is None or quedan < v for v in valores)
+
+    def _acotar(valor: Optional[float]) -> Optional[float]:
+        if quedan is None:
+            return valor
+        return quedan if valor is None else min(valor, quedan)
+
+    timeout = httpx.Timeout(
+        connect=_acotar(base.connect),
+        read=_acotar(base.read),
+        write=_acotar(base.write),
+        pool=_acotar(base.pool),
+    )
+    return timeout, acotado
+
+
+@contextmanager
+def timeout_del_turno(operacion: str, acotado: bool):
+    """
+    Convierte un timeout de httpx en DeadlineExcedido cuando el timeout del
+    request fue acortado al tiempo restante del turno.
+    """
+    try:
+        yield
+    except httpx.TimeoutException as e:
+        if acotado:
+            raise DeadlineExcedido(operacion) from e
+        raise
@@ -0,0 +1,100 @@
+"""
+Hedging de lecturas idempotentes para recortar la cola de latencia.
+
+Si la primera request no respondio al llegar al p90 observado, se lanza una
+segunda identica (el pool HTTP la envia por otra conexion) y se usa la que
+responda primero; la otra se cancela. Un presupuesto limita las requests
+extra a un porcentaje de las llamadas.
+
+Solo para operaciones sin efectos secundarios: ambas requests pueden llegar
+al servidor.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, TypeVar
+
+from app.utils.latencia import HistorialLatencia
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class PresupuestoCobertura:
+    """
+    Token bucket de requests de cobertura: cada llamada suma `porcentaje`/100
+    tokens (hasta `maximo`) y cada cobertura consume uno.
+    """
+
+    def __init__(self, porcentaje: float, maximo: float = 10.0):
+        self.porcentaje = porcentaje
+        self.maximo = maximo
+        self._tokens = 0.0
+        self.stats: Dict[str, int] = {"llamadas": 0, "coberturas": 0, "ganadas": 0, "sin_presupuesto": 0}
+
+    def registrar_llamada(self):
+        self.stats["llamadas"] += 1
+        self._tokens = min(self.maximo, self._tokens + self.porcentaje / 100)
+
+    def consumir(self) -> bool:
+        if self._tokens < 1.0:
+            self.stats["sin_presupuesto"] += 1
+            return False
+        self._tokens -= 1.0
+        self.stats["coberturas"] += 1
+        return True
+
+
+async def con_cobertura(
+    llamada: Callable[[], Awaitable[T]],
+    historial: HistorialLatencia,
+    presupuesto: PresupuestoCobertura,
+    percentil: float = 0.90,
+    espera_minima: float = 0.0,
+    habilitado: bool = True,
+) -> T:
+    """
+    Ejecuta `llamada` y, si tarda mas que el percentil observado, lanza una
+    segunda en paralelo. La propia `llamada` registra su latencia en `historial`
+    (tambien la perdedora, al cancelarse).
+
+    Args:
+        llamada: Funcion sin argumentos que crea la request (se invoca una o dos veces).
+        historial: Latencias observadas de esta operacion.
+        presupuesto: Limite compartido de requests extra.
+        percentil: Percentil de latencia tras el cual se cubre.
+        espera_minima: Piso (segundos) de la espera antes de cubrir.
+        habilitado: Si es False se hace una sola request.
+    """
+    presupuesto.registrar_llamada()
+    umbral = historial.percentil(percentil) if habilitado else None
+
+    if umbral is None:
+        return await llamada()
+
+    inicio = time.monotonic()
+    primera = asyncio.ensure_future(llamada())
+    pendientes = {primera}
+    try:
+        hechas, _ = await asyncio.wait(pendientes, timeout=max(umbral, espera_minima))
+        if not hechas and presupuesto.consumir():
+            segunda = asyncio.ensure_future(llamada())
+            pendientes.add(segunda)
+            logger.debug("Cobertura lanzada tras %.0fms", (time.monotonic() - inicio) * 1000)
+
+        error = None
+        while pendientes:
+            hechas, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+            for tarea in hechas:
+                if tarea.exception() is None:
+                    if tarea is not primera:
+                        presupuesto.stats["ganadas"] += 1
+                    return tarea.result()
+                # Si la otra sigue en vuelo todavia puede responder
+                if error is None or tarea is primera:
+                    error = tarea.exception()
+        raise error
+    finally:
+        for tarea in pendientes:
+            tarea.cancel()
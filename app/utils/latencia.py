@@ -0,0 +1,114 @@
+"""
+Latencias observadas por upstream y operacion.
+
+Cada `HistorialLatencia` mantiene un EWMA y una ventana circular de las
+ultimas muestras (de donde salen los percentiles). Se usa para:
+
+- Timeouts adaptativos: `timeout_sugerido()` = p99 x ADAPTIVE_TIMEOUT_FACTOR,
+  acotado entre ADAPTIVE_TIMEOUT_MIN_SECONDS (o el piso de la operacion) y
+  el timeout del pool.
+- El p90 que dispara el hedging de lecturas a FileMaker.
+
+Uso:
+    hist = latencia.historial(http_svc.FM, "get_recados")
+    with hist.medir():
+        resp = await client.post(..., timeout=deadline.timeout_httpx(client, op, read=hist.timeout_sugerido()))
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Optional, Tuple
+
+import httpx
+
+from app.config import get_settings
+
+# Peso de la muestra nueva en el EWMA
+_ALFA_EWMA = 0.2
+
+
+class HistorialLatencia:
+    """Ventana circular con las ultimas `max_muestras` latencias (segundos) y su EWMA."""
+
+    def __init__(self, max_muestras: int = 500, min_muestras: int = 20):
+        self.min_muestras = min_muestras
+        self.ewma: Optional[float] = None
+        self._muestras: Deque[float] = deque(maxlen=max_muestras)
+
+    def registrar(self, segundos: float):
+        self._muestras.append(segundos)
+        self.ewma = segundos if self.ewma is None else _ALFA_EWMA * segundos + (1 - _ALFA_EWMA) * self.ewma
+
+    @contextmanager
+    def medir(self):
+        """
+        Registra la duracion del bloque si termina bien, por timeout o
+        cancelado (ej: la request perdedora de un hedge). Timeouts y
+        cancelaciones son cotas inferiores, pero dejarlas fuera sesgaria el
+        p99 hacia abajo justo cuando el upstream se pone lento.
+        """
+        inicio = time.monotonic()
+        try:
+            yield
+        except (httpx.TimeoutException, asyncio.CancelledError):
+            self.registrar(time.monotonic() - inicio)
+            raise
+        self.registrar(time.monotonic() - inicio)
+
+    def percentil(self, p: float) -> Optional[float]:
+        """Percentil `p` (0..1) de las muestras, o None si aun no hay suficientes."""
+        if len(self._muestras) < self.min_muestras:
+            return None
+        ordenadas = sorted(self._muestras)
+        indice = min(len(ordenadas) - 1, int(round(p * (len(ordenadas) - 1))))
+        return ordenadas[indice]
+
+    def timeout_sugerido(self, piso: Optional[float] = None) -> Optional[float]:
+        """
+        Timeout de lectura p99 x factor, o None sin muestras suficientes.
+
+        Args:
+            piso: Minimo para esta operacion (por defecto ADAPTIVE_TIMEOUT_MIN_SECONDS).
+        """
+        p99 = self.percentil(0.99)
+        if p99 is None:
+            return None
+        settings = get_settings()
+        if piso is None:
+            piso = settings.ADAPTIVE_TIMEOUT_MIN_SECONDS
+        return max(piso, p99 * settings.ADAPTIVE_TIMEOUT_FACTOR)
+
+    def __len__(self) -> int:
+        return len(self._muestras)
+
+
+_historiales: Dict[Tuple[str, str], HistorialLatencia] = {}
+
+
+def historial(upstream: str, operacion: str) -> HistorialLatencia:
+    """Historial de latencias de una operacion de un upstream (se crea al primer uso)."""
+    clave = (upstream, operacion)
+    hist = _historiales.get(clave)
+    if hist is None:
+        hist = _historiales[clave] = HistorialLatencia()
+    return hist
+
+
+def _ms(segundos: Optional[float]) -> Optional[float]:
+    return round(segundos * 1000, 1) if segundos is not None else None
+
+
+def get_stats() -> dict:
+    """EWMA, percentiles y timeout sugerido (ms) por upstream y operacion."""
+    stats: Dict[str, dict] = {}
+    for (upstream, operacion), hist in _historiales.items():
+        stats.setdefault(upstream, {})[operacion] = {
+            "muestras": len(hist),
+            "ewma_ms": _ms(hist.ewma),
+            "p50_ms": _ms(hist.percentil(0.50)),
+            "p90_ms": _ms(hist.percentil(0.90)),
+            "p99_ms": _ms(hist.percentil(0.99)),
+            "timeout_ms": _ms(hist.timeout_sugerido()),
+        }
+    return stats
@@ -1,61 +1,142 @@
 """
 Utilidad de reintentos con backoff exponencial para llamadas HTTP.
+
+Cada llamador describe sus reintentos con una `PoliticaReintentos`. El
+backoff usa full jitter (espera aleatoria entre 0 y el tope exponencial)
+para no sincronizar a los workers, y todos los reintentos del proceso
+comparten un presupuesto (RETRY_BUDGET_PERCENT de las llamadas): durante
+una caida los reintentos no multiplican la carga sobre el upstream.
 """
 import asyncio
 import logging
-from typing import Callable, Set, Type, Optional
+import random
+from dataclasses import dataclass, field
+from typing import Callable, Dict, FrozenSet, Optional, Type
 
 import httpx
 
+from app.config import get_settings
+from app.exceptions import DeadlineExcedido
+from app.utils import deadline
+
 logger = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True)
+class PoliticaReintentos:
+    """Cuantas veces y ante que errores reintentar una operacion."""
+    max_intentos: int = 3
+    backoff_base: float = 1.0
+    backoff_max: float = 8.0
+    excepciones_reintentables: FrozenSet[Type[Exception]] = field(
+        default_factory=lambda: frozenset({httpx.RequestError})
+    )
+
+    def espera(self, intento: int) -> float:
+        """Full jitter: uniforme entre 0 y min(backoff_max, base * 2^(intento-1))."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (intento - 1))))
+
+
+POLITICA_POR_DEFECTO = PoliticaReintentos()
+
+
+class PresupuestoReintentos:
+    """
+    Token bucket de reintentos del proceso: cada llamada deposita
+    `porcentaje`/100 tokens (hasta `maximo`) y cada reintento consume uno.
+    """
+
+    def __init__(self, porcentaje: float, maximo: float):
+        self.porcentaje = porcentaje
+        self.maximo = maximo
+        self._tokens = maximo
+        self.stats: Dict[str, int] = {"llamadas": 0, "reintentos": 0, "sin_presupuesto": 0}
+
+    def depositar(self):
+        self.stats["llamadas"] += 1
+        self._tokens = min(self.maximo, self._tokens + self.porcentaje / 100)
+
+    def retirar(self) -> bool:
+        if self._tokens < 1.0:
+            self.stats["sin_presupuesto"] += 1
+            return False
+        self._tokens -= 1.0
+        self.stats["reintentos"] += 1
+        return True
+
+
+_presupuesto: Optional[PresupuestoReintentos] = None
+
+
+def _get_presupuesto() -> PresupuestoReintentos:
+    global _presupuesto
+    if _presupuesto is None:
+        settings = get_settings()
+        _presupuesto = PresupuestoReintentos(settings.RETRY_BUDGET_PERCENT, settings.RETRY_BUDGET_BURST)
+    return _presupuesto
+
+
 async def con_reintentos(
     operacion: Callable,
     *args,
-    max_intentos: int = 3,
-    backoff_base: float = 1.0,
-    excepciones_reintentables: Optional[Set[Type[Exception]]] = None,
+    politica: PoliticaReintentos = POLITICA_POR_DEFECTO,
     nombre_operacion: str = "operacion",
     **kwargs,
 ):
     """
     Ejecuta una operacion asincrona con reintentos y backoff exponencial.
+    Respeta el deadline del turno: no inicia un reintento que no alcanza a terminar.
 
     Args:
         operacion: Funcion asincrona a ejecutar
-        max_intentos: Numero maximo de intentos (default: 3)
-        backoff_base: Tiempo base en segundos entre reintentos (default: 1.0)
-        excepciones_reintentables: Set de excepciones que justifican reintento
+        politica: Intentos, backoff y excepciones reintentables
         nombre_operacion: Nombre para logging
 
     Returns:
         Resultado de la operacion
 
     Raises:
-        La ultima excepcion si todos los intentos fallan
+        La ultima excepcion si todos los intentos fallan o se agota el presupuesto de reintentos
+        DeadlineExcedido si el turno no tiene tiempo para otro intento
     """
-    if excepciones_reintentables is None:
-        excepciones_reintentables = {httpx.RequestError}
+    presupuesto = _get_presupuesto()
+    presupuesto.depositar()
+    reintentables = tuple(politica.excepciones_reintentables)
 
-    ultimo_error = None
-
-    for intento in range(1, max_intentos + 1):
+    for intento in range(1, politica.max_intentos + 1):
+        deadline.verificar(nombre_operacion)
         try:
             return await operacion(*args, **kwargs)
-        except tuple(excepciones_reintentables) as e:
-            ultimo_error = e
-            if intento < max_intentos:
-                espera = backoff_base * (2 ** (intento - 1))
-                logger.warning(
-                    "Reintento %d/%d para %s (espera %.1fs): %s",
-                    intento, max_intentos, nombre_operacion, espera, e,
-                )
-                await asyncio.sleep(espera)
-            else:
+        except DeadlineExcedido:
+            raise
+        except reintentables as e:
+            if intento >= politica.max_intentos:
                 logger.error(
                     "Agotados %d intentos para %s: %s",
-                    max_intentos, nombre_operacion, e,
+                    politica.max_intentos, nombre_operacion, e,
                 )
+                raise
+
+            espera = politica.espera(intento)
+            quedan = deadline.restante()
+            if quedan is not None and quedan <= espera:
+                logger.warning(
+                    "Sin tiempo para reintentar %s (quedan %.1fs): %s",
+                    nombre_operacion, max(quedan, 0), e,
+                )
+                raise DeadlineExcedido(nombre_operacion) from e
+
+            if not presupuesto.retirar():
+                logger.warning("Presupuesto de reintentos agotado, sin reintentar %s: %s", nombre_operacion, e)
+                raise
+
+            logger.warning(
+                "Reintento %d/%d para %s (espera %.1fs): %s",
+                intento, politica.max_intentos, nombre_operacion, espera, e,
+            )
+            await asyncio.sleep(espera)
+
 
-    raise ultimo_error
+def get_stats() -> dict:
+    """Llamadas, reintentos y reintentos negados por presupuesto en este proceso."""
+    return dict(_get_presupuesto().stats)
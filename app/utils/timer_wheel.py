@@ -0,0 +1,99 @@
+"""
+Hashed timer wheel para programar miles de deadlines sin un task por clave.
+
+Cada clave vive en un único slot (ceil(deadline / resolucion) % slots). Armar,
+re-armar y cancelar son O(1); avanzar la rueda solo revisa los slots
+cuyos ticks ya pasaron. Las claves con deadline en una vuelta futura de
+la rueda permanecen en su slot hasta que les toque.
+
+Uso:
+    rueda = TimerWheel(resolucion=1.0, slots=512)
+    rueda.arm("56911111111", time.time() + 120)
+    vencidas = rueda.avanzar(time.time())
+"""
+import math
+from typing import Dict, List, Set
+
+
+class TimerWheel:
+    """Rueda de timers hasheada. No es thread-safe (pensada para el event loop)."""
+
+    def __init__(self, resolucion: float = 1.0, slots: int = 512):
+        if resolucion <= 0 or slots <= 0:
+            raise ValueError("resolucion y slots deben ser positivos")
+        self.resolucion = resolucion
+        self._slots: List[Set[str]] = [set() for _ in range(slots)]
+        self._deadlines: Dict[str, float] = {}
+        self._slot_de: Dict[str, int] = {}
+        # Próximo tick (absoluto) que todavía no se ha revisado
+        self._proximo_tick: int = -1
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __contains__(self, clave: str) -> bool:
+        return clave in self._deadlines
+
+    def _tick(self, instante: float) -> int:
+        return math.floor(instante / self.resolucion)
+
+    def _tick_de_deadline(self, deadline: float) -> int:
+        # Redondeo hacia arriba: al revisar el tick t (t * resolucion <= ahora)
+        # todas las claves de la vuelta actual en ese slot ya vencieron
+        return math.ceil(deadline / self.resolucion)
+
+    def arm(self, clave: str, deadline: float):
+        """Programa (o re-programa) el deadline de una clave. O(1)."""
+        self.cancel(clave)
+
+        tick = self._tick_de_deadline(deadline)
+        # Si el tick ya fue revisado, dejarlo en el próximo a revisar
+        if self._proximo_tick >= 0 and tick < self._proximo_tick:
+            tick = self._proximo_tick
+
+        indice = tick % len(self._slots)
+        self._slots[indice].add(clave)
+        self._slot_de[clave] = indice
+        self._deadlines[clave] = deadline
+
+    def cancel(self, clave: str):
+        """Elimina una clave de la rueda si existe. O(1)."""
+        indice = self._slot_de.pop(clave, None)
+        if indice is None:
+            return
+        self._slots[indice].discard(clave)
+        self._deadlines.pop(clave, None)
+
+    def deadline(self, clave: str) -> float | None:
+        """Retorna el deadline programado de una clave, o None."""
+        return self._deadlines.get(clave)
+
+    def avanzar(self, ahora: float) -> List[str]:
+        """
+        Avanza la rueda hasta `ahora` y retorna (removiéndolas) las claves
+        cuyo deadline ya venció.
+        """
+        tick_actual = self._tick(ahora)
+        if self._proximo_tick < 0:
+            self._proximo_tick = tick_actual
+
+        if tick_actual < self._proximo_tick:
+            return []
+
+        # Si pasó más de una vuelta completa basta con revisar cada slot una vez
+        n_ticks = min(tick_actual - self._proximo_tick + 1, len(self._slots))
+        inicio = tick_actual - n_ticks + 1
+
+        vencidas: List[str] = []
+        for tick in range(inicio, tick_actual + 1):
+            slot = self._slots[tick % len(self._slots)]
+            if not slot:
+                continue
+            for clave in [c for c in slot if self._deadlines[c] <= ahora]:
+                slot.discard(clave)
+                del self._slot_de[clave]
+                del self._deadlines[clave]
+                vencidas.append(clave)
+
+        self._proximo_tick = tick_actual + 1
+        return vencidas
@@ -0,0 +1,311 @@
+"""
+Tracing liviano por turno (un mensaje entrante = una traza).
+
+- El webhook abre la traza con `turno()`: genera un trace_id que viaja en un
+  contextvar y que el logger agrega a cada registro (campo `trace_id`).
+- `span(nombre, fase)` mide un tramo anidado (auth, estado, cada iteracion
+  del LLM, cada tool, cada llamada a FileMaker, cada envio). Fuera de un
+  turno no registra nada.
+- Al cerrar el turno, si duro mas de TRACE_SLOW_TURN_SECONDS se emite un
+  solo registro "turno lento" con el desglose por fase (tiempo exclusivo de
+  cada span, sin contar sus hijos) y los spans mas lentos.
+- Exportador OTLP/HTTP (JSON) opcional: con TRACE_OTLP_ENDPOINT (ej.
+  http://localhost:4318/v1/traces) los spans se envian en lotes a un
+  collector local.
+"""
+import asyncio
+import functools
+import logging
+import secrets
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Spans encolados para exportar como maximo (si el collector no responde se descartan)
+_MAX_COLA_EXPORTACION = 5000
+_LOTE_EXPORTACION = 256
+_INTERVALO_EXPORTACION = 2.0
+
+
+@dataclass
+class Span:
+    """Un tramo medido dentro de una traza."""
+    nombre: str
+    fase: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    inicio_ns: int
+    fin_ns: int = 0
+    atributos: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def duracion(self) -> float:
+        return (self.fin_ns - self.inicio_ns) / 1e9
+
+
+@dataclass
+class Traza:
+    """Spans de un turno; `raiz` cubre el turno completo."""
+    trace_id: str
+    raiz: Span
+    spans: List[Span] = field(default_factory=list)
+
+
+_traza: ContextVar[Optional[Traza]] = ContextVar("traza", default=None)
+_span_actual: ContextVar[Optional[Span]] = ContextVar("span_actual", default=None)
+# Separado de la traza: tambien lo fijan los workers que continúan un turno (ej. envios encolados)
+_trace_id: ContextVar[Optional[str]] = ContextVar("trace_id", default=None)
+
+_cola_exportacion: Optional[asyncio.Queue] = None
+_exportador_task: Optional[asyncio.Task] = None
+_stats: Dict[str, int] = {"turnos": 0, "turnos_lentos": 0, "spans_exportados": 0, "spans_descartados": 0}
+
+
+def trace_id_actual() -> Optional[str]:
+    """trace_id del turno en curso (None fuera de un turno)."""
+    return _trace_id.get()
+
+
+@contextmanager
+def con_trace_id(trace_id: Optional[str]):
+    """Asocia los logs del bloque a un turno ya cerrado (ej. un envio encolado)."""
+    token = _trace_id.set(trace_id)
+    try:
+        yield
+    finally:
+        _trace_id.reset(token)
+
+
+def anotar(**atributos):
+    """Agrega atributos al span raiz del turno (telefono, rol, tipo de mensaje)."""
+    traza = _traza.get()
+    if traza is not None:
+        traza.raiz.atributos.update(atributos)
+
+
+@contextmanager
+def turno(nombre: str, **atributos):
+    """Abre la traza de un turno; al salir emite el resumen si fue lento y la exporta."""
+    trace_id = secrets.token_hex(16)
+    raiz = Span(
+        nombre=nombre, fase="turno", trace_id=trace_id, span_id=secrets.token_hex(8),
+        parent_id=None, inicio_ns=time.time_ns(), atributos=dict(atributos),
+    )
+    traza = Traza(trace_id=trace_id, raiz=raiz)
+    tokens = (_traza.set(traza), _span_actual.set(raiz), _trace_id.set(trace_id))
+    try:
+        yield traza
+    except BaseException as e:
+        raiz.error = repr(e)
+        raise
+    finally:
+        raiz.fin_ns = time.time_ns()
+        try:
+            _cerrar_turno(traza)
+        finally:
+            _traza.reset(tokens[0])
+            _span_actual.reset(tokens[1])
+            _trace_id.reset(tokens[2])
+
+
+@contextmanager
+def span(nombre: str, fase: str, **atributos):
+    """Mide un tramo del turno actual (no-op fuera de un turno)."""
+    traza = _traza.get()
+    if traza is None:
+        yield None
+        return
+
+    padre = _span_actual.get()
+    actual = Span(
+        nombre=nombre, fase=fase, trace_id=traza.trace_id, span_id=secrets.token_hex(8),
+        parent_id=padre.span_id if padre else None, inicio_ns=time.time_ns(), atributos=atributos,
+    )
+    token = _span_actual.set(actual)
+    try:
+        yield actual
+    except BaseException as e:
+        actual.error = repr(e)
+        raise
+    finally:
+        actual.fin_ns = time.time_ns()
+        _span_actual.reset(token)
+        traza.spans.append(actual)
+
+
+def trazado(nombre: str, fase: str):
+    """Decorador para funciones async: cada llamada es un span."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(nombre, fase):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ──────────────────────────────────────────────
+# Resumen de turnos lentos
+# ──────────────────────────────────────────────
+
+def _desglose(traza: Traza) -> Dict[str, float]:
+    """Tiempo exclusivo (ms) por fase: la duracion de cada span menos la de sus hijos."""
+    hijos: Dict[str, float] = {}
+    for s in traza.spans:
+        if s.parent_id is not None:
+            hijos[s.parent_id] = hijos.get(s.parent_id, 0.0) + s.duracion
+
+    fases: Dict[str, float] = {}
+    for s in traza.spans:
+        exclusivo = max(0.0, s.duracion - hijos.get(s.span_id, 0.0))
+        fases[s.fase] = fases.get(s.fase, 0.0) + exclusivo
+
+    fases["otros"] = max(0.0, traza.raiz.duracion - hijos.get(traza.raiz.span_id, 0.0))
+    return {fase: round(segundos * 1000, 1) for fase, segundos in fases.items()}
+
+
+def _cerrar_turno(traza: Traza):
+    _stats["turnos"] += 1
+    settings = get_settings()
+
+    if traza.raiz.duracion >= settings.TRACE_SLOW_TURN_SECONDS:
+        _stats["turnos_lentos"] += 1
+        lentos = sorted(traza.spans, key=lambda s: s.duracion, reverse=True)[:5]
+        resumen = {
+            "trace_id": traza.trace_id,
+            "total_ms": round(traza.raiz.duracion * 1000, 1),
+            "fases_ms": _desglose(traza),
+            "spans": len(traza.spans),
+            "mas_lentos": [
+                {"nombre": s.nombre, "ms": round(s.duracion * 1000, 1), **({"error": s.error} if s.error else {})}
+                for s in lentos
+            ],
+            **traza.raiz.atributos,
+        }
+        logger.warning(
+            "Turno lento (%.0f ms): %s", traza.raiz.duracion * 1000, resumen["fases_ms"],
+            extra={"turn_summary": resumen},
+        )
+
+    if _cola_exportacion is not None:
+        for s in [traza.raiz] + traza.spans:
+            try:
+                _cola_exportacion.put_nowait(s)
+            except asyncio.QueueFull:
+                _stats["spans_descartados"] += 1
+
+
+# ──────────────────────────────────────────────
+# Exportador OTLP/HTTP (JSON)
+# ──────────────────────────────────────────────
+
+def _valor_otlp(valor: Any) -> dict:
+    if isinstance(valor, bool):
+        return {"boolValue": valor}
+    if isinstance(valor, int):
+        return {"intValue": str(valor)}
+    if isinstance(valor, float):
+        return {"doubleValue": valor}
+    return {"stringValue": str(valor)}
+
+
+def _span_otlp(s: Span) -> dict:
+    atributos = {"fase": s.fase, **s.atributos}
+    datos = {
+        "traceId": s.trace_id,
+        "spanId": s.span_id,
+        "name": s.nombre,
+        "kind": 2 if s.parent_id is None else 1,  # SERVER para la raiz, INTERNAL el resto
+        "startTimeUnixNano": str(s.inicio_ns),
+        "endTimeUnixNano": str(s.fin_ns),
+        "attributes": [{"key": k, "value": _valor_otlp(v)} for k, v in atributos.items()],
+        "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+    }
+    if s.parent_id:
+        datos["parentSpanId"] = s.parent_id
+    return datos
+
+
+async def _enviar_lote(client: httpx.AsyncClient, url: str, lote: List[Span]):
+    settings = get_settings()
+    cuerpo = {
+        "resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": settings.TRACE_SERVICE_NAME}},
+                {"key": "deployment.environment", "value": {"stringValue": settings.ENVIRONMENT}},
+            ]},
+            "scopeSpans": [{"scope": {"name": "skinmed.tracing"}, "spans": [_span_otlp(s) for s in lote]}],
+        }],
+    }
+    try:
+        resp = await client.post(url, json=cuerpo)
+        resp.raise_for_status()
+        _stats["spans_exportados"] += len(lote)
+    except Exception as e:
+        _stats["spans_descartados"] += len(lote)
+        logger.debug("No se pudieron exportar %d spans: %s", len(lote), e)
+
+
+async def _exportador_loop(url: str):
+    async with httpx.AsyncClient(timeout=5.0) as client:
+        while True:
+            lote = [await _cola_exportacion.get()]
+            limite = time.monotonic() + _INTERVALO_EXPORTACION
+            while len(lote) < _LOTE_EXPORTACION:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(await asyncio.wait_for(_cola_exportacion.get(), restante))
+                except asyncio.TimeoutError:
+                    break
+            await _enviar_lote(client, url, lote)
+
+
+async def start():
+    """Inicia el exportador OTLP si TRACE_OTLP_ENDPOINT esta configurado."""
+    global _cola_exportacion, _exportador_task
+    url = get_settings().TRACE_OTLP_ENDPOINT
+    if not url or _exportador_task is not None:
+        return
+    _cola_exportacion = asyncio.Queue(maxsize=_MAX_COLA_EXPORTACION)
+    _exportador_task = asyncio.create_task(_exportador_loop(url))
+    logger.info("Exportador OTLP de trazas activo -> %s", url)
+
+
+async def stop():
+    """Detiene el exportador y envia lo que quede en cola."""
+    global _cola_exportacion, _exportador_task
+    if _exportador_task is None:
+        return
+    _exportador_task.cancel()
+    try:
+        await _exportador_task
+    except asyncio.CancelledError:
+        pass
+
+    pendientes = []
+    while not _cola_exportacion.empty():
+        pendientes.append(_cola_exportacion.get_nowait())
+    if pendientes:
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            for i in range(0, len(pendientes), _LOTE_EXPORTACION):
+                await _enviar_lote(client, get_settings().TRACE_OTLP_ENDPOINT, pendientes[i:i + _LOTE_EXPORTACION])
+
+    _cola_exportacion = None
+    _exportador_task = None
+
+
+def get_stats() -> dict:
+    """Turnos trazados, turnos lentos y spans exportados/descartados."""
+    return dict(_stats)
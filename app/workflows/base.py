@@ -1,4 +1,6 @@
 from abc import ABC, abstractmethod
+from typing import Awaitable, List
+
 from fastapi import BackgroundTasks
 
 class WorkflowHandler(ABC):
@@ -11,3 +13,7 @@ class WorkflowHandler(ABC):
     async def handle_button(self, user, phone: str, button_title: str, background_tasks: BackgroundTasks):
         """Handle button click from user"""
         pass
+
+    def lecturas_prefetch(self, user) -> List[Awaitable]:
+        """Lecturas a precalentar al inicio de una sesion (ver workflows/prefetch.py)"""
+        return []
@@ -12,8 +12,12 @@ from app.workflows.base import WorkflowHandler
 from app.workflows.role_registry import register_workflow
 from app.workflows import state as workflow_state
 from app.workflows import session_timer
+from app.workflows import prefetch
 from app.services.filemaker import FileMakerService
 from app.services.whatsapp import WhatsAppService
+from app.services import notificaciones_enfermeria
+from app.services import recados_outbox
+from app.services import recados_vistos
 from app.formatters.agenda import AgendaFormatter
 from app.formatters.recados import RecadosFormatter
 from app.exceptions import ServicioNoDisponibleError
@@ -108,6 +112,10 @@ class DoctorWorkflow(WorkflowHandler):
             "_Puedes escribir *menu* en cualquier momento para volver al inicio o *salir* para terminar el flujo._"
         )
 
+    def lecturas_prefetch(self, user):
+        """Agenda de hoy y recados: las dos opciones mas tocadas del menu inicial"""
+        return [FileMakerService.get_agenda_raw(user.id), prefetch.recados(user.id)]
+
     async def _send_menu(self, user, phone: str):
         """Envia la plantilla inicial"""
         full_name = f"{user.name} {user.last_name}".strip()
@@ -229,9 +237,12 @@ class DoctorWorkflow(WorkflowHandler):
         notificar_enfermeria = categoria not in ["Enviar receta", "Agendar paciente"]
 
         try:
+            # Clave del outbox: tambien deduplica la notificacion a enfermeria
+            clave = None
             if guardar_en_fm:
-                await FileMakerService.create_recado(
+                clave = await recados_outbox.encolar(
                     doctor_id=user.id,
+                    phone=phone,
                     texto=texto_formateado,
                     categoria=categoria,
                     fecha=fecha,
@@ -239,16 +250,7 @@ class DoctorWorkflow(WorkflowHandler):
                 )
 
             if notificar_enfermeria:
-                settings = get_settings()
-                await WhatsAppService.send_template(
-                    settings.CHIEF_NURSE_PHONE,
-                    user.name,
-                    "reenviar_recado_secretaria",
-                    include_header=False,
-                    include_body=False,
-                    header_params=[categoria],
-                    body_params=[user.name, message_text],
-                )
+                await notificaciones_enfermeria.notificar_recado(user, categoria, message_text, idempotency_key=clave)
 
             # Confirmacion al doctor
             if guardar_en_fm and notificar_enfermeria:
@@ -319,6 +321,7 @@ class DoctorWorkflow(WorkflowHandler):
 
             formatted_msg = RecadosFormatter.format(recados_data, user.name, user.last_name, pacient_names)
             await WhatsAppService.send_message(phone, formatted_msg)
+            await recados_vistos.registrar(user.id, RecadosFormatter.conteo_entradas(recados_data))
             await self._ask_continue(phone)
         except ServicioNoDisponibleError as e:
             logger.error("Servicio no disponible al consultar recados: %s", e)
@@ -10,4 +10,7 @@ from app.workflows.manager import ManagerWorkflow
 @register_workflow("medico_gerencia")
 class HybridManagerWorkflow(ManagerWorkflow):
     """Hereda toda la funcionalidad del ManagerWorkflow."""
-    pass
+
+    def lecturas_prefetch(self, user):
+        """Agenda general mas la agenda y recados propios (perfil de medico)"""
+        return super().lecturas_prefetch(user) + self._doctor_workflow.lecturas_prefetch(user)
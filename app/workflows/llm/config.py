@@ -8,7 +8,10 @@ from __future__ import annotations
 
 import logging
 from dataclasses import dataclass, field
-from typing import Any, Awaitable, Callable, Dict, List, Optional
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import pytz
 
 logger = logging.getLogger(__name__)
 
@@ -31,7 +34,9 @@ class RoleLLMConfig:
         tools:                  Definiciones de tools en formato OpenAI function calling.
         tool_handlers:          Mapeo nombre_funcion -> función async que la ejecuta.
         prompt_context_builder: Función que recibe (user) y retorna dict con
-                                los valores para los placeholders del prompt.
+                                los valores de los placeholders propios del
+                                usuario. {fecha_actual} y {dia_semana} se
+                                completan con contexto_fecha().
     """
     role_name: str
     system_prompt_template: str
@@ -67,3 +72,62 @@ def get_llm_config(role: str) -> Optional[RoleLLMConfig]:
 def get_registered_llm_roles() -> List[str]:
     """Retorna los roles que tienen configuración LLM registrada."""
     return list(_LLM_CONFIGS.keys())
+
+
+# ──────────────────────────────────────────────
+# System prompt
+# ──────────────────────────────────────────────
+
+_DIAS_SEMANA = [
+    "lunes", "martes", "miércoles", "jueves",
+    "viernes", "sábado", "domingo",
+]
+
+# Prompts con la fecha ya aplicada, por (rol, fecha). Al responder solo
+# resta completar los placeholders del usuario.
+_PROMPTS_PARCIALES: Dict[Tuple[str, str], str] = {}
+
+
+class _ContextoParcial(dict):
+    """Deja intactos los placeholders sin valor para completarlos después."""
+
+    def __missing__(self, key: str) -> str:
+        return "{" + key + "}"
+
+
+def contexto_fecha(ahora: Optional[datetime] = None) -> Dict[str, str]:
+    """Placeholders de fecha comunes a todos los prompts (hora de Chile)."""
+    ahora = ahora or datetime.now(pytz.timezone("America/Santiago"))
+    return {
+        "fecha_actual": ahora.strftime("%Y-%m-%d"),
+        "dia_semana": _DIAS_SEMANA[ahora.weekday()],
+    }
+
+
+def _prompt_parcial(config: RoleLLMConfig, fecha: Dict[str, str]) -> str:
+    clave = (config.role_name, fecha["fecha_actual"])
+    parcial = _PROMPTS_PARCIALES.get(clave)
+    if parcial is None:
+        # Cambio de día: descartar los parciales de fechas anteriores
+        for vieja in [k for k in _PROMPTS_PARCIALES if k[1] != fecha["fecha_actual"]]:
+            del _PROMPTS_PARCIALES[vieja]
+        parcial = config.system_prompt_template.format_map(_ContextoParcial(fecha))
+        _PROMPTS_PARCIALES[clave] = parcial
+    return parcial
+
+
+def render_system_prompt(config: RoleLLMConfig, user) -> str:
+    """Construye el system prompt del rol para un usuario."""
+    parcial = _prompt_parcial(config, contexto_fecha())
+    return parcial.format(**config.prompt_context_builder(user))
+
+
+def prerender_system_prompts() -> int:
+    """
+    Pre-renderiza la parte del system prompt que no depende del usuario
+    para todos los roles registrados. Retorna la cantidad de roles.
+    """
+    fecha = contexto_fecha()
+    for config in _LLM_CONFIGS.values():
+        _prompt_parcial(config, fecha)
+    return len(_LLM_CONFIGS)
@@ -7,17 +7,22 @@ al RoleLLMConfig correspondiente.
 """
 import json
 import logging
+import time
 from datetime import datetime
 from typing import Any, Dict, List
 
 import pytz
 
+from app import metrics
 from app.config import get_settings
+from app.logging_config import muestrear_payload, resumir_payload
 from app.services import redis as redis_svc
 from app.services import llm_service
 from app.services.whatsapp import WhatsAppService
-from app.exceptions import ServicioNoDisponibleError
-from app.workflows.llm.config import get_llm_config
+from app.exceptions import ServicioNoDisponibleError, DeadlineExcedido
+from app.utils import tracing
+from app.workflows.llm import recorder
+from app.workflows.llm.config import get_llm_config, render_system_prompt
 
 logger = logging.getLogger(__name__)
 
@@ -55,6 +60,7 @@ async def is_legacy_fallback(phone: str) -> bool:
 async def set_legacy_fallback(phone: str):
     """Marca la sesión como legacy fallback para el resto de la conversación."""
     await redis_svc.set(_fallback_key(phone), "1", ttl=_HISTORY_TTL)
+    metrics.FALLBACKS_LEGACY.inc()
     logger.info("[LLM_ENGINE] Sesión %s marcada como legacy fallback", phone)
 
 
@@ -117,7 +123,11 @@ async def _execute_tool(
         return f"Error: función '{tool_name}' no reconocida."
 
     try:
-        return await handler(user, phone, arguments)
+        with metrics.cronometro(metrics.TOOL_LATENCIA, tool=tool_name), tracing.span(f"tool.{tool_name}", fase="tool"):
+            return await handler(user, phone, arguments)
+    except DeadlineExcedido:
+        # Sin tiempo para otra vuelta del LLM: se corta el turno completo
+        raise
     except ServicioNoDisponibleError as e:
         logger.error("[LLM_ENGINE] Error en herramienta %s: %s", tool_name, e)
         return (
@@ -147,28 +157,41 @@ async def process_message(user, phone: str, message_text: str, role: str) -> str
         "OK" si el LLM manejó el mensaje exitosamente.
         "FALLBACK" si el LLM no pudo manejar el mensaje.
     """
+    # Con LLM_TRACE_PATH el turno queda grabado para reproducirlo offline (bench/replay.py)
+    grabacion = recorder.iniciar(user, phone, role, message_text)
+    try:
+        resultado = await _procesar(user, phone, message_text, role, grabacion)
+    except BaseException as e:
+        grabacion.cerrar(f"error:{type(e).__name__}")
+        raise
+    grabacion.cerrar(resultado)
+    return resultado
+
+
+async def _procesar(user, phone: str, message_text: str, role: str, grabacion: recorder.Grabacion) -> str:
+    """Agent loop de `process_message`."""
     config = get_llm_config(role)
     if config is None:
         logger.error("[LLM_ENGINE] No hay config LLM registrada para rol '%s'", role)
         return "FALLBACK"
 
-    # Construir contexto para el prompt usando el builder del rol
-    prompt_context = config.prompt_context_builder(user)
-
-    # Construir system prompt personalizado
+    # Construir system prompt personalizado (la parte fija del día viene pre-renderizada)
     system_msg = {
         "role": "system",
-        "content": config.system_prompt_template.format(**prompt_context),
+        "content": render_system_prompt(config, user),
     }
 
     # Obtener historial existente
     history = await _get_history(phone)
 
+    # Payloads completos solo en los turnos muestreados (LOG_PAYLOAD_SAMPLE_RATE)
+    con_payload = muestrear_payload(phone)
+
     # Agregar mensaje del usuario
     user_msg = {"role": "user", "content": message_text}
     logger.info(
         "[LLM_DEBUG] Mensaje usuario [%s] para %s: %s",
-        role, phone, message_text,
+        role, phone, resumir_payload(message_text, con_payload),
     )
     history.append(user_msg)
 
@@ -177,13 +200,16 @@ async def process_message(user, phone: str, message_text: str, role: str) -> str
 
     try:
         # Llamar al LLM
-        assistant_response = await llm_service.chat_completion(
-            messages=messages,
-            tools=config.tools,
-        )
+        inicio = time.perf_counter()
+        with metrics.cronometro(metrics.LLM_LATENCIA, paso="inicial"), tracing.span("llm.inicial", fase="llm", iteracion=0):
+            assistant_response = await llm_service.chat_completion(
+                messages=messages,
+                tools=config.tools,
+            )
+        grabacion.llm(messages, assistant_response, inicio)
 
         # Log de la respuesta inicial de OpenAI
-        _log_llm_response(assistant_response, phone, role, step="initial")
+        _log_llm_response(assistant_response, phone, role, step="initial", con_payload=con_payload)
 
         # Procesar tool calls si existen (agent loop)
         max_iterations = 5  # Prevenir loops infinitos
@@ -211,18 +237,19 @@ async def process_message(user, phone: str, message_text: str, role: str) -> str
 
                 logger.info(
                     "[LLM_ENGINE] Ejecutando tool: %s(%s) para %s [rol=%s]",
-                    func_name, func_args, phone, role,
+                    func_name, resumir_payload(func_args, con_payload), phone, role,
                 )
 
+                inicio = time.perf_counter()
                 result = await _execute_tool(
                     func_name, func_args, user, phone, config.tool_handlers,
                 )
+                grabacion.tool(func_name, func_args, result, inicio)
 
                 # Log del resultado para debugging
-                result_preview = result[:500] + "..." if len(result) > 500 else result
                 logger.info(
                     "[LLM_DEBUG] Tool result %s -> %s [%s]",
-                    func_name, result_preview, phone,
+                    func_name, resumir_payload(result, con_payload, limite=500), phone,
                 )
 
                 # Agregar resultado al historial
@@ -235,13 +262,17 @@ async def process_message(user, phone: str, message_text: str, role: str) -> str
 
             # Llamar al LLM de nuevo con los resultados
             messages = [system_msg] + history
-            assistant_response = await llm_service.chat_completion(
-                messages=messages,
-                tools=config.tools,
-            )
+            inicio = time.perf_counter()
+            with metrics.cronometro(metrics.LLM_LATENCIA, paso="post_tool"), \
+                    tracing.span("llm.post_tool", fase="llm", iteracion=iteration):
+                assistant_response = await llm_service.chat_completion(
+                    messages=messages,
+                    tools=config.tools,
+                )
+            grabacion.llm(messages, assistant_response, inicio)
 
             # Log de la respuesta post-tool de OpenAI
-            _log_llm_response(assistant_response, phone, role, step=f"post-tool-{iteration}")
+            _log_llm_response(assistant_response, phone, role, step=f"post-tool-{iteration}", con_payload=con_payload)
 
         # Respuesta final del LLM (sin tool calls)
         final_content = assistant_response.get("content", "")
@@ -282,7 +313,7 @@ async def process_message(user, phone: str, message_text: str, role: str) -> str
             logger.info(
                 "[LLM_DEBUG] Respuesta final LLM (%d chars) para %s: %s",
                 len(final_content), phone,
-                final_content[:300] + "..." if len(final_content) > 300 else final_content,
+                resumir_payload(final_content, con_payload, limite=300),
             )
             await WhatsAppService.send_message(phone, final_content)
         else:
@@ -294,6 +325,8 @@ async def process_message(user, phone: str, message_text: str, role: str) -> str
 
         return "OK"
 
+    except DeadlineExcedido:
+        raise
     except ServicioNoDisponibleError as e:
         logger.error(
             "[LLM_ENGINE] Servicio no disponible: %s — activando fallback para %s",
@@ -338,7 +371,7 @@ def _serialize_assistant_message(response: Dict[str, Any]) -> Dict[str, Any]:
     return msg
 
 
-def _log_llm_response(response: Dict[str, Any], phone: str, role: str, step: str):
+def _log_llm_response(response: Dict[str, Any], phone: str, role: str, step: str, con_payload: bool = True):
     """
     Loguea la respuesta de OpenAI de forma legible para debugging.
 
@@ -346,26 +379,31 @@ def _log_llm_response(response: Dict[str, Any], phone: str, role: str, step: str
     - Si el modelo devolvió tool_calls (con nombre y argumentos)
     - Si el modelo devolvió content directo (truncado)
     - El paso del agent loop (initial, post-tool-1, etc.)
+
+    Sin `con_payload` (turno no muestreado) se omiten argumentos y contenido.
     """
     tool_calls = response.get("tool_calls")
     content = response.get("content")
 
     if tool_calls:
         calls_summary = ", ".join(
-            f"{tc['function']['name']}({tc['function']['arguments']})"
+            f"{tc['function']['name']}({resumir_payload(tc['function']['arguments'], con_payload)})"
             for tc in tool_calls
         )
+        if not content:
+            content_preview = "null"
+        elif con_payload:
+            content_preview = repr(content[:100])
+        else:
+            content_preview = resumir_payload(content, False)
         logger.info(
             "[LLM_DEBUG] OpenAI response [%s] step=%s: TOOL_CALLS=[%s] content=%s [%s]",
-            role, step, calls_summary,
-            repr(content[:100]) if content else "null",
-            phone,
+            role, step, calls_summary, content_preview, phone,
         )
     elif content:
-        preview = content[:300] + "..." if len(content) > 300 else content
         logger.info(
             "[LLM_DEBUG] OpenAI response [%s] step=%s: CONTENT (%d chars)=%s [%s]",
-            role, step, len(content), preview, phone,
+            role, step, len(content), resumir_payload(content, con_payload, limite=300), phone,
         )
     else:
         logger.warning(
@@ -0,0 +1,160 @@
+"""
+Grabacion opt-in de turnos del agente LLM para reproducirlos offline.
+
+Con LLM_TRACE_PATH configurado, cada llamada a `engine.process_message`
+agrega una linea JSON al archivo con:
+
+- el usuario, el rol y el mensaje recibido
+- cada llamada al LLM: mensajes enviados, respuesta del modelo y duracion
+- cada tool ejecutada: argumentos, resultado y duracion
+- el resultado del turno ("OK", "FALLBACK" o la excepcion) y su duracion
+
+bench/replay.py reproduce estos turnos contra el motor sin red.
+
+Las trazas contienen datos de pacientes: usar solo en entornos de prueba.
+Al cerrar el turno el registro solo se encola; la serializacion JSON y la
+escritura al archivo ocurren en un hilo escritor, fuera del event loop
+(igual que los logs en logging_config). Por eso mensajes, respuestas y
+argumentos se copian al registrarlos: el hilo serializa lo que se envio.
+"""
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import get_settings
+from app.utils import tracing
+
+logger = logging.getLogger(__name__)
+
+VERSION_TRAZA = 1
+
+# (ruta, registro) de turnos cerrados pendientes de escribir; None detiene el hilo
+_cola: "queue.SimpleQueue[Optional[Tuple[str, Dict[str, Any]]]]" = queue.SimpleQueue()
+_escritor: Optional[threading.Thread] = None
+_lock = threading.Lock()
+
+
+def _escribir_pendientes():
+    while True:
+        item = _cola.get()
+        if item is None:
+            return
+        ruta, registro = item
+        try:
+            linea = json.dumps(registro, ensure_ascii=False, default=str)
+            with open(ruta, "a", encoding="utf-8") as f:
+                f.write(linea + "\n")
+        except Exception as e:
+            logger.warning("[LLM_TRACE] No se pudo grabar el turno en %s: %s", ruta, e)
+
+
+def _encolar(ruta: str, registro: Dict[str, Any]):
+    global _escritor
+    with _lock:
+        if _escritor is None:
+            _escritor = threading.Thread(target=_escribir_pendientes, name="llm-trace-writer", daemon=True)
+            _escritor.start()
+    _cola.put((ruta, registro))
+
+
+def detener():
+    """Escribe los turnos pendientes y detiene el hilo escritor."""
+    global _escritor
+    with _lock:
+        escritor, _escritor = _escritor, None
+    if escritor is not None:
+        _cola.put(None)
+        escritor.join()
+
+
+atexit.register(detener)
+
+
+def _instantanea(valor: Any) -> Any:
+    """
+    Copia profunda de listas y dicts: el engine sigue modificando el
+    historial en el event loop mientras el hilo escritor serializa el turno.
+    """
+    if isinstance(valor, list):
+        return [_instantanea(v) for v in valor]
+    if isinstance(valor, dict):
+        return {k: _instantanea(v) for k, v in valor.items()}
+    return valor
+
+
+class Grabacion:
+    """Turno en curso; sin LLM_TRACE_PATH todos los metodos son no-op."""
+
+    def __init__(self, ruta: str, user, phone: str, role: str, message_text: str):
+        self._ruta = ruta
+        self._inicio = time.perf_counter()
+        self._registro: Dict[str, Any] = {
+            "version": VERSION_TRAZA,
+            "trace_id": tracing.trace_id_actual(),
+            "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "rol": role,
+            "telefono": phone,
+            "usuario": user.model_dump() if hasattr(user, "model_dump") else dict(vars(user)),
+            "mensaje": message_text,
+            "llamadas_llm": [],
+            "tools": [],
+        }
+
+    @property
+    def _iteracion(self) -> int:
+        return max(0, len(self._registro["llamadas_llm"]) - 1)
+
+    def llm(self, mensajes: List[Dict[str, Any]], respuesta: Dict[str, Any], inicio: float):
+        """Registra una llamada al LLM que empezo en `inicio` (time.perf_counter())."""
+        self._registro["llamadas_llm"].append({
+            "mensajes": _instantanea(mensajes),
+            "respuesta": _instantanea(respuesta),
+            "ms": round((time.perf_counter() - inicio) * 1000, 1),
+        })
+
+    def tool(self, nombre: str, argumentos: Dict[str, Any], resultado: str, inicio: float):
+        """Registra una tool ejecutada en la iteracion actual del agent loop."""
+        self._registro["tools"].append({
+            "iteracion": self._iteracion + 1,
+            "nombre": nombre,
+            "argumentos": _instantanea(argumentos),
+            "resultado": resultado,
+            "ms": round((time.perf_counter() - inicio) * 1000, 1),
+        })
+
+    def cerrar(self, resultado: str):
+        """Completa el turno y lo encola para agregarlo al archivo de trazas."""
+        self._registro["resultado"] = resultado
+        self._registro["iteraciones"] = self._iteracion
+        self._registro["total_ms"] = round((time.perf_counter() - self._inicio) * 1000, 1)
+        _encolar(self._ruta, self._registro)
+
+
+class _SinGrabacion(Grabacion):
+    def __init__(self):
+        pass
+
+    def llm(self, mensajes, respuesta, inicio):
+        pass
+
+    def tool(self, nombre, argumentos, resultado, inicio):
+        pass
+
+    def cerrar(self, resultado):
+        pass
+
+
+_SIN_GRABACION = _SinGrabacion()
+
+
+def iniciar(user, phone: str, role: str, message_text: str) -> Grabacion:
+    """Abre la grabacion de un turno (no-op si LLM_TRACE_PATH esta vacio)."""
+    ruta: Optional[str] = get_settings().LLM_TRACE_PATH
+    if not ruta:
+        return _SIN_GRABACION
+    return Grabacion(ruta, user, phone, role, message_text)
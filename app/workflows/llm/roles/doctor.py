@@ -4,11 +4,8 @@ Configuración LLM para el rol de doctores (medico).
 Registra el system prompt, tools, handlers y constructor de contexto
 específicos para el workflow de doctores.
 """
-from datetime import datetime
 from typing import Any, Dict
 
-import pytz
-
 from app.workflows.llm.config import RoleLLMConfig, register_llm_config
 from app.workflows.llm.tools import shared as tool_shared
 from app.workflows.llm.tools import agenda as tool_agenda
@@ -40,7 +37,7 @@ Las categorías de recados disponibles son:
 Reglas importantes:
 - IMPORTANTE: Cuando el doctor mencione fechas relativas ("mañana", "el lunes", "próximo miércoles", etc.), SIEMPRE usa primero la función calcular_fecha para obtener la fecha exacta. NUNCA intentes calcular fechas por tu cuenta.
 - Cuando el doctor quiera ver su agenda, usa la función revisar_agenda. Si menciona una fecha relativa, primero llama a calcular_fecha y luego usa el resultado en revisar_agenda.
-- Cuando el doctor quiera ver sus recados/mensajes, usa la función revisar_recados.
+- Cuando el doctor quiera ver sus recados/mensajes, usa la función revisar_recados. Si pregunta solo por lo nuevo ("¿tengo recados nuevos?", "¿qué hay nuevo?"), usa solo_nuevos=true.
 - Cuando el doctor quiera dejar un recado o mensaje, usa la función publicar_recado. Asegúrate de identificar la categoría correcta y el contenido del mensaje.
 - Si el doctor te saluda, pregunta en qué puedes ayudar, o pregunta qué puedes hacer, responde amablemente listando tus capacidades (revisar agenda, revisar recados, publicar recado). Esto NO es un fallback.
 - SOLO usa el prefijo "[FALLBACK]" si el doctor te pide realizar una acción concreta que NO puedes hacer con tus funciones (por ejemplo: "recetame un medicamento", "llama a un paciente", etc.). Saludos, preguntas generales y conversación casual NO son fallback.
@@ -82,23 +79,11 @@ _TOOL_HANDLERS = {
 # ──────────────────────────────────────────────
 
 def _build_prompt_context(user) -> Dict[str, str]:
-    """Construye el contexto dinámico para el system prompt del doctor."""
+    """Construye el contexto del usuario para el system prompt del doctor."""
     doctor_name = f"{user.name} {user.last_name}".strip()
 
-    tz = pytz.timezone("America/Santiago")
-    now = datetime.now(tz)
-    fecha_actual = now.strftime("%Y-%m-%d")
-
-    _DIAS_SEMANA = [
-        "lunes", "martes", "miércoles", "jueves",
-        "viernes", "sábado", "domingo",
-    ]
-    dia_semana = _DIAS_SEMANA[now.weekday()]
-
     return {
         "doctor_name": doctor_name,
-        "fecha_actual": fecha_actual,
-        "dia_semana": dia_semana,
     }
 
 
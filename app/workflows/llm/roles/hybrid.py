@@ -14,11 +14,8 @@ Tools gerencia:
   - consultar_agenda: datos crudos de todos los doctores (análisis)
   - ver_agenda_doctor: agenda formateada de cualquier doctor (con glosario)
 """
-from datetime import datetime
 from typing import Dict
 
-import pytz
-
 from app.workflows.llm.config import RoleLLMConfig, register_llm_config
 from app.workflows.llm.tools import shared as tool_shared
 from app.workflows.llm.tools import agenda as tool_agenda
@@ -55,7 +52,7 @@ Tienes acceso a las siguientes funciones:
 *Funciones de médico (para tu agenda personal):*
 1. **Calcular fecha**: Convierte fechas relativas ("mañana", "próximo miércoles") a fecha exacta.
 2. **Revisar tu agenda**: Consulta tus propias citas para un día específico.
-3. **Revisar tus recados**: Ve tus recados/mensajes pendientes.
+3. **Revisar tus recados**: Ve tus recados/mensajes pendientes (o solo los nuevos desde tu última revisión).
 4. **Publicar recado**: Crea un nuevo recado.
 
 *Funciones de gerencia (para la clínica):*
@@ -111,23 +108,11 @@ _TOOL_HANDLERS = {
 # ──────────────────────────────────────────────
 
 def _build_prompt_context(user) -> Dict[str, str]:
-    """Construye el contexto dinámico para el system prompt híbrido."""
+    """Construye el contexto del usuario para el system prompt híbrido."""
     doctor_name = f"{user.name} {user.last_name}".strip()
 
-    tz = pytz.timezone("America/Santiago")
-    now = datetime.now(tz)
-    fecha_actual = now.strftime("%Y-%m-%d")
-
-    _DIAS_SEMANA = [
-        "lunes", "martes", "miércoles", "jueves",
-        "viernes", "sábado", "domingo",
-    ]
-    dia_semana = _DIAS_SEMANA[now.weekday()]
-
     return {
         "doctor_name": doctor_name,
-        "fecha_actual": fecha_actual,
-        "dia_semana": dia_semana,
     }
 
 
@@ -7,11 +7,8 @@ específicos para el workflow de gerencia.
 A diferencia del doctor, las tools de gerencia retornan datos crudos
 al LLM para que él interprete y responda — no envían por WhatsApp.
 """
-from datetime import datetime
 from typing import Any, Dict
 
-import pytz
-
 from app.workflows.llm.config import RoleLLMConfig, register_llm_config
 from app.workflows.llm.tools import shared as tool_shared
 from app.workflows.llm.tools import agenda_manager as tool_agenda_mgr
@@ -83,23 +80,11 @@ _TOOL_HANDLERS = {
 # ──────────────────────────────────────────────
 
 def _build_prompt_context(user) -> Dict[str, str]:
-    """Construye el contexto dinámico para el system prompt del manager."""
+    """Construye el contexto del usuario para el system prompt del manager."""
     manager_name = f"{user.name} {user.last_name}".strip()
 
-    tz = pytz.timezone("America/Santiago")
-    now = datetime.now(tz)
-    fecha_actual = now.strftime("%Y-%m-%d")
-
-    _DIAS_SEMANA = [
-        "lunes", "martes", "miércoles", "jueves",
-        "viernes", "sábado", "domingo",
-    ]
-    dia_semana = _DIAS_SEMANA[now.weekday()]
-
     return {
         "manager_name": manager_name,
-        "fecha_actual": fecha_actual,
-        "dia_semana": dia_semana,
     }
 
 
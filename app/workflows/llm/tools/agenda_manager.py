@@ -9,18 +9,17 @@ Soporta filtros opcionales: doctor, solo_resumen.
 """
 import logging
 from datetime import datetime
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
 
 import pytz
 
+from app.formatters import cache_render
+from app.formatters.agenda import Cita, agrupar_por_doctor, citas_validas
 from app.services.filemaker import FileMakerService
+from app.services.ultimo_valido import obtenido_en
 
 logger = logging.getLogger(__name__)
 
-# Filtros de citas inválidas (misma lógica que legacy)
-_IGNORAR_TIPO = ["Eliminada", "Bloqueada", "No Viene"]
-_IGNORAR_ACTIVIDAD = ["RECORDATORIO", "VISITADOR MÉDICO", "LABORATORIO"]
-
 
 # ──────────────────────────────────────────────
 # Definición OpenAI function calling
@@ -75,41 +74,12 @@ TOOL_DEFINITION = {
 # Helpers
 # ──────────────────────────────────────────────
 
-def _filtrar_citas_validas(data: List[Dict]) -> List[Dict]:
-    """Filtra citas eliminadas, bloqueadas, de sistema, etc."""
-    return [
-        r for r in data
-        if r["fieldData"].get("Tipo") not in _IGNORAR_TIPO
-        and r["fieldData"].get("Actividad", "").upper() not in _IGNORAR_ACTIVIDAD
-        and r["fieldData"].get("Hora", "00:00:00") != "00:00:00"
-    ]
-
-
 def _match_doctor(nombre_completo: str, filtro: str) -> bool:
     """Match flexible: verifica si el filtro está contenido en el nombre del doctor."""
     return filtro.lower().strip() in nombre_completo.lower()
 
 
-def _agrupar_por_doctor(data: List[Dict]) -> Dict[str, List[Dict]]:
-    """Agrupa citas por nombre de doctor, ordenadas por hora."""
-    doctors: Dict[str, List[Dict]] = {}
-    for record in data:
-        fd = record.get("fieldData", {})
-        doctor_name = fd.get("Recurso Humano::Nombre Lista", "").strip()
-        if not doctor_name:
-            continue
-        if doctor_name not in doctors:
-            doctors[doctor_name] = []
-        doctors[doctor_name].append(record)
-
-    # Ordenar citas de cada doctor por hora
-    for doctor_name in doctors:
-        doctors[doctor_name].sort(key=lambda x: x["fieldData"].get("Hora", ""))
-
-    return doctors
-
-
-def _formatear_resumen(doctors: Dict[str, List[Dict]], fecha_display: str) -> str:
+def _formatear_resumen(doctors: Dict[str, List[Cita]], fecha_display: str) -> str:
     """Genera resumen: nombre doctor + Nº citas."""
     if not doctors:
         return f"No hay doctores con agenda para {fecha_display}."
@@ -121,7 +91,7 @@ def _formatear_resumen(doctors: Dict[str, List[Dict]], fecha_display: str) -> st
     return "\n".join(lines)
 
 
-def _formatear_detalle(doctors: Dict[str, List[Dict]], fecha_display: str) -> str:
+def _formatear_detalle(doctors: Dict[str, List[Cita]], fecha_display: str) -> str:
     """Genera detalle completo: doctor + cada cita con hora/paciente/procedimiento."""
     if not doctors:
         return f"No hay doctores con agenda para {fecha_display}."
@@ -130,23 +100,16 @@ def _formatear_detalle(doctors: Dict[str, List[Dict]], fecha_display: str) -> st
 
     for name, citas in doctors.items():
         lines.append(f"\n{name} — {len(citas)} cita(s):")
-        for record in citas:
-            fd = record["fieldData"]
-            hora = ":".join(fd.get("Hora", "00:00").split(":")[:2])
-            tipo = fd.get("Tipo", "")
-            paciente_nombre = fd.get("Pacientes::NOMBRE", "")
-            paciente_apellido = fd.get("Pacientes::APELLIDO PATERNO", "")
-            paciente = f"{paciente_nombre} {paciente_apellido}".strip() or "Sin paciente"
-            actividad = fd.get("Actividad", "Sin especificar")
-
-            tipo_tag = ""
-            if tipo.lower() == "disponible":
-                lines.append(f"  {hora} — Disponible")
+        for cita in citas:
+            tipo = cita.tipo.lower()
+            if tipo == "disponible":
+                lines.append(f"  {cita.hora} — Disponible")
                 continue
-            elif tipo.lower() == "conjunto":
-                tipo_tag = " (conjunto)"
 
-            lines.append(f"  {hora} — {paciente} — {actividad}{tipo_tag}")
+            paciente = cita.paciente or "Sin paciente"
+            actividad = cita.actividad if cita.actividad is not None else "Sin especificar"
+            tipo_tag = " (conjunto)" if tipo == "conjunto" else ""
+            lines.append(f"  {cita.hora} — {paciente} — {actividad}{tipo_tag}")
 
     return "\n".join(lines)
 
@@ -155,6 +118,12 @@ def _formatear_detalle(doctors: Dict[str, List[Dict]], fecha_display: str) -> st
 # Handler
 # ──────────────────────────────────────────────
 
+def _agrupar(all_data: List[Dict]) -> Tuple[int, Dict[str, List[Cita]]]:
+    """(cantidad de citas válidas, citas agrupadas por doctor)."""
+    valid_data = citas_validas(all_data)
+    return len(valid_data), agrupar_por_doctor(valid_data)
+
+
 async def handle(user, phone: str, arguments: Dict[str, Any]) -> str:
     """
     Consulta agendas con filtros opcionales.
@@ -185,15 +154,15 @@ async def handle(user, phone: str, arguments: Dict[str, Any]) -> str:
         len(all_data) if all_data else 0, fecha_display,
     )
 
-    # Filtrar citas inválidas
-    valid_data = _filtrar_citas_validas(all_data)
+    # Filtrar citas inválidas y agrupar por doctor (se reutiliza si los registros no cambiaron)
+    total_validas, doctors = cache_render.renderizar(
+        "consultar_agenda.doctores", all_data, lambda: _agrupar(all_data),
+    )
     logger.info(
         "[AGENDA_MGR] Post-filtro: %d citas válidas de %d totales",
-        len(valid_data), len(all_data) if all_data else 0,
+        total_validas, len(all_data) if all_data else 0,
     )
 
-    # Agrupar por doctor
-    doctors = _agrupar_por_doctor(valid_data)
     logger.info(
         "[AGENDA_MGR] Doctores con agenda: %d — %s",
         len(doctors),
@@ -236,18 +205,31 @@ async def handle(user, phone: str, arguments: Dict[str, Any]) -> str:
         doctors = filtered
         bloqueados_dict = filtered_bloqueados
 
-    # Formatear resultado
-    if solo_resumen:
-        result = _formatear_resumen(doctors, fecha_display)
-    else:
-        result = _formatear_detalle(doctors, fecha_display)
+    # Formatear resultado (el set de doctores filtrado identifica el render junto a la fecha)
+    formatear = _formatear_resumen if solo_resumen else _formatear_detalle
+    result = cache_render.renderizar(
+        "consultar_agenda.resumen" if solo_resumen else "consultar_agenda.detalle",
+        all_data,
+        lambda: formatear(doctors, fecha_display),
+        fecha_display, tuple(doctors),
+    )
         
     # Añadir sección de bloqueados si hay
     if bloqueados_dict:
-        result += "\n\nDoctores con agenda bloqueada este día:\n"
+        lineas = ["\n\nDoctores con agenda bloqueada este día:\n"]
         for nombre, obs in bloqueados_dict.items():
             obs_clean = obs.replace("\r", " ").replace("\n", " ").strip()
-            result += f"- {nombre}: {obs_clean}\n"
+            lineas.append(f"- {nombre}: {obs_clean}\n")
+        result += "".join(lineas)
+
+    # FileMaker caido: los datos vienen del ultimo respaldo valido
+    respaldo_t = obtenido_en(all_data)
+    if respaldo_t is not None:
+        hora = datetime.fromtimestamp(respaldo_t, tz).strftime("%d-%m-%Y %H:%M")
+        result = (
+            f"[DATOS DE RESPALDO] FileMaker no está disponible; esta agenda corresponde "
+            f"a la última lectura válida ({hora}). Indícalo al usuario.\n\n" + result
+        )
 
     logger.info(
         "[AGENDA_MGR] Resultado (%d chars): %s",
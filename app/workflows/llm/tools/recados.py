@@ -9,9 +9,11 @@ from typing import Any, Dict
 
 import pytz
 
-from app.config import get_settings
 from app.services.filemaker import FileMakerService
 from app.services.whatsapp import WhatsAppService
+from app.services import notificaciones_enfermeria
+from app.services import recados_outbox
+from app.services import recados_vistos
 from app.formatters.recados import RecadosFormatter
 
 logger = logging.getLogger(__name__)
@@ -28,7 +30,15 @@ REVISAR_RECADOS_TOOL = {
         "description": "Obtiene los recados pendientes (mensajes/notas) del doctor.",
         "parameters": {
             "type": "object",
-            "properties": {},
+            "properties": {
+                "solo_nuevos": {
+                    "type": "boolean",
+                    "description": (
+                        "Si es true, solo muestra los mensajes nuevos desde la "
+                        "última vez que el doctor revisó sus recados"
+                    ),
+                },
+            },
             "required": [],
         },
     },
@@ -75,7 +85,9 @@ PUBLICAR_RECADO_TOOL = {
 
 async def handle_revisar(user, phone: str, arguments: Dict[str, Any]) -> str:
     """Consulta recados pendientes y los envía formateados por WhatsApp."""
+    solo_nuevos = arguments.get("solo_nuevos", False)
     recados_data = await FileMakerService.get_recados(user.id)
+    vistos = await recados_vistos.obtener(user.id) if solo_nuevos else None
 
     # Resolver IDs de pacientes a nombres
     pacient_names: Dict[str, str] = {}
@@ -89,13 +101,25 @@ async def handle_revisar(user, phone: str, arguments: Dict[str, Any]) -> str:
                 pacient_names[pac_id] = "Paciente desconocido"
 
     formatted_msg = RecadosFormatter.format(
-        recados_data, user.name, user.last_name, pacient_names,
+        recados_data, user.name, user.last_name, pacient_names, vistos=vistos,
     )
 
     # Enviar recados formateados directamente por WhatsApp
     await WhatsAppService.send_message(phone, formatted_msg)
 
+    # Lo enviado queda como revisado para el proximo "solo nuevos"
+    conteos = RecadosFormatter.conteo_entradas(recados_data or [])
+    await recados_vistos.registrar(user.id, conteos)
+
     # Retornar resumen breve al LLM
+    if vistos is not None:
+        num_nuevos = sum(1 for record_id, n in conteos.items() if n > vistos.get(record_id, 0))
+        return (
+            f"Recados nuevos enviados al doctor. {num_nuevos} recado(s) con mensajes nuevos "
+            f"desde su última revisión. "
+            f"Los recados ya fueron enviados por WhatsApp, NO los repitas. "
+            f"Solo agrega un breve comentario conversacional."
+        )
     num_recados = len(recados_data) if recados_data else 0
     return (
         f"Recados enviados al doctor. {num_recados} recado(s) encontrado(s). "
@@ -126,9 +150,12 @@ async def handle_publicar(user, phone: str, arguments: Dict[str, Any]) -> str:
     guardar_en_fm = categoria != "Bloquear agenda"
     notificar_enfermeria = categoria not in ["Enviar receta", "Agendar paciente"]
 
+    # Clave del outbox: tambien deduplica la notificacion a enfermeria
+    clave = None
     if guardar_en_fm:
-        await FileMakerService.create_recado(
+        clave = await recados_outbox.encolar(
             doctor_id=user.id,
+            phone=phone,
             texto=texto_formateado,
             categoria=categoria,
             fecha=fecha,
@@ -136,16 +163,7 @@ async def handle_publicar(user, phone: str, arguments: Dict[str, Any]) -> str:
         )
 
     if notificar_enfermeria:
-        settings = get_settings()
-        await WhatsAppService.send_template(
-            settings.CHIEF_NURSE_PHONE,
-            user.name,
-            "reenviar_recado_secretaria",
-            include_header=False,
-            include_body=False,
-            header_params=[categoria],
-            body_params=[user.name, mensaje],
-        )
+        await notificaciones_enfermeria.notificar_recado(user, categoria, mensaje, idempotency_key=clave)
 
     # Construir confirmación
     if guardar_en_fm and notificar_enfermeria:
@@ -2,8 +2,9 @@
 Tool: ver_agenda_doctor (para gerencia).
 
 Para consultas directas del tipo "dame la agenda del Dr. X para mañana".
-Usa el AgendaFormatter + glosario, igual que el workflow legacy del doctor,
-y envía el mensaje formateado directamente por WhatsApp.
+Usa el render de AgendaFormatter (cuerpo + glosario, igual que el workflow
+legacy del doctor) con encabezado propio, y envía el mensaje formateado
+directamente por WhatsApp.
 
 La diferencia con consultar_agenda:
 - consultar_agenda: devuelve datos crudos al LLM para análisis/comparación.
@@ -17,6 +18,7 @@ from typing import Any, Dict
 import pytz
 
 from app.services.filemaker import FileMakerService
+from app.services.ultimo_valido import obtenido_en
 from app.services.whatsapp import WhatsAppService
 from app.formatters.agenda import AgendaFormatter
 
@@ -67,11 +69,6 @@ TOOL_DEFINITION = {
 # Handler
 # ──────────────────────────────────────────────
 
-# Filtros de citas inválidas
-_IGNORAR_TIPO = ["Eliminada", "Bloqueada", "No Viene"]
-_IGNORAR_ACTIVIDAD = ["RECORDATORIO", "VISITADOR MÉDICO", "LABORATORIO"]
-
-
 def _match_doctor(nombre_completo: str, filtro: str) -> bool:
     return filtro.lower().strip() in nombre_completo.lower()
 
@@ -169,24 +166,13 @@ async def handle(user, phone: str, arguments: Dict[str, Any]) -> str:
         doctor_name, fecha_display, len(doctor_data),
     )
 
-    # Formatear con el AgendaFormatter
-    formatted_msg, glossary = AgendaFormatter.format(doctor_data, doctor_name)
-
-    # Construir un único mensaje: header propio + cuerpo de citas + glosario
-    # El formatter devuelve "Hola Dr(a). X\nAgenda para día solicitado:\n\nHH:MM..."
-    # Eliminamos el header del formatter y usamos el nuestro
-    cuerpo = formatted_msg
-    for prefijo in [
-        f"*Hola Dr(a). {doctor_name}*\nAgenda para día solicitado:\n\n",
-        f"*Hola Dr(a). {doctor_name}*\nNo tienes citas agendadas día solicitado.",
-    ]:
-        if cuerpo.startswith(prefijo):
-            cuerpo = cuerpo[len(prefijo):]
-            break
+    # Un único mensaje: header propio + cuerpo de citas (+ aviso de respaldo) + glosario
+    render = AgendaFormatter.render(doctor_data, obtenido_en=obtenido_en(all_data))
+    cuerpo = ("\n".join(render.lineas) + render.banner).strip()
 
-    mensaje_final = f"*Agenda de {doctor_name}* — {fecha_display}\n\n{cuerpo.strip()}"
-    if glossary:
-        mensaje_final += f"\n\n*Glosario:*\n{glossary}"
+    mensaje_final = f"*Agenda de {doctor_name}* — {fecha_display}\n\n{cuerpo}"
+    if render.glosario:
+        mensaje_final += f"\n\n*Glosario:*\n{render.glosario}"
 
     await WhatsAppService.send_message(phone, mensaje_final)
 
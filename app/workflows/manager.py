@@ -1,6 +1,5 @@
 import logging
 import re
-from collections import OrderedDict
 from datetime import datetime
 
 import pytz
@@ -13,31 +12,20 @@ from app.workflows import state as workflow_state
 from app.workflows import session_timer
 from app.workflows.llm import engine as llm_engine
 from app.services.filemaker import FileMakerService
+from app.services.ultimo_valido import obtenido_en
 from app.services.whatsapp import WhatsAppService
 from app.services import redis as redis_svc
-from app.formatters.agenda import AgendaFormatter
+from app.formatters import cache_render
+from app.formatters.agenda import AgendaFormatter, agrupar_por_doctor, citas_validas
+from app.formatters.frescura import banner_frescura
 from app.exceptions import ServicioNoDisponibleError
 
 logger = logging.getLogger(__name__)
 
-# Filtros de citas invalidas (compartidos con AgendaFormatter)
-_IGNORAR_TIPO = ["Eliminada", "Bloqueada", "No Viene", "Disponible"]
-_IGNORAR_ACTIVIDAD = ["RECORDATORIO", "VISITADOR MÉDICO", "LABORATORIO"]
-
 # TTL para el modo doctor activo (2 horas)
 _DOCTOR_MODE_TTL = 7200
 
 
-def _filtrar_citas_validas(data: list) -> list:
-    """Filtra citas eliminadas, bloqueadas, etc."""
-    return [
-        r for r in data
-        if r["fieldData"].get("Tipo") not in _IGNORAR_TIPO
-        and r["fieldData"].get("Actividad", "").upper() not in _IGNORAR_ACTIVIDAD
-        and r["fieldData"].get("Hora", "00:00:00") != "00:00:00"
-    ]
-
-
 def _doctor_mode_key(phone: str) -> str:
     return f"manager:doctor_mode:{phone}"
 
@@ -62,6 +50,10 @@ class ManagerWorkflow(WorkflowHandler):
         from app.workflows.doctor import DoctorWorkflow
         self._doctor_workflow = DoctorWorkflow()
 
+    def lecturas_prefetch(self, user):
+        """Agenda de hoy de todos los doctores"""
+        return [FileMakerService.get_agenda_all_doctors()]
+
     async def handle_text(self, user, phone: str, message_text: str = ""):
         texto = message_text.strip().lower()
 
@@ -248,20 +240,15 @@ class ManagerWorkflow(WorkflowHandler):
                 await self._ask_continue(phone)
                 return
 
-            valid_data = _filtrar_citas_validas(all_data)
+            # Citas por doctor (sin horas disponibles); se reutiliza si los registros no cambiaron
+            citas_por_doctor = cache_render.renderizar("gerencia.doctores", all_data, lambda: {
+                name: len(citas)
+                for name, citas in agrupar_por_doctor(
+                    [c for c in citas_validas(all_data) if c.tipo != "Disponible"]
+                ).items()
+            })
 
-            # Agrupar citas por doctor
-            doctors: OrderedDict[str, list] = OrderedDict()
-            for record in valid_data:
-                fd = record.get("fieldData", {})
-                doctor_name = fd.get("Recurso Humano::Nombre Lista", "").strip()
-                if not doctor_name:
-                    continue
-                if doctor_name not in doctors:
-                    doctors[doctor_name] = []
-                doctors[doctor_name].append(record)
-
-            if not doctors:
+            if not citas_por_doctor:
                 await WhatsAppService.send_message(
                     phone,
                     f"No se encontraron doctores con agenda para {label}."
@@ -270,7 +257,7 @@ class ManagerWorkflow(WorkflowHandler):
                 return
 
             # Guardar estado para la seleccion
-            doctor_list = list(doctors.keys())
+            doctor_list = list(citas_por_doctor)
             state_data = {"doctors": doctor_list}
             if date:
                 state_data["date"] = date
@@ -281,11 +268,13 @@ class ManagerWorkflow(WorkflowHandler):
             )
 
             # Construir mensaje con lista numerada
-            msg = f"*Doctores con agenda {label}* ({len(doctor_list)}):\n\n"
-            for i, name in enumerate(doctor_list, 1):
-                n_citas = len(doctors[name])
-                msg += f"*{i}.* {name} — _{n_citas} cita(s)_\n"
-            msg += "\n_Escribe el número del doctor para ver su agenda:_"
+            lineas = [f"*Doctores con agenda {label}* ({len(doctor_list)}):\n"]
+            lineas += [f"*{i}.* {name} — _{citas_por_doctor[name]} cita(s)_" for i, name in enumerate(doctor_list, 1)]
+            msg = (
+                "\n".join(lineas)
+                + "\n\n_Escribe el número del doctor para ver su agenda:_"
+                + banner_frescura(obtenido_en(all_data))
+            )
 
             await WhatsAppService.send_message(phone, msg)
 
@@ -355,12 +344,9 @@ class ManagerWorkflow(WorkflowHandler):
                 if r.get("fieldData", {}).get("Recurso Humano::Nombre Lista", "").strip() == doctor_name
             ]
 
-            formatted_msg, glossary = AgendaFormatter.format(doctor_data, doctor_name)
-
-            # Reemplazar "Dr(a)." prefix
-            formatted_msg = formatted_msg.replace(
-                f"*Hola Dr(a). {doctor_name}*",
-                f"*Agenda de {doctor_name} para {label}*"
+            formatted_msg, glossary = AgendaFormatter.format(
+                doctor_data, doctor_name, obtenido_en=obtenido_en(all_data),
+                encabezado=f"*Agenda de {doctor_name} para {label}*",
             )
 
             await WhatsAppService.send_message(phone, formatted_msg)
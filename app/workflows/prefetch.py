@@ -0,0 +1,68 @@
+"""
+Prefetch de los datos probables al inicio de una sesión.
+
+Al primer mensaje después de inactividad el usuario recibe el menú y casi
+siempre toca "Revisar agenda del día" o "Revisar mis recados" (gerencia:
+la agenda de hoy). main.py agenda `ejecutar` en segundo plano con las
+lecturas que declara el workflow del rol (`lecturas_prefetch`); pasan por
+los mismos métodos cacheados de FileMakerService, así que el primer toque
+se sirve desde caché.
+
+Los errores no se propagan: el prefetch es best-effort y la lectura real
+se reintenta normalmente al tocar el botón.
+"""
+import asyncio
+import logging
+from typing import Dict
+
+from app.config import get_settings
+from app.services.filemaker import FileMakerService
+from app.workflows.base import WorkflowHandler
+
+logger = logging.getLogger(__name__)
+
+# Busquedas de pacientes en vuelo por prefetch: un doctor con muchos recados
+# no debe ocupar el pool de FileMaker que usan los turnos en curso
+_CONCURRENCIA_PACIENTES = 4
+
+_stats: Dict[str, int] = {"sesiones": 0, "lecturas": 0, "errores": 0}
+
+
+async def recados(doctor_id: str):
+    """Recados del doctor y los nombres de sus pacientes."""
+    recados_data = await FileMakerService.get_recados(doctor_id)
+    pac_ids = {r.get("fieldData", {}).get("_FK_IDPaciente", "") for r in recados_data}
+    semaforo = asyncio.Semaphore(_CONCURRENCIA_PACIENTES)
+
+    async def _paciente(pac_id: str):
+        async with semaforo:
+            await FileMakerService.get_pacient_by_id(pac_id)
+
+    await asyncio.gather(
+        *(_paciente(pac_id) for pac_id in pac_ids if pac_id),
+        return_exceptions=True,
+    )
+
+
+async def ejecutar(handler: WorkflowHandler, user, phone: str):
+    """Ejecuta en paralelo las lecturas de prefetch del rol."""
+    if not get_settings().SESSION_PREFETCH_ENABLED:
+        return
+    lecturas = handler.lecturas_prefetch(user)
+    if not lecturas:
+        return
+
+    _stats["sesiones"] += 1
+    _stats["lecturas"] += len(lecturas)
+    resultados = await asyncio.gather(*lecturas, return_exceptions=True)
+    errores = [r for r in resultados if isinstance(r, Exception)]
+    if errores:
+        _stats["errores"] += len(errores)
+        logger.info("[PREFETCH] %d de %d lectura(s) fallaron para %s: %s", len(errores), len(lecturas), phone, errores[0])
+    else:
+        logger.debug("[PREFETCH] %d lectura(s) precargadas para %s", len(lecturas), phone)
+
+
+def get_stats() -> dict:
+    """Sesiones con prefetch, lecturas lanzadas y fallidas."""
+    return dict(_stats)
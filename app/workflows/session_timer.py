@@ -1,91 +1,336 @@
 """
 Timer de inactividad de sesión.
 
-Mecanismo: cada interacción del usuario guarda un timestamp en Redis.
-Se lanza un asyncio task que espera SESSION_TIMEOUT_SECONDS y luego
-verifica si el timestamp sigue siendo el mismo (= no hubo actividad).
-Si no cambió, envía mensaje de cierre y limpia el estado del workflow.
+Mecanismo: cada interacción del usuario guarda un timestamp en Redis
+(session:activity) y re-arma el deadline de su sesión. Un único loop de
+fondo cierra las sesiones vencidas; no existe un asyncio task por usuario.
+
+Backends (SESSION_TIMER_BACKEND):
+    redis -> Deadlines en un sorted set compartido (score = deadline). Un
+             único sweeper por cluster, elegido con un lease en Redis,
+             reclama los vencidos de forma atómica (ZRANGEBYSCORE + ZREM en
+             un script Lua). Funciona con múltiples workers/réplicas y
+             sobrevive reinicios.
+    local  -> Deadlines en un timer wheel en memoria (re-armado O(1), sin
+             round trip a Redis). Solo apto para un único worker.
+
+En ambos casos, antes de cerrar se valida el timestamp de actividad real
+(un MGET por lote) y se re-programa si hubo actividad reciente.
 """
 import asyncio
 import logging
+import os
+import socket
 import time
-from typing import Dict
+import uuid
+from collections import deque
+from typing import Deque, List, Optional
 
 from app.services import redis as redis_svc
 from app.workflows import state as workflow_state
 from app.services.whatsapp import WhatsAppService
+from app.services.whatsapp_dispatcher import NOTIFICACION
 from app.config import get_settings
+from app.utils.timer_wheel import TimerWheel
 
 logger = logging.getLogger(__name__)
 
-# Tareas de timeout activas por teléfono (para poder cancelarlas)
-_active_timers: Dict[str, asyncio.Task] = {}
+# Sorted set con los deadlines de inactividad (miembro = teléfono)
+_DEADLINES_KEY = "session:deadlines"
+
+# Lease que identifica al worker que ejecuta el sweeper en el cluster
+_SWEEPER_LEASE_KEY = "session:sweeper:lease"
+
+# Reclama atómicamente hasta ARGV[2] sesiones con deadline <= ARGV[1].
+# Solo el worker que ejecuta el ZREM recibe cada teléfono, así que
+# ninguna sesión se cierra dos veces.
+_RECLAMAR_VENCIDAS_LUA = """
+local vencidas = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+if #vencidas > 0 then
+    redis.call('ZREM', KEYS[1], unpack(vencidas))
+end
+return vencidas
+"""
+
+# Renueva el lease solo si sigue perteneciendo a este worker
+_RENOVAR_LEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Libera el lease solo si sigue perteneciendo a este worker
+_LIBERAR_LEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Identificador único de este proceso para el lease del sweeper
+_WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Ventana para calcular expiraciones por segundo
+_VENTANA_TASA = 60.0
+
+# Segundos tras los que se reintenta una sesión reclamada que no se pudo
+# validar o cerrar (el reclamo ya la sacó del sorted set / wheel)
+_REINTENTO_CIERRE = 30.0
+
+_sweeper_task: Optional[asyncio.Task] = None
+
+# Timer wheel del backend local (resolución de 1s)
+_wheel = TimerWheel(resolucion=1.0, slots=512)
+
+# Instantes (monotonic) de las últimas expiraciones, para la tasa
+_expiraciones: Deque[float] = deque()
+_expiraciones_total = 0
 
 
 def _key(phone: str) -> str:
     return f"session:activity:{phone}"
 
 
-async def touch(phone: str):
-    """Registra actividad del usuario. Llamar en cada interacción."""
+def _es_local() -> bool:
+    return get_settings().SESSION_TIMER_BACKEND.lower().strip() == "local"
+
+
+async def touch(phone: str) -> bool:
+    """
+    Registra actividad del usuario. Llamar en cada interacción.
+    Retorna True si es el primer mensaje de la sesión (no había actividad
+    registrada: sesión nueva, cerrada por inactividad o con 'salir').
+    """
     ts = str(time.time())
     # TTL de 3x el timeout para limpieza automática
     settings = get_settings()
     ttl = settings.SESSION_TIMEOUT_SECONDS * 3
-    await redis_svc.set(_key(phone), ts, ttl=ttl)
-    return ts
+    anterior = await redis_svc.get_set(_key(phone), ts, ttl=ttl)
+    return anterior is None
 
 
-def schedule_timeout(phone: str):
-    """Programa un task de timeout. Cancela cualquier timer previo."""
-    # Cancelar timer anterior si existe
-    old_task = _active_timers.pop(phone, None)
-    if old_task and not old_task.done():
-        old_task.cancel()
-
-    task = asyncio.create_task(_timeout_check(phone))
-    _active_timers[phone] = task
-
-    # Limpiar referencia cuando termine
-    task.add_done_callback(lambda t: _active_timers.pop(phone, None))
+async def schedule_timeout(phone: str):
+    """Programa (o re-programa) el deadline de inactividad del teléfono."""
+    settings = get_settings()
+    deadline = time.time() + settings.SESSION_TIMEOUT_SECONDS
+    await _armar(phone, deadline)
 
 
 async def cancel(phone: str):
     """Cancela el timer de timeout para un teléfono (ej: al escribir 'salir')."""
-    task = _active_timers.pop(phone, None)
-    if task and not task.done():
-        task.cancel()
-    # Limpiar timestamp para que un timer re-creado por main.py no dispare
+    if _es_local():
+        _wheel.cancel(phone)
+    else:
+        await redis_svc.zrem(_DEADLINES_KEY, phone)
+    # Limpiar timestamp para que un deadline re-creado por main.py no cierre la sesión
     await redis_svc.delete(_key(phone))
     logger.debug("Timer de inactividad cancelado para %s", phone)
 
 
-async def _timeout_check(phone: str):
-    """Espera el timeout y verifica si hubo actividad nueva."""
-    settings = get_settings()
-    timeout = settings.SESSION_TIMEOUT_SECONDS
+async def _armar(phone: str, deadline: float):
+    if _es_local():
+        _wheel.arm(phone, deadline)
+    else:
+        await redis_svc.zadd(_DEADLINES_KEY, {phone: deadline})
+
+
+async def get_info() -> dict:
+    """Retorna métricas del timer: timers armados y expiraciones por segundo."""
+    if _es_local():
+        armados = len(_wheel)
+    else:
+        armados = await redis_svc.zcard(_DEADLINES_KEY)
+
+    _purgar_expiraciones(time.monotonic())
+    return {
+        "backend": "local" if _es_local() else "redis",
+        "timers_armados": armados,
+        "expiraciones_total": _expiraciones_total,
+        "expiraciones_por_segundo": round(len(_expiraciones) / _VENTANA_TASA, 3),
+    }
+
 
-    # Capturar el timestamp actual antes de esperar
-    ts_before = await redis_svc.get(_key(phone))
+def _registrar_expiracion():
+    global _expiraciones_total
+    ahora = time.monotonic()
+    _expiraciones.append(ahora)
+    _expiraciones_total += 1
+    _purgar_expiraciones(ahora)
+
+
+def _purgar_expiraciones(ahora: float):
+    while _expiraciones and ahora - _expiraciones[0] > _VENTANA_TASA:
+        _expiraciones.popleft()
+
+
+# ──────────────────────────────────────────────
+# Sweeper
+# ──────────────────────────────────────────────
+
+async def start():
+    """Inicia el loop de expiración en este worker."""
+    global _sweeper_task
+    if _sweeper_task is None:
+        _sweeper_task = asyncio.create_task(_sweeper_loop())
+        logger.info(
+            "Sweeper de sesiones iniciado (backend=%s, worker=%s)",
+            "local" if _es_local() else "redis", _WORKER_ID,
+        )
+
+
+async def stop():
+    """Detiene el sweeper y libera el lease para que otro worker lo tome."""
+    global _sweeper_task
+    if _sweeper_task is None:
+        return
 
+    _sweeper_task.cancel()
     try:
-        await asyncio.sleep(timeout)
+        await _sweeper_task
     except asyncio.CancelledError:
-        return
+        pass
+    _sweeper_task = None
 
-    # Verificar si el timestamp cambió (= hubo actividad nueva)
-    ts_after = await redis_svc.get(_key(phone))
+    if not _es_local():
+        try:
+            await redis_svc.eval_script(_LIBERAR_LEASE_LUA, [_SWEEPER_LEASE_KEY], [_WORKER_ID])
+        except Exception as e:
+            logger.warning("No se pudo liberar el lease del sweeper: %s", e)
+    logger.info("Sweeper de sesiones detenido")
 
-    if ts_after is None:
-        # Timestamp eliminado (el usuario salió explícitamente)
-        return
 
-    if ts_before != ts_after:
-        # Hubo actividad nueva, otro timer se encargará
+def _lease_ttl() -> int:
+    """TTL del lease: varios intervalos, para tolerar pausas breves del líder."""
+    intervalo = get_settings().SESSION_SWEEP_INTERVAL_SECONDS
+    return max(5, int(intervalo * 5))
+
+
+async def _es_lider() -> bool:
+    """Renueva o toma el lease del sweeper. Retorna True si este worker barre."""
+    ttl = _lease_ttl()
+    renovado = await redis_svc.eval_script(
+        _RENOVAR_LEASE_LUA, [_SWEEPER_LEASE_KEY], [_WORKER_ID, ttl],
+    )
+    if renovado:
+        return True
+
+    tomado = await redis_svc.set_nx(_SWEEPER_LEASE_KEY, _WORKER_ID, ttl=ttl)
+    if tomado:
+        logger.info("Worker %s tomó el lease del sweeper de sesiones", _WORKER_ID)
+    return tomado
+
+
+async def _sweeper_loop():
+    """Loop periódico que cierra las sesiones vencidas."""
+    intervalo = get_settings().SESSION_SWEEP_INTERVAL_SECONDS
+
+    while True:
+        try:
+            if _es_local():
+                await _barrer_local()
+            elif await _es_lider():
+                await _barrer()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Error en sweeper de sesiones")
+
+        await asyncio.sleep(intervalo)
+
+
+async def _reclamar_vencidas(ahora: float, limite: int) -> List[str]:
+    """Reclama un lote de teléfonos con deadline vencido."""
+    return await redis_svc.eval_script(
+        _RECLAMAR_VENCIDAS_LUA, [_DEADLINES_KEY], [ahora, limite],
+    )
+
+
+async def _barrer():
+    """Procesa en lotes todas las sesiones vencidas del sorted set."""
+    lote_max = get_settings().SESSION_SWEEP_BATCH_SIZE
+
+    while True:
+        vencidas = await _reclamar_vencidas(time.time(), lote_max)
+        if not vencidas:
+            return
+
+        await _procesar_lote(vencidas)
+
+        if len(vencidas) < lote_max:
+            return
+
+
+async def _barrer_local():
+    """Avanza el timer wheel y procesa en lotes las sesiones vencidas."""
+    lote_max = get_settings().SESSION_SWEEP_BATCH_SIZE
+    vencidas = _wheel.avanzar(time.time())
+
+    for i in range(0, len(vencidas), lote_max):
+        await _procesar_lote(vencidas[i:i + lote_max])
+
+
+async def _rearmar(phones: List[str]):
+    """Vuelve a programar sesiones reclamadas que no se pudieron procesar."""
+    deadline = time.time() + _REINTENTO_CIERRE
+    for phone in phones:
+        try:
+            await _armar(phone, deadline)
+        except Exception as e:
+            # Sin deadline la sesión no se cierra por inactividad; el TTL de
+            # session:activity sigue limpiando el timestamp
+            logger.error("No se pudo re-programar el cierre de %s: %s", phone, e)
+
+
+async def _procesar_lote(vencidas: List[str]):
+    """
+    Valida un lote de teléfonos vencidos con un único MGET de sus timestamps
+    de actividad y cierra solo las sesiones realmente inactivas.
+
+    Las sesiones que fallan (MGET o cierre) se re-programan en
+    _REINTENTO_CIERRE segundos: el reclamo ya las sacó de los deadlines.
+    """
+    timeout = get_settings().SESSION_TIMEOUT_SECONDS
+    try:
+        timestamps = await redis_svc.mget([_key(phone) for phone in vencidas])
+    except Exception as e:
+        logger.error("No se pudo validar un lote de %d sesiones vencidas: %s", len(vencidas), e)
+        await _rearmar(vencidas)
         return
+    ahora = time.time()
+
+    a_cerrar = []
+    for phone, ts in zip(vencidas, timestamps):
+        if ts is None:
+            # Timestamp eliminado (el usuario salió explícitamente)
+            continue
+
+        # Si hubo actividad entre el touch y el re-armado del deadline,
+        # re-programar con el deadline real en vez de cerrar
+        deadline_real = float(ts) + timeout
+        if deadline_real > ahora:
+            await _armar(phone, deadline_real)
+            continue
+
+        a_cerrar.append(phone)
+
+    resultados = await asyncio.gather(
+        *(_cerrar_sesion(phone) for phone in a_cerrar),
+        return_exceptions=True,
+    )
+    fallidas = []
+    for phone, resultado in zip(a_cerrar, resultados):
+        if isinstance(resultado, Exception):
+            logger.error("Error cerrando sesión de %s: %s", phone, resultado)
+            fallidas.append(phone)
+    await _rearmar(fallidas)
+
 
-    # No hubo actividad → timeout
+async def _cerrar_sesion(phone: str):
+    """Cierra la sesión inactiva de un teléfono."""
+    timeout = get_settings().SESSION_TIMEOUT_SECONDS
     logger.info("Timeout de inactividad para %s (%ds)", phone, timeout)
+    _registrar_expiracion()
 
     # Limpiar estado, timestamp, y estado LLM
     await workflow_state.clear_state(phone)
@@ -98,5 +343,6 @@ async def _timeout_check(phone: str):
     await WhatsAppService.send_message(
         phone,
         "La sesión se cerró por inactividad. "
-        "Cuando necesites algo, escribe cualquier mensaje para volver a comenzar."
+        "Cuando necesites algo, escribe cualquier mensaje para volver a comenzar.",
+        prioridad=NOTIFICACION,
     )
@@ -8,6 +8,7 @@ import logging
 from typing import Any, Dict, Optional
 
 from app.services import redis as redis_svc
+from app.utils import tracing
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +21,7 @@ def _key(phone: str) -> str:
     return f"workflow:state:{phone}"
 
 
+@tracing.trazado("estado.get_state", fase="estado")
 async def get_state(phone: str) -> Optional[Dict[str, Any]]:
     """
     Obtiene el estado actual del workflow para un telefono.
@@ -43,6 +45,7 @@ async def get_state(phone: str) -> Optional[Dict[str, Any]]:
         return {"step": raw}
 
 
+@tracing.trazado("estado.set_state", fase="estado")
 async def set_state(
     phone: str,
     step: str,
@@ -66,6 +69,7 @@ async def set_state(
     logger.debug("Estado workflow guardado para %s: paso=%s", phone, step)
 
 
+@tracing.trazado("estado.clear_state", fase="estado")
 async def clear_state(phone: str):
     """Limpia el estado del workflow para un telefono."""
     await redis_svc.delete(_key(phone))
@@ -0,0 +1,21 @@
+"""
+Herramientas de rendimiento offline:
+
+- bench/run.py: bench de carga con stand-ins locales de FileMaker, Graph API
+  y OpenAI y un generador de webhooks firmados.
+- bench/micro.py: microbenchmarks de formatters y filtrado de registros.
+- bench/replay.py: reproduce turnos del agente grabados con LLM_TRACE_PATH.
+"""
+import os
+
+_VARIABLES_REQUERIDAS = ("FM_USER", "FM_PASS", "WSP_TOKEN", "WSP_PHONE_ID", "WSP_VERIFY_TOKEN", "WSP_APP_SECRET", "OPENAI_API_KEY")
+
+
+def entorno_offline():
+    """
+    Completa las variables obligatorias de Settings con valores de relleno
+    para importar modulos de la app sin tocar ningun servicio. Llamar antes
+    de importar `app.*`.
+    """
+    for variable in _VARIABLES_REQUERIDAS:
+        os.environ.setdefault(variable, "bench")
@@ -0,0 +1,104 @@
+"""
+Escenarios del bench: que escribe cada persona y que tools "decide" el
+stand-in de OpenAI en cada ronda.
+
+`pasos` es la secuencia de rondas de tool calls (cada ronda puede llamar
+varias tools en paralelo); despues de la ultima ronda el modelo responde
+`respuesta`. El texto `mensaje` identifica el escenario y debe ser unico.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple
+
+Ronda = List[Tuple[str, Dict[str, Any]]]
+
+
+@dataclass(frozen=True)
+class Escenario:
+    nombre: str
+    rol: str
+    mensaje: str
+    pasos: List[Ronda] = field(default_factory=list)
+    respuesta: str = "Listo. ¿Necesitas algo más?"
+
+
+ESCENARIOS: List[Escenario] = [
+    # --- medico ---
+    Escenario(
+        nombre="medico_saludo",
+        rol="medico",
+        mensaje="hola aura",
+        respuesta="¡Hola! Puedo revisar tu agenda, tus recados o publicar un recado. ¿Qué necesitas?",
+    ),
+    Escenario(
+        nombre="medico_agenda_hoy",
+        rol="medico",
+        mensaje="muéstrame mi agenda de hoy",
+        pasos=[[("revisar_agenda", {})]],
+        respuesta="Te envié tu agenda de hoy. ¿Necesitas algo más?",
+    ),
+    Escenario(
+        nombre="medico_agenda_manana",
+        rol="medico",
+        mensaje="qué tengo mañana",
+        pasos=[[("calcular_fecha", {"dias_offset": 1})], [("revisar_agenda", {"fecha": "2026-04-15"})]],
+        respuesta="Te envié tu agenda de mañana. ¿Necesitas algo más?",
+    ),
+    Escenario(
+        nombre="medico_recados",
+        rol="medico",
+        mensaje="tengo recados?",
+        pasos=[[("revisar_recados", {})]],
+        respuesta="Ahí están tus recados pendientes.",
+    ),
+    Escenario(
+        nombre="medico_publicar_recado",
+        rol="medico",
+        mensaje="deja un recado: llamar a la paciente Rojas por resultados",
+        pasos=[[("publicar_recado", {"categoria": "Otros", "mensaje": "Llamar a la paciente Rojas por resultados"})]],
+        respuesta="Recado publicado. ¿Algo más?",
+    ),
+    # --- gerencia ---
+    Escenario(
+        nombre="gerencia_resumen",
+        rol="gerencia",
+        mensaje="qué doctores vienen hoy",
+        pasos=[[("consultar_agenda", {"solo_resumen": True})]],
+        respuesta="Hoy atienden 4 doctores.",
+    ),
+    Escenario(
+        nombre="gerencia_agenda_doctor",
+        rol="gerencia",
+        mensaje="dame la agenda de la dra ramirez",
+        pasos=[[("ver_agenda_doctor", {"doctor": "Ramirez"})]],
+        respuesta="Te envié la agenda de la Dra. Ramirez.",
+    ),
+    Escenario(
+        nombre="gerencia_detalle",
+        rol="gerencia",
+        mensaje="cuántos pacientes tiene soto hoy y cuántos pérez",
+        pasos=[[("consultar_agenda", {"doctor": "Soto"}), ("consultar_agenda", {"doctor": "Pérez"})]],
+        respuesta="El Dr. Soto y el Dr. Pérez tienen agenda completa hoy.",
+    ),
+    # --- medico_gerencia (usa el workflow y las tools de gerencia) ---
+    Escenario(
+        nombre="hibrido_mi_agenda",
+        rol="medico_gerencia",
+        mensaje="mi agenda por favor",
+        pasos=[[("ver_agenda_doctor", {"doctor": "Soto"})]],
+        respuesta="Te envié tu agenda.",
+    ),
+    Escenario(
+        nombre="hibrido_clinica",
+        rol="medico_gerencia",
+        mensaje="resumen de la clínica mañana",
+        pasos=[[("calcular_fecha", {"dias_offset": 1})], [("consultar_agenda", {"fecha": "2026-04-15", "solo_resumen": True})]],
+        respuesta="Mañana atienden 4 doctores.",
+    ),
+    Escenario(
+        nombre="hibrido_ocupacion",
+        rol="medico_gerencia",
+        mensaje="detalle de todas las agendas de hoy",
+        pasos=[[("consultar_agenda", {})]],
+        respuesta="Ese es el detalle de hoy.",
+    ),
+]
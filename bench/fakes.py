@@ -0,0 +1,234 @@
+"""
+Stand-ins locales de FileMaker Data API, Meta Graph API y OpenAI.
+
+- FileMaker: `sessions`, `_find` y `records` servidos desde
+  bench/fixtures/filemaker.json (registros por layout). Un criterio sobre un
+  campo que el registro no tiene se ignora: las agendas del fixture no
+  tienen `Fecha` y se repiten para cualquier dia consultado.
+- Graph API: acepta cualquier envio y avisa al generador de carga cuando
+  llega el primer mensaje a un telefono (`esperar_respuesta`).
+- OpenAI: respuestas guionadas por escenario (ver bench/escenarios.py). El
+  escenario se identifica por el ultimo mensaje del usuario y el paso por
+  la cantidad de rondas de tools ya hechas en el turno.
+
+Cada stand-in agrega una latencia configurable (base + jitter uniforme).
+"""
+import asyncio
+import json
+import random
+import uuid
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Deque, Dict, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from bench.escenarios import ESCENARIOS
+
+FIXTURE_FM = Path(__file__).parent / "fixtures" / "filemaker.json"
+
+
+@dataclass(frozen=True)
+class Latencia:
+    """Latencia simulada de un stand-in (milisegundos)."""
+    base_ms: float = 0.0
+    jitter_ms: float = 0.0
+
+    async def esperar(self):
+        ms = self.base_ms + random.uniform(0, self.jitter_ms)
+        if ms > 0:
+            await asyncio.sleep(ms / 1000)
+
+
+# ──────────────────────────────────────────────
+# FileMaker Data API
+# ──────────────────────────────────────────────
+
+def _cumple(registro: dict, criterio: dict) -> bool:
+    for campo, valor in criterio.items():
+        if campo == "omit" or campo not in registro:
+            continue
+        actual = str(registro[campo])
+        valor = str(valor)
+        if valor == "*":
+            if not actual:
+                return False
+        elif valor.startswith("=="):
+            if actual != valor[2:]:
+                return False
+        elif actual != valor:
+            return False
+    return True
+
+
+def crear_filemaker(latencia: Latencia, usuarios_por_rol: int) -> FastAPI:
+    """
+    Data API de FileMaker. Cada usuario del fixture se replica
+    `usuarios_por_rol` veces con telefonos distintos (mismo id de RRHH).
+    """
+    app = FastAPI()
+    layouts: Dict[str, List[dict]] = json.loads(FIXTURE_FM.read_text(encoding="utf-8"))
+    app.state.creados = 0
+
+    base = layouts.get("AuthUsuarios_dapi", [])
+    layouts["AuthUsuarios_dapi"] = [
+        {**usuario, "Telefono": telefono_persona(usuario["Telefono"], i)}
+        for usuario in base
+        for i in range(usuarios_por_rol)
+    ]
+
+    def _sin_registros():
+        return JSONResponse(
+            {"response": {}, "messages": [{"code": "401", "message": "No records match the request"}]},
+            status_code=500,
+        )
+
+    @app.post("/fmi/data/v1/databases/{db}/sessions")
+    async def sessions(db: str):
+        await latencia.esperar()
+        return {"response": {"token": uuid.uuid4().hex}, "messages": [{"code": "0", "message": "OK"}]}
+
+    @app.post("/fmi/data/v1/databases/{db}/layouts/{layout}/_find")
+    async def find(db: str, layout: str, request: Request):
+        # El cuerpo se lee antes de la espera: una cobertura (hedging) perdedora se cancela a mitad
+        cuerpo = await request.json()
+        await latencia.esperar()
+        criterios = cuerpo.get("query") or [{}]
+        encontrados = [r for r in layouts.get(layout, []) if any(_cumple(r, c) for c in criterios)]
+        encontrados = encontrados[:int(cuerpo.get("limit", 100))]
+        if not encontrados:
+            return _sin_registros()
+        return {
+            "response": {
+                "dataInfo": {"layout": layout, "foundCount": len(encontrados), "returnedCount": len(encontrados)},
+                "data": [
+                    {"fieldData": r, "portalData": {}, "recordId": str(i + 1), "modId": "0"}
+                    for i, r in enumerate(encontrados)
+                ],
+            },
+            "messages": [{"code": "0", "message": "OK"}],
+        }
+
+    @app.post("/fmi/data/v1/databases/{db}/layouts/{layout}/records")
+    async def records(db: str, layout: str):
+        await latencia.esperar()
+        app.state.creados += 1
+        return {"response": {"recordId": str(app.state.creados), "modId": "0"}, "messages": [{"code": "0", "message": "OK"}]}
+
+    return app
+
+
+def telefono_persona(telefono_base: str, indice: int) -> str:
+    """Telefono de la replica `indice` de un usuario del fixture."""
+    return f"{telefono_base}{indice:04d}"
+
+
+# ──────────────────────────────────────────────
+# Meta Graph API
+# ──────────────────────────────────────────────
+
+class BuzonGraph:
+    """Mensajes recibidos por el stand-in de Graph, por telefono destino."""
+
+    def __init__(self):
+        self.recibidos = 0
+        self._esperando: Dict[str, Deque[asyncio.Future]] = defaultdict(deque)
+
+    def registrar(self, telefono: str):
+        self.recibidos += 1
+        esperando = self._esperando.get(telefono)
+        while esperando:
+            futuro = esperando.popleft()
+            if not futuro.done():
+                futuro.set_result(None)
+                return
+
+    def esperar_respuesta(self, telefono: str) -> asyncio.Future:
+        """Futuro que se completa con el proximo mensaje enviado a `telefono`."""
+        futuro = asyncio.get_running_loop().create_future()
+        self._esperando[telefono].append(futuro)
+        return futuro
+
+
+def crear_graph(latencia: Latencia, buzon: BuzonGraph) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/{version}/{phone_id}/messages")
+    async def messages(version: str, phone_id: str, request: Request):
+        cuerpo = await request.json()
+        await latencia.esperar()
+        buzon.registrar(str(cuerpo.get("to", "")))
+        return {
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": cuerpo.get("to"), "wa_id": cuerpo.get("to")}],
+            "messages": [{"id": f"wamid.{uuid.uuid4().hex}"}],
+        }
+
+    return app
+
+
+# ──────────────────────────────────────────────
+# OpenAI Chat Completions
+# ──────────────────────────────────────────────
+
+def _respuesta_guionada(mensajes: List[dict]) -> dict:
+    ultimo_usuario = max(i for i, m in enumerate(mensajes) if m.get("role") == "user")
+    texto = mensajes[ultimo_usuario].get("content", "")
+    rondas = sum(1 for m in mensajes[ultimo_usuario + 1:] if m.get("role") == "assistant" and m.get("tool_calls"))
+
+    escenario = next((e for e in ESCENARIOS if e.mensaje == texto), None)
+    pasos = escenario.pasos if escenario else []
+    if rondas < len(pasos):
+        return {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                {
+                    "id": f"call_{uuid.uuid4().hex[:24]}",
+                    "type": "function",
+                    "function": {"name": nombre, "arguments": json.dumps(argumentos, ensure_ascii=False)},
+                }
+                for nombre, argumentos in pasos[rondas]
+            ],
+        }
+    final = escenario.respuesta if escenario else "Hola, ¿en qué te puedo ayudar?"
+    return {"role": "assistant", "content": final}
+
+
+def crear_openai(latencia: Latencia) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        cuerpo = await request.json()
+        await latencia.esperar()
+        mensaje = _respuesta_guionada(cuerpo["messages"])
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "model": cuerpo.get("model"),
+            "choices": [{
+                "index": 0,
+                "message": mensaje,
+                "finish_reason": "tool_calls" if mensaje.get("tool_calls") else "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    return app
+
+
+# ──────────────────────────────────────────────
+# Servidor
+# ──────────────────────────────────────────────
+
+async def servir(app: FastAPI, puerto: int) -> uvicorn.Server:
+    """Levanta `app` en 127.0.0.1:puerto dentro del loop actual."""
+    servidor = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=puerto, log_level="warning", access_log=False))
+    asyncio.create_task(servidor.serve())
+    while not servidor.started:
+        await asyncio.sleep(0.05)
+    return servidor
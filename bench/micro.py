@@ -0,0 +1,239 @@
+"""
+Microbenchmarks de las rutas de CPU puras (formateo y filtrado de registros).
+
+Mide, sobre dias sinteticos de 10 a 2.000 registros y recados con hilos
+largos de entradas separadas por `---`:
+
+- AgendaFormatter.format y RecadosFormatter.format con los caches vacios
+  (render completo + firma) y con hit (`.hit`: mismos registros)
+- RecadosFormatter.format con un recado modificado por llamada
+  (`.modificado`: solo ese hilo se vuelve a parsear)
+- RecadosFormatter._parse_texto_recado
+- citas_validas (filtro y normalizacion compartidos por todas las agendas)
+- consultar_agenda de gerencia completo: citas_validas + agrupar_por_doctor
+  + _formatear_detalle / _formatear_resumen
+
+Cada caso se mide con timeit (autorange + mediana de --repeticiones) y se
+compara contra la linea base en bench/baselines/micro.json: un caso mas
+lento que base * (1 + --umbral) es una regresion y el comando termina con
+codigo 1. Las lineas base dependen de la maquina: regenerarlas con
+--guardar en el mismo equipo antes de comparar una optimizacion.
+
+Uso:
+    python -m bench.micro                      # comparar contra la linea base
+    python -m bench.micro --guardar            # regenerar la linea base
+    python -m bench.micro --filtro agenda --umbral 0.1
+"""
+import argparse
+import itertools
+import json
+import platform
+import random
+import statistics
+import sys
+import timeit
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+from bench import entorno_offline
+
+# Los modulos de tools leen la configuracion al importarse; el bench no toca ningun servicio
+entorno_offline()
+
+from app.formatters import cache_render  # noqa: E402
+from app.formatters.agenda import _ABREVIACIONES, AgendaFormatter, agrupar_por_doctor, citas_validas  # noqa: E402
+from app.formatters.recados import RecadosFormatter  # noqa: E402
+from app.workflows.llm.tools.agenda_manager import _formatear_detalle, _formatear_resumen  # noqa: E402
+
+BASELINE = Path(__file__).parent / "baselines" / "micro.json"
+
+TAMANOS_DIA = (10, 100, 500, 2000)
+# (recados, entradas por recado)
+TAMANOS_RECADOS = ((10, 3), (20, 50), (5, 500))
+
+_NOMBRES = ["MARIA", "JOSE", "CAMILA", "PEDRO", "VALENTINA", "DIEGO", "FERNANDA", "MATIAS", "JAVIERA", "TOMAS"]
+_APELLIDOS = ["GONZALEZ", "MUÑOZ", "ROJAS", "DIAZ", "PEREZ", "SOTO", "CONTRERAS", "SILVA", "MARTINEZ", "SEPULVEDA"]
+_TIPOS = ["Cita"] * 12 + ["Disponible"] * 4 + ["Conjunto", "Eliminada", "Bloqueada", "No Viene"]
+_ACTIVIDADES = list(_ABREVIACIONES) + ["RECORDATORIO", "LABORATORIO", "PROCEDIMIENTO ESPECIAL"]
+_AUTORES = ["recepcion", "Dra. Ramirez", "enfermeria", "Dr. Soto"]
+
+
+# ──────────────────────────────────────────────
+# Datos sinteticos
+# ──────────────────────────────────────────────
+
+def dia_sintetico(n: int, semilla: int = 0) -> List[Dict]:
+    """`n` registros de ListadoDeHoras_dapi repartidos en ~n/25 doctores, en orden aleatorio."""
+    rnd = random.Random(semilla)
+    doctores = [f"Dr(a). Doctor {i:03d}" for i in range(max(1, n // 25))]
+    registros = []
+    for i in range(n):
+        minutos = 8 * 60 + (i * 15) % (12 * 60)
+        hora = f"{minutos // 60:02d}:{minutos % 60:02d}:00" if rnd.random() > 0.02 else "00:00:00"
+        registros.append({
+            "fieldData": {
+                "Tipo": rnd.choice(_TIPOS),
+                "Hora": hora,
+                "Actividad": rnd.choice(_ACTIVIDADES),
+                "Pacientes::NOMBRE": rnd.choice(_NOMBRES),
+                "Pacientes::APELLIDO PATERNO": rnd.choice(_APELLIDOS),
+                "Recurso Humano::Nombre Lista": rnd.choice(doctores),
+            },
+            "portalData": {},
+            "recordId": str(i + 1),
+            "modId": "0",
+        })
+    return registros
+
+
+def texto_recado_sintetico(entradas: int, semilla: int = 0) -> str:
+    """Campo texto_Recado con `entradas` mensajes (el mas nuevo primero), separados por `\\r---\\r`."""
+    rnd = random.Random(semilla)
+    bloques = []
+    for i in range(entradas):
+        dia = 1 + i % 28
+        bloques.append(
+            f"{rnd.choice(_AUTORES)} > {dia:02d}-04-2026 > {8 + i % 10:02d}:{i % 60:02d}:{rnd.randrange(60):02d}\r"
+            f"  Paciente {rnd.choice(_APELLIDOS).title()} consulta por resultados, llamar al {56900000000 + i}"
+        )
+    return "\r---\r".join(bloques)
+
+
+def recados_sinteticos(cantidad: int, entradas: int, semilla: int = 0) -> List[Dict]:
+    return [
+        {
+            "fieldData": {"texto_Recado": texto_recado_sintetico(entradas, semilla + i), "_FK_IDPaciente": str(1000 + i)},
+            "recordId": str(i + 1),
+            "modId": "0",
+        }
+        for i in range(cantidad)
+    ]
+
+
+# ──────────────────────────────────────────────
+# Casos
+# ──────────────────────────────────────────────
+
+def _sin_cache(funcion: Callable[[], object]) -> Callable[[], object]:
+    """Vacia los caches de renders y de parseo antes de cada llamada: mide el render completo."""
+    def caso():
+        cache_render.limpiar()
+        RecadosFormatter.limpiar_parseo()
+        return funcion()
+    return caso
+
+
+def _recado_modificado(recados: List[Dict], nombres: Dict[str, str]) -> Callable[[], object]:
+    """Sube el modId del primer recado en cada llamada, como si FileMaker lo hubiera editado."""
+    recados = [dict(r) for r in recados]
+    version = itertools.count(1)
+
+    def caso():
+        recados[0] = {**recados[0], "modId": str(next(version))}
+        return RecadosFormatter.format(recados, "Claudia", "Ramirez", nombres)
+    return caso
+
+
+def casos() -> List[Tuple[str, Callable[[], object]]]:
+    """(nombre, funcion sin argumentos) de cada caso; los datos se generan una sola vez."""
+    lista: List[Tuple[str, Callable[[], object]]] = []
+
+    for n in TAMANOS_DIA:
+        dia = dia_sintetico(n)
+        lista += [
+            (f"agenda.format[{n}]", _sin_cache(lambda dia=dia: AgendaFormatter.format(dia, "Claudia Ramirez"))),
+            (f"agenda.format.hit[{n}]", lambda dia=dia: AgendaFormatter.format(dia, "Claudia Ramirez")),
+            (f"agenda.citas_validas[{n}]", lambda dia=dia: citas_validas(dia)),
+            (f"consultar_agenda.detalle[{n}]",
+             lambda dia=dia: _formatear_detalle(agrupar_por_doctor(citas_validas(dia)), "14-04-2026")),
+            (f"consultar_agenda.resumen[{n}]",
+             lambda dia=dia: _formatear_resumen(agrupar_por_doctor(citas_validas(dia)), "14-04-2026")),
+        ]
+
+    for cantidad, entradas in TAMANOS_RECADOS:
+        recados = recados_sinteticos(cantidad, entradas)
+        nombres = {str(1000 + i): f"Paciente {i}" for i in range(cantidad)}
+        texto = recados[0]["fieldData"]["texto_Recado"]
+        lista += [
+            (f"recados.format[{cantidad}x{entradas}]",
+             _sin_cache(lambda recados=recados, nombres=nombres: RecadosFormatter.format(recados, "Claudia", "Ramirez", nombres))),
+            (f"recados.format.hit[{cantidad}x{entradas}]",
+             lambda recados=recados, nombres=nombres: RecadosFormatter.format(recados, "Claudia", "Ramirez", nombres)),
+            (f"recados.format.modificado[{cantidad}x{entradas}]", _recado_modificado(recados, nombres)),
+            (f"recados.parse[{entradas}]", lambda texto=texto: RecadosFormatter._parse_texto_recado(texto)),
+        ]
+
+    return lista
+
+
+def medir(funcion: Callable[[], object], repeticiones: int) -> float:
+    """Mediana en microsegundos por llamada de `repeticiones` corridas de ~0.2 s."""
+    timer = timeit.Timer(funcion)
+    numero, _ = timer.autorange()
+    tiempos = timer.repeat(repeat=repeticiones, number=numero)
+    return statistics.median(tiempos) / numero * 1e6
+
+
+# ──────────────────────────────────────────────
+# CLI
+# ──────────────────────────────────────────────
+
+def _leer_baseline() -> Dict[str, float]:
+    if not BASELINE.exists():
+        return {}
+    return {nombre: caso["us"] for nombre, caso in json.loads(BASELINE.read_text(encoding="utf-8"))["casos"].items()}
+
+
+def _guardar_baseline(resultados: Dict[str, float], parcial: bool):
+    # Con --filtro se actualizan solo los casos medidos; sin filtro se reescribe completa
+    casos_base = {nombre: {"us": us} for nombre, us in _leer_baseline().items()} if parcial else {}
+    casos_base.update({nombre: {"us": round(us, 2)} for nombre, us in resultados.items()})
+    BASELINE.parent.mkdir(parents=True, exist_ok=True)
+    BASELINE.write_text(json.dumps({
+        "python": platform.python_version(),
+        "maquina": platform.machine(),
+        "casos": dict(sorted(casos_base.items())),
+    }, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Microbenchmarks de formatters y filtrado de registros")
+    parser.add_argument("--filtro", help="Solo los casos cuyo nombre contiene este texto")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--umbral", type=float, default=0.2, help="Regresion si supera la linea base en esta fraccion")
+    parser.add_argument("--guardar", action="store_true", help="Escribir los resultados como nueva linea base")
+    args = parser.parse_args(argv)
+
+    base = _leer_baseline()
+    resultados: Dict[str, float] = {}
+    regresiones = []
+
+    print(f"{'caso':<34} {'us/llamada':>12} {'base':>12} {'delta':>8}")
+    for nombre, funcion in casos():
+        if args.filtro and args.filtro not in nombre:
+            continue
+        us = medir(funcion, args.repeticiones)
+        resultados[nombre] = us
+        anterior = base.get(nombre)
+        if anterior:
+            delta = us / anterior - 1
+            marca = "  REGRESION" if delta > args.umbral else ""
+            if marca:
+                regresiones.append(nombre)
+            print(f"{nombre:<34} {us:>12.1f} {anterior:>12.1f} {delta:>+7.0%}{marca}")
+        else:
+            print(f"{nombre:<34} {us:>12.1f} {'-':>12} {'-':>8}")
+
+    if args.guardar:
+        _guardar_baseline(resultados, parcial=bool(args.filtro))
+        print(f"\nLinea base actualizada: {BASELINE}")
+        return 0
+
+    if regresiones:
+        print(f"\n{len(regresiones)} regresion(es) sobre {args.umbral:.0%}: {', '.join(regresiones)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+"""
+Replay determinista de turnos del agente LLM grabados con LLM_TRACE_PATH.
+
+Cada turno grabado se vuelve a pasar por `engine.process_message` sin red:
+
+- OpenAI: `llm_service.chat_completion` devuelve las respuestas grabadas
+  en orden.
+- Tools: cada handler devuelve el resultado grabado para esa tool (por
+  nombre y orden de llamada).
+- Redis: el historial vive en memoria; antes de cada turno se carga el
+  grabado (los mensajes previos al del usuario en la primera llamada al LLM).
+- WhatsApp: los envios se descartan.
+
+El system prompt, el recorte del historial y el agent loop son los del
+codigo actual, asi que el replay sirve para medir el overhead del motor,
+probar cambios de prompt o de historial (tamano de lo enviado al modelo) y
+comparar iteraciones entre versiones. Se reporta como divergencia cuando el
+motor pide mas o menos respuestas o tools que las grabadas.
+
+Uso:
+    python -m bench.replay trazas.jsonl
+    python -m bench.replay trazas.jsonl --repeticiones 20          # overhead del motor
+    python -m bench.replay trazas.jsonl --con-latencias            # con los tiempos grabados
+    python -m bench.replay trazas.jsonl --encadenar --max-historial 10
+"""
+import argparse
+import asyncio
+import copy
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field, replace
+from typing import Any, Dict, List, Optional
+from unittest import mock
+
+from bench import entorno_offline
+
+entorno_offline()
+# El replay no debe volver a grabar los turnos que reproduce
+os.environ["LLM_TRACE_PATH"] = ""
+
+import app.workflows  # noqa: E402,F401  (registra las configs LLM de cada rol)
+from app.auth.models import User  # noqa: E402
+from app.services import llm_service  # noqa: E402
+from app.services.whatsapp import WhatsAppService  # noqa: E402
+from app.workflows.llm import engine  # noqa: E402
+from app.workflows.llm.config import get_llm_config  # noqa: E402
+
+
+@dataclass
+class ResultadoReplay:
+    indice: int
+    rol: str
+    mensaje: str
+    resultado_grabado: str
+    resultado: str = ""
+    iteraciones_grabadas: int = 0
+    iteraciones: int = 0
+    llamadas_grabadas: int = 0
+    llamadas: int = 0
+    chars_grabados: int = 0
+    chars: int = 0
+    motor_ms: float = 0.0
+    total_grabado_ms: float = 0.0
+    divergencias: List[str] = field(default_factory=list)
+
+
+def _chars(mensajes: List[Dict[str, Any]]) -> int:
+    return len(json.dumps(mensajes, ensure_ascii=False))
+
+
+def cargar_trazas(ruta: str) -> List[dict]:
+    with open(ruta, encoding="utf-8") as f:
+        return [json.loads(linea) for linea in f if linea.strip()]
+
+
+# ──────────────────────────────────────────────
+# Stand-ins en proceso
+# ──────────────────────────────────────────────
+
+class _RedisMemoria:
+    """Lo minimo de app.services.redis que usa el motor."""
+
+    def __init__(self):
+        self.datos: Dict[str, str] = {}
+
+    async def get(self, key: str) -> Optional[str]:
+        return self.datos.get(key)
+
+    async def set(self, key: str, value: str, ttl: Optional[int] = None):
+        self.datos[key] = value
+
+    async def delete(self, key: str):
+        self.datos.pop(key, None)
+
+
+class _Reproductor:
+    """Sirve las respuestas y resultados grabados de un turno."""
+
+    def __init__(self, turno: dict, con_latencias: bool):
+        self.turno = turno
+        self.con_latencias = con_latencias
+        self.llamadas: List[int] = []
+        self.divergencias: List[str] = []
+        self._tools: Dict[str, List[dict]] = defaultdict(list)
+        for tool in turno["tools"]:
+            self._tools[tool["nombre"]].append(tool)
+
+    async def chat_completion(self, messages, tools=None, temperature=0.3):
+        indice = len(self.llamadas)
+        self.llamadas.append(_chars(messages))
+        grabadas = self.turno["llamadas_llm"]
+        if indice >= len(grabadas):
+            self.divergencias.append(f"llamada LLM #{indice + 1} sin respuesta grabada")
+            return {"role": "assistant", "content": "[REPLAY] sin respuesta grabada"}
+        if self.con_latencias:
+            await asyncio.sleep(grabadas[indice]["ms"] / 1000)
+        return copy.deepcopy(grabadas[indice]["respuesta"])
+
+    def handler(self, nombre: str):
+        async def _handler(user, phone, arguments):
+            pendientes = self._tools.get(nombre)
+            if not pendientes:
+                self.divergencias.append(f"tool {nombre} sin resultado grabado")
+                return f"Error: sin resultado grabado para '{nombre}'."
+            tool = pendientes.pop(0)
+            if self.con_latencias:
+                await asyncio.sleep(tool["ms"] / 1000)
+            return tool["resultado"]
+        return _handler
+
+    def sin_usar(self) -> List[str]:
+        return [nombre for nombre, pendientes in self._tools.items() for _ in pendientes]
+
+
+class _Handlers(dict):
+    def __init__(self, reproductor: _Reproductor):
+        super().__init__()
+        self._reproductor = reproductor
+
+    def get(self, nombre, default=None):
+        return self._reproductor.handler(nombre)
+
+
+# ──────────────────────────────────────────────
+# Replay
+# ──────────────────────────────────────────────
+
+def _historial_grabado(turno: dict) -> List[dict]:
+    llamadas = turno["llamadas_llm"]
+    if not llamadas:
+        return []
+    # [system] + historial + [mensaje del usuario]
+    return llamadas[0]["mensajes"][1:-1]
+
+
+async def _correr_turno(turno: dict, historial: List[dict], redis: _RedisMemoria, con_latencias: bool):
+    reproductor = _Reproductor(turno, con_latencias)
+    config = get_llm_config(turno["rol"])
+    config_replay = replace(config, tool_handlers=_Handlers(reproductor)) if config is not None else None
+
+    phone = turno["telefono"]
+    redis.datos.clear()
+    if historial:
+        await redis.set(engine._history_key(phone), json.dumps(historial))
+
+    async def _descartar_envio(to_phone, text, *args, **kwargs):
+        return None
+
+    with mock.patch.object(llm_service, "chat_completion", reproductor.chat_completion), \
+            mock.patch.object(engine, "get_llm_config", lambda rol: config_replay), \
+            mock.patch.object(WhatsAppService, "send_message", _descartar_envio):
+        inicio = time.perf_counter()
+        try:
+            resultado = await engine.process_message(User(**turno["usuario"]), phone, turno["mensaje"], turno["rol"])
+        except Exception as e:
+            resultado = f"error:{type(e).__name__}"
+        segundos = time.perf_counter() - inicio
+
+    guardado = await redis.get(engine._history_key(phone))
+    return reproductor, resultado, segundos, json.loads(guardado) if guardado else historial
+
+
+async def reproducir(trazas: List[dict], repeticiones: int, con_latencias: bool, encadenar: bool) -> List[ResultadoReplay]:
+    redis = _RedisMemoria()
+    historiales: Dict[str, List[dict]] = {}
+    resultados = []
+
+    with mock.patch.object(engine, "redis_svc", redis):
+        for indice, turno in enumerate(trazas, 1):
+            if encadenar and turno["telefono"] in historiales:
+                historial = historiales[turno["telefono"]]
+            else:
+                historial = _historial_grabado(turno)
+
+            tiempos = []
+            for _ in range(max(1, repeticiones)):
+                reproductor, resultado, segundos, guardado = await _correr_turno(turno, historial, redis, con_latencias)
+                tiempos.append(segundos)
+            historiales[turno["telefono"]] = guardado
+
+            llamadas = turno["llamadas_llm"]
+            r = ResultadoReplay(
+                indice=indice,
+                rol=turno["rol"],
+                mensaje=turno["mensaje"],
+                resultado_grabado=turno.get("resultado", ""),
+                resultado=resultado,
+                iteraciones_grabadas=turno.get("iteraciones", max(0, len(llamadas) - 1)),
+                iteraciones=max(0, len(reproductor.llamadas) - 1),
+                llamadas_grabadas=len(llamadas),
+                llamadas=len(reproductor.llamadas),
+                chars_grabados=sum(_chars(ll["mensajes"]) for ll in llamadas),
+                chars=sum(reproductor.llamadas),
+                motor_ms=statistics.median(tiempos) * 1000,
+                total_grabado_ms=turno.get("total_ms", 0.0),
+                divergencias=list(reproductor.divergencias),
+            )
+            if r.llamadas != r.llamadas_grabadas:
+                r.divergencias.append(f"llamadas LLM: grabadas {r.llamadas_grabadas}, replay {r.llamadas}")
+            if reproductor.sin_usar():
+                r.divergencias.append(f"tools grabadas sin usar: {', '.join(reproductor.sin_usar())}")
+            if r.resultado != r.resultado_grabado:
+                r.divergencias.append(f"resultado: grabado {r.resultado_grabado}, replay {r.resultado}")
+            resultados.append(r)
+
+    return resultados
+
+
+# ──────────────────────────────────────────────
+# CLI
+# ──────────────────────────────────────────────
+
+def imprimir(resultados: List[ResultadoReplay], con_latencias: bool):
+    columna_ms = "turno_ms" if con_latencias else "motor_ms"
+    print(f"{'#':>4} {'rol':<16} {'mensaje':<30} {'iter':>7} {'chars enviados':>22} {columna_ms:>9} {'grabado_ms':>10}  divergencias")
+    for r in resultados:
+        delta = f"{r.chars / r.chars_grabados - 1:+.0%}" if r.chars_grabados else "-"
+        chars = f"{r.chars_grabados}->{r.chars} {delta}"
+        mensaje = r.mensaje if len(r.mensaje) <= 30 else r.mensaje[:27] + "..."
+        print(
+            f"{r.indice:>4} {r.rol:<16} {mensaje:<30} {f'{r.iteraciones_grabadas}->{r.iteraciones}':>7} "
+            f"{chars:>22} {r.motor_ms:>9.2f} {r.total_grabado_ms:>10.0f}  {'; '.join(r.divergencias)}"
+        )
+
+    if not resultados:
+        print("Sin turnos.")
+        return
+    tiempos = sorted(r.motor_ms for r in resultados)
+    p95 = tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))]
+    grabados = sum(r.chars_grabados for r in resultados)
+    enviados = sum(r.chars for r in resultados)
+    print(
+        f"\n{len(resultados)} turnos, {sum(1 for r in resultados if r.divergencias)} con divergencias | "
+        f"iteraciones {sum(r.iteraciones_grabadas for r in resultados)}->{sum(r.iteraciones for r in resultados)} | "
+        f"chars enviados {grabados}->{enviados}"
+        + (f" ({enviados / grabados - 1:+.1%})" if grabados else "")
+        + f" | {columna_ms} p50 {statistics.median(tiempos):.2f} p95 {p95:.2f}"
+    )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Replay offline de turnos grabados con LLM_TRACE_PATH")
+    parser.add_argument("trazas", help="Archivo JSONL grabado con LLM_TRACE_PATH")
+    parser.add_argument("--rol", help="Solo los turnos de este rol")
+    parser.add_argument("--limite", type=int, help="Reproducir como maximo N turnos")
+    parser.add_argument("--repeticiones", type=int, default=1, help="Corridas por turno (se reporta la mediana)")
+    parser.add_argument("--con-latencias", action="store_true", help="Esperar los tiempos grabados del LLM y de cada tool")
+    parser.add_argument("--encadenar", action="store_true",
+                        help="Usar como historial el que dejo el replay del turno anterior del mismo telefono")
+    parser.add_argument("--max-historial", type=int, help="Probar otro limite de mensajes de historial")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", help="Guardar los resultados por turno en este archivo")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.WARNING))
+
+    trazas = cargar_trazas(args.trazas)
+    if args.rol:
+        trazas = [t for t in trazas if t["rol"] == args.rol]
+    if args.limite:
+        trazas = trazas[:args.limite]
+
+    with mock.patch.object(engine, "_MAX_HISTORY_MESSAGES", args.max_historial or engine._MAX_HISTORY_MESSAGES):
+        resultados = asyncio.run(reproducir(trazas, args.repeticiones, args.con_latencias, args.encadenar))
+
+    imprimir(resultados, args.con_latencias)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump([asdict(r) for r in resultados], f, indent=2, ensure_ascii=False)
+
+    return 1 if any(r.divergencias for r in resultados) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+"""
+Bench de carga end-to-end sin tocar sistemas productivos.
+
+Levanta los stand-ins de FileMaker, Graph API y OpenAI (bench/fakes.py),
+arranca el bot con uvicorn apuntando a ellos y envia webhooks firmados
+(HMAC-SHA256, igual que Meta) a una tasa fija por escenario. Por escenario
+reporta throughput y p50/p95/p99 de:
+
+- webhook: POST /webhook hasta su respuesta (el turno completo se procesa
+  dentro de la request).
+- respuesta: POST /webhook hasta que el primer mensaje de vuelta llega al
+  stand-in de Graph (incluye la cola del dispatcher de WhatsApp).
+
+Cada telefono tiene un solo turno en curso; si todos los de un rol estan
+ocupados el envio se cuenta como "saturado" (subir --usuarios-por-rol).
+
+Uso:
+    python -m bench.run
+    python -m bench.run --rps 10 --duracion 60 --escenario medico_agenda_hoy
+    python -m bench.run --workers 2 --json resultados.json
+
+Requiere Redis (--redis-url, por defecto redis://localhost:6379/15).
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+from bench import fakes
+from bench.escenarios import ESCENARIOS, Escenario
+
+RAIZ = Path(__file__).resolve().parent.parent
+
+_APP_SECRET = "bench-app-secret"
+_PHONE_ID = "bench-phone-id"
+_TELEFONO_ENFERMERIA = "56900000999"
+
+
+@dataclass
+class Resultado:
+    escenario: str
+    enviados: int = 0
+    ok: int = 0
+    errores: int = 0
+    sin_respuesta: int = 0
+    saturados: int = 0
+    duracion_s: float = 0.0
+    webhook_ms: List[float] = field(default_factory=list)
+    respuesta_ms: List[float] = field(default_factory=list)
+
+    @property
+    def throughput(self) -> float:
+        return self.ok / self.duracion_s if self.duracion_s else 0.0
+
+    def resumen(self) -> dict:
+        datos = asdict(self)
+        datos.pop("webhook_ms")
+        datos.pop("respuesta_ms")
+        datos["throughput"] = round(self.throughput, 2)
+        for nombre, muestras in (("webhook", self.webhook_ms), ("respuesta", self.respuesta_ms)):
+            for p in (50, 95, 99):
+                datos[f"{nombre}_p{p}_ms"] = _percentil(muestras, p)
+        return datos
+
+
+def _percentil(muestras: List[float], p: int) -> Optional[float]:
+    if not muestras:
+        return None
+    ordenadas = sorted(muestras)
+    indice = max(0, min(len(ordenadas) - 1, round(p / 100 * len(ordenadas) + 0.5) - 1))
+    return round(ordenadas[indice], 1)
+
+
+# ──────────────────────────────────────────────
+# Bot bajo prueba
+# ──────────────────────────────────────────────
+
+def entorno_bot(args) -> Dict[str, str]:
+    """Variables de entorno que apuntan el bot a los stand-ins."""
+    return {
+        **os.environ,
+        "FM_HOST": f"127.0.0.1:{args.puerto_base + 1}",
+        "FM_SCHEME": "http",
+        "FM_USER": "bench",
+        "FM_PASS": "bench",
+        "META_API_BASE_URL": f"http://127.0.0.1:{args.puerto_base + 2}",
+        "OPENAI_API_BASE_URL": f"http://127.0.0.1:{args.puerto_base + 3}/v1",
+        "OPENAI_API_KEY": "bench",
+        "LLM_MODE_ENABLED": "true",
+        "WSP_TOKEN": "bench",
+        "WSP_PHONE_ID": _PHONE_ID,
+        "WSP_VERIFY_TOKEN": "bench",
+        "WSP_APP_SECRET": _APP_SECRET,
+        "CHIEF_NURSE_PHONE": _TELEFONO_ENFERMERIA,
+        "REDIS_URL": args.redis_url,
+        # El bench mide el camino del turno, no los limites por usuario
+        "RATE_LIMIT_MAX": "1000000",
+        "RATE_LIMIT_RULES": "*:texto=1000000/60,*:boton=1000000/60",
+        "SESSION_TIMEOUT_SECONDS": "3600",
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+    }
+
+
+async def iniciar_bot(args) -> subprocess.Popen:
+    proceso = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--host", "127.0.0.1", "--port", str(args.puerto_base),
+            "--workers", str(args.workers), "--log-level", "warning",
+        ],
+        cwd=RAIZ,
+        env=entorno_bot(args),
+    )
+    url = f"http://127.0.0.1:{args.puerto_base}/health/ready"
+    limite = time.monotonic() + 60
+    async with httpx.AsyncClient(timeout=2.0) as cliente:
+        while time.monotonic() < limite:
+            if proceso.poll() is not None:
+                raise RuntimeError(f"El bot termino al iniciar (codigo {proceso.returncode})")
+            try:
+                if (await cliente.get(url)).status_code == 200:
+                    return proceso
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    proceso.terminate()
+    raise RuntimeError("El bot no quedo listo en 60 s (¿Redis disponible?)")
+
+
+# ──────────────────────────────────────────────
+# Generador de carga
+# ──────────────────────────────────────────────
+
+def webhook_firmado(telefono: str, texto: str) -> tuple:
+    """Cuerpo y headers de un webhook de texto entrante, firmado como lo firma Meta."""
+    cuerpo = json.dumps({
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": "bench",
+            "changes": [{
+                "field": "messages",
+                "value": {
+                    "messaging_product": "whatsapp",
+                    "contacts": [{"wa_id": telefono, "profile": {"name": "Bench"}}],
+                    "messages": [{
+                        "from": telefono,
+                        "id": f"wamid.bench.{uuid.uuid4().hex}",
+                        "timestamp": str(int(time.time())),
+                        "type": "text",
+                        "text": {"body": texto},
+                    }],
+                },
+            }],
+        }],
+    }, ensure_ascii=False).encode("utf-8")
+    firma = hmac.new(_APP_SECRET.encode("utf-8"), cuerpo, hashlib.sha256).hexdigest()
+    headers = {"Content-Type": "application/json", "X-Hub-Signature-256": f"sha256={firma}"}
+    return cuerpo, headers
+
+
+async def correr_escenario(
+    escenario: Escenario, cliente: httpx.AsyncClient, buzon: fakes.BuzonGraph, telefonos: List[str], args,
+) -> Resultado:
+    resultado = Resultado(escenario=escenario.nombre)
+    libres = deque(telefonos)
+    loop = asyncio.get_running_loop()
+
+    async def _turno(telefono: str):
+        respuesta = buzon.esperar_respuesta(telefono)
+        cuerpo, headers = webhook_firmado(telefono, escenario.mensaje)
+        inicio = time.perf_counter()
+        try:
+            resp = await cliente.post("/webhook", content=cuerpo, headers=headers)
+            resultado.webhook_ms.append((time.perf_counter() - inicio) * 1000)
+            if resp.status_code != 200:
+                resultado.errores += 1
+                return
+            await asyncio.wait_for(respuesta, args.timeout_respuesta)
+            resultado.respuesta_ms.append((time.perf_counter() - inicio) * 1000)
+            resultado.ok += 1
+        except asyncio.TimeoutError:
+            resultado.sin_respuesta += 1
+        except httpx.HTTPError:
+            resultado.errores += 1
+        finally:
+            # Pausa para que mensajes rezagados del turno no se confundan con el siguiente
+            await asyncio.sleep(args.pausa_usuario)
+            libres.append(telefono)
+
+    tareas = []
+    inicio = loop.time()
+    for i in range(int(args.rps * args.duracion)):
+        await asyncio.sleep(max(0.0, inicio + i / args.rps - loop.time()))
+        resultado.enviados += 1
+        if not libres:
+            resultado.saturados += 1
+            continue
+        tareas.append(asyncio.create_task(_turno(libres.popleft())))
+
+    await asyncio.gather(*tareas)
+    resultado.duracion_s = loop.time() - inicio - args.pausa_usuario
+    return resultado
+
+
+def imprimir(resultados: List[Resultado]):
+    columnas = (
+        f"{'escenario':<24} {'env':>5} {'ok':>5} {'err':>4} {'t/o':>4} {'sat':>4} {'turnos/s':>8} "
+        f"{'wh p50':>8} {'wh p95':>8} {'wh p99':>8} {'resp p50':>9} {'resp p95':>9} {'resp p99':>9}"
+    )
+    print(columnas)
+    print("-" * len(columnas))
+    for r in resultados:
+        d = r.resumen()
+        ms = lambda v: f"{v:.0f}" if v is not None else "-"  # noqa: E731
+        print(
+            f"{r.escenario:<24} {r.enviados:>5} {r.ok:>5} {r.errores:>4} {r.sin_respuesta:>4} {r.saturados:>4} "
+            f"{r.throughput:>8.2f} {ms(d['webhook_p50_ms']):>8} {ms(d['webhook_p95_ms']):>8} {ms(d['webhook_p99_ms']):>8} "
+            f"{ms(d['respuesta_p50_ms']):>9} {ms(d['respuesta_p95_ms']):>9} {ms(d['respuesta_p99_ms']):>9}"
+        )
+
+
+async def main(args) -> int:
+    escenarios = [e for e in ESCENARIOS if not args.escenario or e.nombre in args.escenario]
+    if not escenarios:
+        print(f"Escenarios disponibles: {', '.join(e.nombre for e in ESCENARIOS)}")
+        return 2
+
+    buzon = fakes.BuzonGraph()
+    servidores = [
+        await fakes.servir(
+            fakes.crear_filemaker(fakes.Latencia(args.fm_latencia_ms, args.fm_jitter_ms), args.usuarios_por_rol),
+            args.puerto_base + 1,
+        ),
+        await fakes.servir(
+            fakes.crear_graph(fakes.Latencia(args.graph_latencia_ms, args.graph_jitter_ms), buzon),
+            args.puerto_base + 2,
+        ),
+        await fakes.servir(
+            fakes.crear_openai(fakes.Latencia(args.openai_latencia_ms, args.openai_jitter_ms)),
+            args.puerto_base + 3,
+        ),
+    ]
+
+    usuarios = json.loads(fakes.FIXTURE_FM.read_text(encoding="utf-8"))["AuthUsuarios_dapi"]
+    telefonos_por_rol = {
+        u["ROL"]: [fakes.telefono_persona(u["Telefono"], i) for i in range(args.usuarios_por_rol)]
+        for u in usuarios
+    }
+
+    bot = await iniciar_bot(args)
+    resultados = []
+    try:
+        limites = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{args.puerto_base}", timeout=120.0, limits=limites,
+        ) as cliente:
+            for escenario in escenarios:
+                print(f"-> {escenario.nombre} ({args.rps} msg/s x {args.duracion} s)", file=sys.stderr)
+                resultados.append(
+                    await correr_escenario(escenario, cliente, buzon, telefonos_por_rol[escenario.rol], args)
+                )
+    finally:
+        bot.terminate()
+        bot.wait(timeout=30)
+        for servidor in servidores:
+            servidor.should_exit = True
+        await asyncio.sleep(0.2)
+
+    imprimir(resultados)
+    if args.json:
+        Path(args.json).write_text(
+            json.dumps([r.resumen() for r in resultados], ensure_ascii=False, indent=2), encoding="utf-8",
+        )
+    return 0 if all(r.errores == 0 and r.sin_respuesta == 0 for r in resultados) else 1
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Bench de carga offline del bot")
+    parser.add_argument("--escenario", action="append", help="Escenario a correr (repetible; por defecto todos)")
+    parser.add_argument("--rps", type=float, default=5.0, help="Webhooks por segundo por escenario")
+    parser.add_argument("--duracion", type=float, default=20.0, help="Segundos de carga por escenario")
+    parser.add_argument("--usuarios-por-rol", type=int, default=20, help="Telefonos distintos por rol")
+    parser.add_argument("--workers", type=int, default=1, help="Workers de uvicorn del bot")
+    parser.add_argument("--puerto-base", type=int, default=18000, help="Bot en este puerto; FM, Graph y OpenAI en los 3 siguientes")
+    parser.add_argument("--redis-url", default=os.environ.get("BENCH_REDIS_URL", "redis://localhost:6379/15"))
+    parser.add_argument("--timeout-respuesta", type=float, default=30.0, help="Segundos maximos hasta la primera respuesta")
+    parser.add_argument("--pausa-usuario", type=float, default=1.0, help="Segundos antes de reutilizar un telefono")
+    parser.add_argument("--fm-latencia-ms", type=float, default=80.0)
+    parser.add_argument("--fm-jitter-ms", type=float, default=40.0)
+    parser.add_argument("--graph-latencia-ms", type=float, default=60.0)
+    parser.add_argument("--graph-jitter-ms", type=float, default=30.0)
+    parser.add_argument("--openai-latencia-ms", type=float, default=700.0)
+    parser.add_argument("--openai-jitter-ms", type=float, default=400.0)
+    parser.add_argument("--json", help="Guardar el resumen por escenario en este archivo")
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(_parser().parse_args())))
@@ -1,21 +1,40 @@
+import hmac
 import logging
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request, Response, BackgroundTasks, HTTPException, Depends
 from fastapi.responses import JSONResponse
 
+from app import metrics
 from app.config import get_settings, validate
-from app.logging_config import setup_logging
+from app.logging_config import setup_logging, detener_logging
 from app.schemas import WSPPayload
 from app.auth.service import AuthService
 from app.services.whatsapp import WhatsAppService
+from app.services.filemaker import FileMakerService
 from app.services import redis as redis_svc
 from app.services import http as http_svc
+from app.services import cache
+from app.services import warmup
+from app.services import whatsapp_dispatcher
+from app.services import notificaciones_enfermeria
+from app.services import recados_outbox
+from app.services import ultimo_valido
+from app.utils import circuit_breaker
+from app.utils import deadline
+from app.utils import latencia
+from app.utils import retry
+from app.utils import tracing
+from app.services import rate_limit
+from app.formatters import cache_render
+from app.formatters.recados import RecadosFormatter
 from app.middleware import verify_signature, SecurityHeadersMiddleware
-from app.exceptions import ServicioNoDisponibleError
+from app.exceptions import ServicioNoDisponibleError, DeadlineExcedido
 from app.workflows import doctor, manager, hybrid
 from app.workflows.role_registry import get_workflow_handler
 from app.workflows import session_timer
+from app.workflows import prefetch
+from app.workflows.llm import recorder
 
 logger = logging.getLogger(__name__)
 
@@ -27,19 +46,40 @@ TIPOS_MENSAJE_SOPORTADOS = {"text", "interactive", "button"}
 async def lifespan(app: FastAPI):
     # --- Startup ---
     settings = get_settings()
-    setup_logging(settings.LOG_LEVEL, settings.ENVIRONMENT)
+    setup_logging(settings.LOG_LEVEL, settings.ENVIRONMENT, settings.LOG_PAYLOAD_SAMPLE_RATE)
     logger.info("Iniciando Bot Clinica SkinMed")
     validate()
     await redis_svc.init(settings.REDIS_URL)
     await http_svc.init()
+    await cache.start()
+    await circuit_breaker.start()
+    await whatsapp_dispatcher.start()
+    await notificaciones_enfermeria.start()
+    await recados_outbox.start()
+    await session_timer.start()
+    await AuthService.start()
+    # Warm-up en segundo plano: /health/ready responde 503 hasta que termine
+    await tracing.start()
+    await warmup.start()
     logger.info("Servicios inicializados correctamente")
 
     yield
 
     # --- Shutdown ---
+    await warmup.stop()
+    await tracing.stop()
+    await AuthService.stop()
+    await session_timer.stop()
+    await recados_outbox.stop()
+    await notificaciones_enfermeria.stop()
+    await whatsapp_dispatcher.stop()
+    await circuit_breaker.stop()
+    await cache.stop()
     await http_svc.close()
     await redis_svc.close()
+    recorder.detener()
     logger.info("Servicios cerrados correctamente")
+    detener_logging()
 
 
 def create_app() -> FastAPI:
@@ -91,6 +131,12 @@ async def readiness_check():
     """Readiness check profundo: verifica conectividad con todos los servicios."""
     estado = {"status": "ok", "servicios": {}}
 
+    # Mientras el warm-up no termine, el servicio no recibe trafico
+    estado["warmup"] = warmup.get_info()
+    if not warmup.esta_listo():
+        estado["status"] = "warming_up"
+        return JSONResponse(content=estado, status_code=503)
+
     # Check Redis
     try:
         await redis_svc.get("health:ping")
@@ -99,27 +145,87 @@ async def readiness_check():
         estado["servicios"]["redis"] = f"error: {e}"
         estado["status"] = "degraded"
 
-    # Check HTTP Client
-    try:
-        http_svc.get_client()
-        estado["servicios"]["http_client"] = "ok"
-    except RuntimeError:
-        estado["servicios"]["http_client"] = "error: no inicializado"
-        estado["status"] = "degraded"
+    # Check HTTP Clients (un pool por upstream)
+    for nombre in (http_svc.FM, http_svc.META, http_svc.OPENAI):
+        try:
+            http_svc.get_client(nombre)
+            estado["servicios"][f"http_{nombre}"] = "ok"
+        except RuntimeError:
+            estado["servicios"][f"http_{nombre}"] = "error: no inicializado"
+            estado["status"] = "degraded"
+    estado["http_pools"] = http_svc.get_stats()
 
     # Check FileMaker (intenta obtener token)
     try:
-        from app.services.filemaker import FileMakerService
         token = await FileMakerService.get_token()
         estado["servicios"]["filemaker"] = "ok" if token else "error: sin token"
     except Exception as e:
         estado["servicios"]["filemaker"] = f"error: {e}"
         estado["status"] = "degraded"
 
+    # Metricas del timer de inactividad (informativo, no afecta el status)
+    try:
+        estado["session_timer"] = await session_timer.get_info()
+    except Exception as e:
+        estado["session_timer"] = f"error: {e}"
+
+    # Estadisticas del cache de dos niveles (informativo)
+    estado["cache"] = cache.get_stats()
+
+    # Cola de mensajes salientes de WhatsApp (informativo)
+    estado["whatsapp_dispatcher"] = whatsapp_dispatcher.get_stats()
+
+    # Recados pendientes de escribir en FileMaker (informativo)
+    try:
+        estado["recados_outbox"] = await recados_outbox.get_stats()
+    except Exception as e:
+        estado["recados_outbox"] = f"error: {e}"
+
+    # Latencias observadas y timeouts adaptativos por upstream (informativo)
+    estado["latencias"] = latencia.get_stats()
+    estado["reintentos"] = retry.get_stats()
+
+    # Hedging de lecturas a FileMaker (informativo)
+    estado["fm_hedging"] = FileMakerService.get_hedging_stats()
+
+    # Estado compartido de los circuit breakers (informativo)
+    estado["circuit_breakers"] = circuit_breaker.get_info()
+
+    # Respaldos servidos mientras FileMaker no responde (informativo)
+    estado["ultimo_valido"] = ultimo_valido.get_stats()
+
+    # Turnos trazados y exportacion OTLP (informativo)
+    estado["tracing"] = tracing.get_stats()
+
+    # Mensajes renderizados reutilizados por firma de registros (informativo)
+    estado["render_cache"] = cache_render.get_stats()
+    estado["recados_parseo"] = RecadosFormatter.get_stats_parseo()
+
+    # Prefetch al inicio de sesion (informativo)
+    estado["prefetch"] = prefetch.get_stats()
+
     status_code = 200 if estado["status"] == "ok" else 503
     return JSONResponse(content=estado, status_code=status_code)
 
 
+# --- Metricas ---
+
+
+@app.get("/metrics")
+async def metrics_endpoint(request: Request):
+    """Metricas Prometheus. Requiere 'Authorization: Bearer <METRICS_TOKEN>'; sin token configurado no existe."""
+    settings = get_settings()
+    if not settings.METRICS_TOKEN:
+        raise HTTPException(status_code=404)
+
+    autorizacion = request.headers.get("authorization", "")
+    if not hmac.compare_digest(autorizacion.encode(), f"Bearer {settings.METRICS_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Token de metricas invalido")
+
+    await metrics.actualizar_gauges()
+    return Response(content=metrics.exportar(), media_type=metrics.CONTENT_TYPE)
+
+
 # --- Webhook ---
 
 
@@ -141,22 +247,24 @@ async def _process_message(msg, background_tasks: BackgroundTasks):
     settings = get_settings()
     sender_phone = msg.sender_phone
 
+    # Plazo total del turno, respetado por todas las llamadas aguas abajo
+    token_deadline = deadline.iniciar(settings.TURN_DEADLINE_SECONDS)
+    tracing.anotar(phone=sender_phone, tipo=msg.type)
     try:
-        # Rate limiting
-        permitido = await redis_svc.verificar_rate_limit(
-            f"ratelimit:{sender_phone}",
-            limite=settings.RATE_LIMIT_MAX,
-            ventana_ttl=settings.RATE_LIMIT_WINDOW,
-        )
-        if not permitido:
-            logger.warning("Rate limit excedido para %s", sender_phone)
+        # Rate limiting global (antes de autenticar, para descartar floods
+        # sin tocar FileMaker ni OpenAI)
+        with tracing.span("rate_limit.global", fase="estado"):
+            cuota = await rate_limit.verificar(sender_phone, rate_limit.RUTA_GLOBAL)
+        if not cuota.permitido:
             return
 
         # Autenticacion
-        user = await AuthService.get_user_by_phone(sender_phone)
+        with tracing.span("auth", fase="auth"):
+            user = await AuthService.get_user_by_phone(sender_phone)
         if not user:
             logger.warning("[MAIN] Usuario no encontrado para phone=%s", sender_phone)
             return
+        tracing.anotar(rol=user.role)
 
         logger.info("[MAIN] Usuario autenticado: phone=%s, role=%s, name=%s", sender_phone, user.role, user.name)
 
@@ -182,9 +290,21 @@ async def _process_message(msg, background_tasks: BackgroundTasks):
             )
             return
 
+        # Rate limiting por rol y ruta (texto -> LLM, botones)
+        ruta = rate_limit.RUTA_TEXTO if msg.type == "text" else rate_limit.RUTA_BOTON
+        with tracing.span(f"rate_limit.{ruta}", fase="estado"):
+            cuota = await rate_limit.verificar(sender_phone, ruta, user.role)
+        if not cuota.permitido:
+            return
+
         # Registrar actividad y programar timeout de inactividad
-        await session_timer.touch(sender_phone)
-        session_timer.schedule_timeout(sender_phone)
+        with tracing.span("sesion", fase="estado"):
+            sesion_nueva = await session_timer.touch(sender_phone)
+            await session_timer.schedule_timeout(sender_phone)
+
+        # Primer mensaje tras inactividad: precargar lo que probablemente pida
+        if sesion_nueva:
+            background_tasks.add_task(prefetch.ejecutar, handler, user, sender_phone)
 
         # Procesar segun tipo
         if msg.type == "text":
@@ -207,17 +327,30 @@ async def _process_message(msg, background_tasks: BackgroundTasks):
             logger.info("[MAIN] Boton recibido de %s: '%s'", sender_phone, btn_title)
             await handler.handle_button(user, sender_phone, btn_title, background_tasks)
 
+    except DeadlineExcedido as e:
+        logger.warning("Turno de %s cortado por deadline: %s", sender_phone, e)
+        try:
+            with deadline.sin_limite():
+                await WhatsAppService.send_message(
+                    sender_phone,
+                    "Lo sentimos, tu solicitud está tardando más de lo normal. Por favor intenta de nuevo."
+                )
+        except Exception:
+            pass
     except ServicioNoDisponibleError as e:
         logger.error("Servicio externo no disponible: %s", e)
         try:
-            await WhatsAppService.send_message(
-                sender_phone,
-                "Lo sentimos, el sistema no está disponible. Intenta de nuevo en unos minutos."
-            )
+            with deadline.sin_limite():
+                await WhatsAppService.send_message(
+                    sender_phone,
+                    "Lo sentimos, el sistema no está disponible. Intenta de nuevo en unos minutos."
+                )
         except Exception:
             pass
     except Exception as e:
         logger.exception("Error procesando mensaje de %s", sender_phone)
+    finally:
+        deadline.terminar(token_deadline)
 
 
 @app.post("/webhook")
@@ -226,26 +359,29 @@ async def webhook(
     background_tasks: BackgroundTasks = None,
 ):
     """Recibe y procesa mensajes del webhook de WhatsApp."""
-    try:
-        change = payload.entry[0].changes[0].value
+    # Cada POST es un turno: trace_id propio para los logs y spans de todo el procesamiento
+    with metrics.cronometro(metrics.WEBHOOK_LATENCIA), tracing.turno("webhook"):
+        try:
+            change = payload.entry[0].changes[0].value
 
-        if change.messages:
-            msg = change.messages[0]
+            if change.messages:
+                msg = change.messages[0]
 
-            # Idempotencia: verificar si ya procesamos este mensaje
-            msg_id = msg.id
-            ya_procesado = await redis_svc.get(f"msg:processed:{msg_id}")
-            if ya_procesado:
-                logger.debug("Mensaje %s ya procesado, ignorando", msg_id)
-                return {"status": "already_processed"}
+                # Idempotencia: verificar si ya procesamos este mensaje
+                msg_id = msg.id
+                ya_procesado = await redis_svc.get(f"msg:processed:{msg_id}")
+                if ya_procesado:
+                    logger.debug("Mensaje %s ya procesado, ignorando", msg_id)
+                    metrics.IDEMPOTENCIA_DESCARTES.labels(origen="webhook").inc()
+                    return {"status": "already_processed"}
 
-            # Marcar como procesado (TTL 1 hora)
-            await redis_svc.set(f"msg:processed:{msg_id}", "1", ttl=3600)
+                # Marcar como procesado (TTL 1 hora)
+                await redis_svc.set(f"msg:processed:{msg_id}", "1", ttl=3600)
 
-            # Procesar mensaje en background para responder rapido
-            await _process_message(msg, background_tasks)
+                # Procesar mensaje en background para responder rapido
+                await _process_message(msg, background_tasks)
 
-    except Exception as e:
-        logger.exception("Error en webhook")
+        except Exception as e:
+            logger.exception("Error en webhook")
 
     return {"status": "ok"}
@@ -0,0 +1,46 @@
+"""
+Script de administración: re-encola los recados del dead-letter.
+
+Los recados que agotaron sus intentos de creación en FileMaker quedan en
+la lista Redis recados:outbox:dead. Una vez resuelto el problema (FileMaker
+caído, layout mal configurado, etc.), este script los devuelve al outbox
+para que el worker los vuelva a procesar. El chequeo de idempotencia evita
+duplicar los que sí alcanzaron a crearse.
+
+Uso:
+    python replay_recados.py            # re-encola todos
+    python replay_recados.py --listar   # solo muestra el dead-letter
+"""
+import asyncio
+import json
+import os
+import sys
+
+# Asegurar que el directorio raiz está en el path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.config import get_settings
+from app.services import redis as redis_svc
+from app.services import recados_outbox
+
+
+async def main(listar: bool) -> int:
+    await redis_svc.init(get_settings().REDIS_URL)
+    try:
+        if listar:
+            crudos = await redis_svc.lrange(recados_outbox._DEAD_LETTER_KEY, 0, -1)
+            for raw in crudos:
+                recado = json.loads(raw)
+                print(f"{recado['idempotency_key']}  doctor={recado['doctor_id']}  error={recado.get('error')}")
+            print(f"Total en dead-letter: {len(crudos)}")
+            return 0
+
+        total = await recados_outbox.reprocesar_dead_letters()
+        print(f"Recados re-encolados: {total}")
+        return 0
+    finally:
+        await redis_svc.close()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(listar="--listar" in sys.argv[1:])))